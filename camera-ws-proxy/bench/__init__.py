@@ -0,0 +1 @@
+"""Load and latency benchmarks for the camera proxy, run against a synthetic camera"""
@@ -0,0 +1,218 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .fake_camera import FakeCamera
+from .load import (ViewerResult, cpu_usage, hls_viewer, ll_hls_viewer, percentile, sample_resources,
+                   websocket_viewer)
+from .proxy import CAMERA_ID, add_camera_arguments
+
+logger = logging.getLogger("bench")
+
+
+def summarize(values: List[float]) -> Optional[Dict[str, float]]:
+    if not values:
+        return None
+    return {
+        "p50": percentile(values, 0.50),
+        "p90": percentile(values, 0.90),
+        "p99": percentile(values, 0.99),
+        "max": max(values),
+    }
+
+
+async def wait_until_up(client: httpx.AsyncClient, proxy: Optional[asyncio.subprocess.Process],
+                        proxy_port: int, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        if proxy is not None and proxy.returncode is not None:
+            raise RuntimeError(f"Proxy exited with code {proxy.returncode}, is port {proxy_port} in use?")
+        try:
+            if (await client.get("/cameras")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError("Proxy did not come up")
+        await asyncio.sleep(0.2)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    camera = None
+    proxy = None
+    base_url = args.url
+    if base_url is None:
+        camera = FakeCamera(args.width, args.height, args.framerate, args.bitrate, args.camera_file)
+        camera_port = await camera.start()
+        base_url = f"http://127.0.0.1:{args.port}"
+        proxy_args = [
+            sys.executable, "-m", "bench.proxy",
+            "--camera-port", str(camera_port),
+            "--port", str(args.port),
+            "--format", args.format,
+            "--width", str(args.width),
+            "--height", str(args.height),
+            "--framerate", str(args.framerate),
+            "--max-transcoders", str(args.max_transcoders),
+        ]
+        if args.passthrough:
+            proxy_args.append("--passthrough")
+        if args.low_latency_hls:
+            proxy_args.append("--low-latency-hls")
+        # Async so the fake camera, which shares this loop, keeps streaming while the proxy runs and stops
+        proxy = await asyncio.create_subprocess_exec(*proxy_args, cwd=Path(__file__).resolve().parent.parent)
+    pid = proxy.pid if proxy else args.pid
+    camera_id = args.camera if args.url else CAMERA_ID
+
+    limits = httpx.Limits(max_connections=args.viewers + 10)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+            await wait_until_up(client, proxy, args.port)
+            resources: Dict[str, Any] = {}
+            if pid:
+                idle_start = sample_resources(pid)
+                await asyncio.sleep(args.settle)
+                idle_end = sample_resources(pid)
+                resources["idle"] = {"cpu": cpu_usage(idle_start, idle_end), "rss": idle_end.rss_bytes}
+
+            stop = asyncio.Event()
+            results = [ViewerResult() for _ in range(args.viewers)]
+            ws_url = base_url.replace("http", "ws", 1) + f"/stream/{camera_id}"
+            playlist_url = f"{base_url}/streams/{camera_id}/index.m3u8"
+            if args.protocol == "hls":
+                started = await client.post(f"/cameras/{camera_id}/hls/start")
+                logger.info(f"HLS start: {started.json()}")
+
+            def launch(result: ViewerResult) -> asyncio.Task:
+                if args.protocol == "ws":
+                    return asyncio.create_task(websocket_viewer(ws_url, stop, result))
+                if args.low_latency_hls:
+                    return asyncio.create_task(ll_hls_viewer(client, playlist_url, stop, result))
+                return asyncio.create_task(hls_viewer(client, playlist_url, stop, result))
+
+            # The first viewer alone shows what the stream itself costs
+            tasks = [launch(results[0])]
+            await asyncio.sleep(args.settle)
+            if pid:
+                one_start = sample_resources(pid)
+                await asyncio.sleep(args.settle)
+                one_end = sample_resources(pid)
+                resources["one_viewer"] = {"cpu": cpu_usage(one_start, one_end), "rss": one_end.rss_bytes}
+
+            logger.info(f"Ramping up to {args.viewers} viewers over {args.ramp}s")
+            for result in results[1:]:
+                tasks.append(launch(result))
+                await asyncio.sleep(args.ramp / max(args.viewers - 1, 1))
+            await asyncio.sleep(args.settle)
+
+            # Only the steady-state window counts toward throughput and latency
+            for result in results:
+                result.bytes = 0
+                result.messages = 0
+                result.latencies = []
+                result.reloads = []
+            window_start = sample_resources(pid) if pid else None
+            started_at = time.monotonic()
+            logger.info(f"Measuring for {args.duration}s")
+            await asyncio.sleep(args.duration)
+            elapsed = time.monotonic() - started_at
+            if pid:
+                window_end = sample_resources(pid)
+                resources["all_viewers"] = {"cpu": cpu_usage(window_start, window_end), "rss": window_end.rss_bytes}
+            stop.set()
+            await asyncio.gather(*tasks)
+    finally:
+        if proxy:
+            if proxy.returncode is None:
+                proxy.terminate()
+            try:
+                await asyncio.wait_for(proxy.wait(), timeout=15)
+            except asyncio.TimeoutError:
+                logger.warning("Proxy did not stop within 15s, killing it")
+                proxy.kill()
+                await proxy.wait()
+        if camera:
+            await camera.stop()
+
+    total_bytes = sum(result.bytes for result in results)
+    report: Dict[str, Any] = {
+        "protocol": args.protocol,
+        "format": args.format if args.protocol == "ws" else ("ll-hls" if args.low_latency_hls else "hls"),
+        "passthrough": args.passthrough,
+        "viewers": args.viewers,
+        "duration": elapsed,
+        "errors": [result.error for result in results if result.error],
+        "throughput_bps": total_bytes * 8 / elapsed,
+        "per_viewer_bps": total_bytes * 8 / elapsed / args.viewers,
+        "messages_per_second": sum(result.messages for result in results) / elapsed,
+        "time_to_first_frame": summarize([result.first_frame for result in results if result.first_frame is not None]),
+        "latency": summarize([latency for result in results for latency in result.latencies]),
+        "playlist_reload": summarize([reload for result in results for reload in result.reloads]),
+        "resources": resources,
+    }
+    if "one_viewer" in resources and args.viewers > 1:
+        # Cost of each viewer beyond the first, which already paid for the encoder
+        report["cpu_per_viewer"] = (resources["all_viewers"]["cpu"] - resources["one_viewer"]["cpu"]) / (args.viewers - 1)
+        report["rss_per_viewer"] = (resources["all_viewers"]["rss"] - resources["one_viewer"]["rss"]) / (args.viewers - 1)
+    return report
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    def ms(stats: Optional[Dict[str, float]]) -> str:
+        if stats is None:
+            return "n/a"
+        return "  ".join(f"{key} {value * 1000:.0f}ms" for key, value in stats.items())
+
+    print(f"\n{report['viewers']} {report['protocol']} viewers ({report['format']}"
+          f"{', passthrough' if report['passthrough'] else ''}) over {report['duration']:.1f}s")
+    print(f"  throughput      {report['throughput_bps'] / 1e6:.2f} Mbit/s total, "
+          f"{report['per_viewer_bps'] / 1e6:.3f} Mbit/s per viewer, {report['messages_per_second']:.0f} msg/s")
+    print(f"  first frame     {ms(report['time_to_first_frame'])}")
+    latency = ms(report["latency"]) if report["latency"] else "n/a (no timestamps arrived; re-encoded streams drop them)"
+    print(f"  glass-to-glass  {latency}")
+    if report["playlist_reload"]:
+        print(f"  playlist reload {ms(report['playlist_reload'])}")
+    for phase, usage in report["resources"].items():
+        print(f"  {phase:<15} cpu {usage['cpu'] * 100:.1f}%  rss {usage['rss'] / 2**20:.1f} MiB")
+    if "cpu_per_viewer" in report:
+        print(f"  per viewer      cpu {report['cpu_per_viewer'] * 100:.3f}%  rss {report['rss_per_viewer'] / 2**10:.1f} KiB")
+    print(f"  errors          {len(report['errors'])}")
+    for error in sorted(set(report["errors"]))[:5]:
+        print(f"    {error}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Drive the proxy with simulated viewers and report throughput, latency and cost per viewer"
+    )
+    parser.add_argument("--protocol", choices=["ws", "hls"], default="ws")
+    parser.add_argument("--viewers", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds measured once all viewers are on")
+    parser.add_argument("--ramp", type=float, default=10.0, help="Seconds over which viewers connect")
+    parser.add_argument("--settle", type=float, default=5.0, help="Seconds to let each phase settle")
+    parser.add_argument("--bitrate", default="4M", help="Fake camera bitrate")
+    parser.add_argument("--camera-file", type=Path, help="Loop a recorded .h264 file instead of a test pattern")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the proxy started by the benchmark")
+    parser.add_argument("--url", help="Benchmark an already running proxy instead of starting one")
+    parser.add_argument("--camera", default=CAMERA_ID, help="Camera to watch with --url")
+    parser.add_argument("--pid", type=int, help="Process to measure CPU and memory of with --url")
+    parser.add_argument("--json", type=Path, help="Also write the report here, e.g. to compare runs")
+    add_camera_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
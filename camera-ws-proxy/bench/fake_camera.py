@@ -0,0 +1,177 @@
+import argparse
+import asyncio
+import logging
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from src.h264 import AccessUnit, AccessUnitParser
+
+logger = logging.getLogger(__name__)
+
+# 16 bytes with no zero byte, so the SEI never needs emulation prevention
+TIMESTAMP_UUID = b"camproxy-bench!!"
+# An access unit delimiter that flushes the last access unit out of the parser
+FLUSH = b"\x00\x00\x00\x01\x09\xf0\x00"
+
+
+def timestamp_sei(micros: int) -> bytes:
+    """A user_data_unregistered SEI NAL unit carrying a wall-clock time in microseconds as ASCII digits"""
+    payload = TIMESTAMP_UUID + b"%016d" % micros
+    return b"\x00\x00\x00\x01\x06\x05" + bytes([len(payload)]) + payload + b"\x80"
+
+
+def find_timestamps(data: bytes) -> List[int]:
+    """Every frame timestamp embedded by a FakeCamera in a chunk of any container"""
+    stamps = []
+    pos = data.find(TIMESTAMP_UUID)
+    while pos != -1:
+        digits = data[pos + 16:pos + 32]
+        if len(digits) == 16 and digits.isdigit():
+            stamps.append(int(digits))
+        pos = data.find(TIMESTAMP_UUID, pos + 16)
+    return stamps
+
+
+class FakeCamera:
+    """TCP server that streams raw H.264 like libcamera-vid, for benchmarks.
+
+    Frames come from an FFmpeg test pattern or from a recorded .h264 file played
+    in a loop. Each access unit is prefixed with a timestamp SEI stamped as it is
+    sent, so viewers can measure glass-to-glass latency through any path that
+    does not re-encode. New connections start at the next keyframe.
+    """
+
+    def __init__(self, width: int = 1280, height: int = 720, framerate: int = 30, bitrate: str = "4M",
+                 source: Optional[Path] = None):
+        self.width = width
+        self.height = height
+        self.framerate = framerate
+        self.bitrate = bitrate
+        self.source = source
+        self.frames_sent = 0
+        self._clients: List[asyncio.StreamWriter] = []
+        self._waiting: List[asyncio.StreamWriter] = []  # Connected, but waiting for a keyframe
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._producer: Optional[asyncio.Task] = None
+        self._process: Optional[asyncio.subprocess.Process] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """Start serving and return the bound port"""
+        self._server = await asyncio.start_server(self._accept, host, port)
+        self._producer = asyncio.create_task(self._produce())
+        port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Fake camera listening on {host}:{port}")
+        return port
+
+    async def stop(self) -> None:
+        if self._producer:
+            self._producer.cancel()
+            try:
+                await self._producer
+            except asyncio.CancelledError:
+                pass
+        if self._process and self._process.returncode is None:
+            self._process.kill()
+            await self._process.wait()
+        for writer in self._clients + self._waiting:
+            writer.close()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        logger.info(f"Fake camera client connected from {writer.get_extra_info('peername')}")
+        self._waiting.append(writer)
+
+    def _send(self, unit: AccessUnit) -> None:
+        if unit.keyframe:
+            self._clients.extend(self._waiting)
+            self._waiting.clear()
+        data = timestamp_sei(time.time_ns() // 1000) + unit.data
+        for writer in list(self._clients):
+            if writer.is_closing():
+                self._clients.remove(writer)
+                continue
+            # A real camera would block; dropping keeps one slow client from pacing the rest
+            if writer.transport.get_write_buffer_size() < 4 * 1024 * 1024:
+                writer.write(data)
+        self.frames_sent += 1
+
+    async def _produce(self) -> None:
+        if self.source:
+            await self._replay(self.source)
+        else:
+            await self._generate()
+
+    async def _replay(self, path: Path) -> None:
+        """Loop a recorded elementary stream at the configured frame rate"""
+        units = AccessUnitParser().feed(memoryview(path.read_bytes() + FLUSH))
+        if not any(unit.keyframe for unit in units):
+            raise ValueError(f"{path} contains no IDR frame")
+        loop = asyncio.get_running_loop()
+        next_frame = loop.time()
+        while True:
+            for unit in units:
+                self._send(unit)
+                next_frame += 1 / self.framerate
+                await asyncio.sleep(max(0.0, next_frame - loop.time()))
+
+    async def _generate(self) -> None:
+        """Encode a moving test pattern in real time, repeating SPS/PPS on every keyframe like `--inline`"""
+        cmd = [
+            "ffmpeg",
+            "-nostats",
+            "-loglevel", "error",
+            "-re",
+            "-f", "lavfi",
+            "-i", f"testsrc2=size={self.width}x{self.height}:rate={self.framerate}",
+            "-c:v", "libx264",
+            "-preset", "ultrafast",
+            "-tune", "zerolatency",
+            "-bf", "0",
+            "-g", str(self.framerate),
+            "-pix_fmt", "yuv420p",
+            "-b:v", self.bitrate,
+            "-x264-params", "repeat-headers=1",
+            "-f", "h264",
+            "pipe:1"
+        ]
+        self._process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE)
+        parser = AccessUnitParser()
+        while True:
+            data = await self._process.stdout.read(65536)
+            if not data:
+                raise RuntimeError(f"Test pattern encoder exited with code {await self._process.wait()}")
+            for unit in parser.feed(memoryview(data)):
+                self._send(unit)
+
+
+async def serve(args: argparse.Namespace) -> None:
+    camera = FakeCamera(args.width, args.height, args.framerate, args.bitrate, args.file)
+    await camera.start(args.host, args.port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await camera.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve a synthetic H.264 camera stream over TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--framerate", type=int, default=30)
+    parser.add_argument("--bitrate", default="4M")
+    parser.add_argument("--file", type=Path, help="Loop a recorded .h264 file instead of a test pattern")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import urljoin
+
+import httpx
+import websockets
+
+from .fake_camera import find_timestamps
+
+logger = logging.getLogger(__name__)
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+SEGMENT_URI = re.compile(r"#EXTINF:[^\n]*\n([^#\n][^\n]*)")
+VARIANT_URI = re.compile(r"#EXT-X-STREAM-INF:[^\n]*\n([^#\n][^\n]*)")
+PRELOAD_HINT = re.compile(r'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="(part_(\d+)_(\d+)\.m4s)"')
+
+
+class ViewerResult:
+    """What one simulated viewer saw"""
+
+    def __init__(self):
+        self.connected_at: Optional[float] = None
+        self.first_frame: Optional[float] = None  # Seconds from connecting to the first media
+        self.bytes = 0
+        self.messages = 0
+        self.latencies: List[float] = []  # Glass-to-glass seconds, one per timestamped frame
+        self.reloads: List[float] = []  # Seconds each LL-HLS blocking playlist reload was held by the server
+        self.error: Optional[str] = None
+
+    def received(self, data: bytes) -> None:
+        now = time.time()
+        if self.first_frame is None:
+            self.first_frame = now - self.connected_at
+        self.bytes += len(data)
+        self.messages += 1
+        self.latencies.extend(now - stamp / 1_000_000 for stamp in find_timestamps(data))
+
+
+async def websocket_viewer(url: str, stop: asyncio.Event, result: ViewerResult) -> None:
+    """Read the WebSocket stream until told to stop"""
+    result.connected_at = time.time()
+    try:
+        async with websockets.connect(url, max_size=None, open_timeout=30) as websocket:
+            while not stop.is_set():
+                try:
+                    data = await asyncio.wait_for(websocket.recv(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    continue
+                result.received(data if isinstance(data, bytes) else data.encode())
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+
+
+async def hls_viewer(client: httpx.AsyncClient, playlist_url: str, stop: asyncio.Event, result: ViewerResult) -> None:
+    """Poll a playlist like a player and download each new segment once.
+
+    A master playlist is followed to its first variant. Latency is measured to the
+    newest frame of each segment, which is how far behind live a player is once it
+    has that segment.
+    """
+    result.connected_at = time.time()
+    seen = set()
+    try:
+        while not stop.is_set():
+            response = await client.get(playlist_url)
+            if response.status_code == 200:
+                variant = VARIANT_URI.search(response.text)
+                if variant:
+                    playlist_url = urljoin(playlist_url, variant.group(1).strip())
+                    continue
+                for uri in SEGMENT_URI.findall(response.text):
+                    uri = uri.strip()
+                    if uri in seen:
+                        continue
+                    seen.add(uri)
+                    segment = await client.get(urljoin(playlist_url, uri))
+                    if segment.status_code == 200:
+                        now = time.time()
+                        if result.first_frame is None:
+                            result.first_frame = now - result.connected_at
+                        result.bytes += len(segment.content)
+                        result.messages += 1
+                        stamps = find_timestamps(segment.content)
+                        if stamps:
+                            result.latencies.append(now - max(stamps) / 1_000_000)
+            await asyncio.sleep(0.25)
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+
+
+async def ll_hls_viewer(client: httpx.AsyncClient, playlist_url: str, stop: asyncio.Event, result: ViewerResult) -> None:
+    """Follow an LL-HLS playlist part by part, like a low-latency player.
+
+    Each round fetches the part named by the preload hint while a blocking playlist
+    reload (`_HLS_msn`/`_HLS_part`) waits for that same part, so both are held by the
+    server until the part exists. Latency is measured to the newest frame of each part.
+    """
+    result.connected_at = time.time()
+    try:
+        response = await client.get(playlist_url)
+        while not stop.is_set():
+            hint = PRELOAD_HINT.search(response.text) if response.status_code == 200 else None
+            if hint is None:
+                await asyncio.sleep(0.25)
+                response = await client.get(playlist_url)
+                continue
+            uri, msn, part = hint.group(1), hint.group(2), hint.group(3)
+            requested = time.monotonic()
+            segment, response = await asyncio.gather(
+                client.get(urljoin(playlist_url, uri)),
+                client.get(playlist_url, params={"_HLS_msn": msn, "_HLS_part": part}),
+            )
+            if response.status_code == 200:
+                result.reloads.append(time.monotonic() - requested)
+            # A hinted part the segment closed before is gone; the reloaded playlist hints the next one
+            if segment.status_code == 200:
+                now = time.time()
+                if result.first_frame is None:
+                    result.first_frame = now - result.connected_at
+                result.bytes += len(segment.content)
+                result.messages += 1
+                stamps = find_timestamps(segment.content)
+                if stamps:
+                    result.latencies.append(now - max(stamps) / 1_000_000)
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+
+
+class ResourceSample(NamedTuple):
+    time: float
+    cpu_seconds: float  # User plus system time of the process tree
+    rss_bytes: int
+
+
+def _descendants(pid: int) -> List[int]:
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                ppid = int(stat.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+def sample_resources(pid: int) -> ResourceSample:
+    """CPU time and resident memory of a process and all its children, e.g. the proxy and its FFmpegs"""
+    cpu = 0.0
+    rss = 0
+    for member in _descendants(pid):
+        try:
+            with open(f"/proc/{member}/stat") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue  # Exited while we looked
+        cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        rss += int(fields[21]) * PAGE_SIZE
+    return ResourceSample(time.monotonic(), cpu, rss)
+
+
+def cpu_usage(start: ResourceSample, end: ResourceSample) -> float:
+    """Cores used between two samples"""
+    return (end.cpu_seconds - start.cpu_seconds) / max(end.time - start.time, 1e-9)
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
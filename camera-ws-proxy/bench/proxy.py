@@ -0,0 +1,56 @@
+import argparse
+import logging
+
+import uvicorn
+
+from src.config import CameraConfig, Config
+from src.server import CameraServer
+
+CAMERA_ID = "bench"
+
+
+def bench_config(args: argparse.Namespace) -> Config:
+    """A single camera pointing at the fake camera, configured from the command line"""
+    return Config(
+        cameras={
+            CAMERA_ID: CameraConfig(
+                id=CAMERA_ID,
+                name="Benchmark Camera",
+                ip_address=args.camera_host,
+                port=args.camera_port,
+                resolution={"width": args.width, "height": args.height},
+                framerate=args.framerate,
+                passthrough=args.passthrough,
+                ws_format=args.format,
+                low_latency_hls=args.low_latency_hls,
+            )
+        },
+        max_transcoders=args.max_transcoders,
+    )
+
+
+def add_camera_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--format", choices=["mpeg1", "h264", "fmp4"], default="h264", help="WebSocket format")
+    parser.add_argument("--passthrough", action="store_true", help="Remux HLS instead of re-encoding it")
+    parser.add_argument("--low-latency-hls", action="store_true")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--framerate", type=int, default=30)
+    parser.add_argument("--max-transcoders", type=int, default=8)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the proxy with a single camera for benchmarking")
+    parser.add_argument("--camera-host", default="127.0.0.1")
+    parser.add_argument("--camera-port", type=int, default=8888)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_camera_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    server = CameraServer(bench_config(args))
+    uvicorn.run(server.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
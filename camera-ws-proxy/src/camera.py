@@ -1,24 +1,191 @@
 import asyncio
 import logging
-from typing import AsyncGenerator, Optional
+from typing import AsyncGenerator, Callable, List, Optional, Union
 import socket
 from contextlib import asynccontextmanager
 
 from .config import CameraConfig
+from .h264 import AccessUnitTracker
 
 logger = logging.getLogger(__name__)
 
+READ_BUFFER_SIZE = 65536
+# An unreachable camera would otherwise hold its connect for the kernel's SYN retries, about two minutes
+CONNECT_TIMEOUT = 5.0
+
+
+class PipeSink:
+    """Feeds camera bytes into an encoder's stdin without letting a stuck encoder stall the camera"""
+
+    def __init__(self, name: str, writer: asyncio.StreamWriter, max_buffered: int = 4 * 1024 * 1024):
+        self.name = name
+        self._writer = writer
+        self.max_buffered = max_buffered
+        self.dropped_bytes = 0
+
+    @property
+    def closed(self) -> bool:
+        return self._writer.is_closing()
+
+    def write(self, data: memoryview) -> None:
+        """Queue data for the encoder; the transport copies anything it cannot write immediately"""
+        if self._writer.transport.get_write_buffer_size() > self.max_buffered:
+            if not self.dropped_bytes:
+                logger.warning(f"Encoder {self.name} is not keeping up, dropping input")
+            self.dropped_bytes += len(data)
+            return
+        self._writer.write(data)
+
+    def close(self) -> None:
+        if not self._writer.is_closing():
+            self._writer.close()
+
+
+class CallbackSink:
+    """Hands camera bytes to an in-process consumer; the buffer is only valid during the call"""
+
+    def __init__(self, name: str, callback: Callable[[memoryview], None]):
+        self.name = name
+        self._callback = callback
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def write(self, data: memoryview) -> None:
+        self._callback(data)
+
+    def close(self) -> None:
+        self._closed = True
+
+
+Sink = Union[PipeSink, CallbackSink]
+
+
 class CameraStream:
-    def __init__(self, config: CameraConfig):
+    """Single owner of the upstream TCP connection to a camera.
+
+    Encoders attach a PipeSink and receive the raw H.264 bytes through their stdin,
+    and in-process consumers attach a CallbackSink, so every consumer of a camera
+    shares one pull from the Pi. The connection is
+    opened when the first sink attaches, re-established with exponential backoff if
+    it drops or stalls for longer than `read_timeout`, and closed with the last sink.
+
+    libcamera-vid without `--inline` sends SPS and PPS only once, on connect, so the
+    latest ones are kept. A sink that attaches later gets them ahead of its first data,
+    which starts at the next access unit so its decoder begins on a picture boundary.
+    """
+
+    def __init__(self, config: CameraConfig, reconnect_min: float = 0.5, reconnect_max: float = 30.0):
         self.config = config
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
         self._socket = None
         self._connected = False
         self._loop = asyncio.get_event_loop()
+        self._sinks: List[Sink] = []
+        self._joining: List[Sink] = []  # Attached sinks waiting for the next access unit
+        self._pump_task: Optional[asyncio.Task] = None
+        self._tracker = AccessUnitTracker()
+        self.reconnects = 0
+        self.bytes_received = 0
 
     @property
     def is_connected(self) -> bool:
         return self._connected and self._socket is not None
 
+    @property
+    def sink_count(self) -> int:
+        return len(self._sinks)
+
+    def attach(self, sink: Sink) -> None:
+        """Start delivering camera data to a sink, connecting if this is the first one"""
+        self._sinks.append(sink)
+        if self.is_connected:
+            # Otherwise it gets the stream from its first byte
+            self._joining.append(sink)
+        logger.info(f"Attached {sink.name} to camera {self.config.id} ({self.sink_count} consumers)")
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = self._loop.create_task(self._pump())
+
+    async def detach(self, sink: Sink) -> None:
+        """Stop delivering to a sink, disconnecting once nothing is attached"""
+        if sink in self._joining:
+            self._joining.remove(sink)
+        if sink in self._sinks:
+            self._sinks.remove(sink)
+            logger.info(f"Detached {sink.name} from camera {self.config.id} ({self.sink_count} consumers)")
+        if not self._sinks:
+            await self.close()
+
+    async def close(self) -> None:
+        """Stop the read loop and drop the upstream connection"""
+        task, self._pump_task = self._pump_task, None
+        if task and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.disconnect()
+
+    def _join(self, data: memoryview) -> None:
+        """Start the waiting sinks on an access unit, with the parameter sets ahead of it"""
+        parameter_sets = self._tracker.parameter_sets
+        for sink in self._joining:
+            if parameter_sets:
+                sink.write(memoryview(parameter_sets))
+            sink.write(data)
+        self._joining.clear()
+
+    def _configure_socket(self, sock: socket.socket) -> None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # Linux-only knobs: notice a dead Pi within ~20s instead of the 2h default
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 10)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 5)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 2)
+        if self.config.recv_buffer_size:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.config.recv_buffer_size)
+
+    async def _pump(self) -> None:
+        """Read from the camera and fan out to every sink, reconnecting until cancelled"""
+        buffer = memoryview(bytearray(READ_BUFFER_SIZE))
+        delay = self.reconnect_min
+        while self._sinks:
+            try:
+                await self.connect()
+                delay = self.reconnect_min
+                self._tracker = AccessUnitTracker()  # A new connection starts a new stream
+                while self._sinks:
+                    nbytes = await asyncio.wait_for(self.read_into(buffer), timeout=self.config.read_timeout)
+                    self.bytes_received += nbytes
+                    data = buffer[:nbytes]
+                    self._tracker.feed(data)
+                    for sink in list(self._sinks):
+                        if sink.closed:
+                            self._sinks.remove(sink)
+                            if sink in self._joining:
+                                self._joining.remove(sink)
+                            continue
+                        if sink not in self._joining:
+                            sink.write(data)
+                    if self._joining and self._tracker.access_unit_start is not None:
+                        self._join(data[self._tracker.access_unit_start:])
+            except asyncio.TimeoutError:
+                logger.warning(f"Camera {self.config.id} sent nothing for {self.config.read_timeout}s, reconnecting")
+                await self.disconnect()
+            except ConnectionError as e:
+                logger.warning(f"Camera {self.config.id} connection lost: {e}")
+            if not self._sinks:
+                break
+            self.reconnects += 1
+            logger.info(f"Reconnecting to camera {self.config.id} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.reconnect_max)
+        await self.disconnect()
+
     async def connect(self) -> None:
         """Connect to the camera TCP stream"""
         if self.is_connected:
@@ -26,7 +193,12 @@ class CameraStream:
 
         try:
             self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            await self._loop.sock_connect(self._socket, (self.config.ip_address, self.config.port))
+            self._socket.setblocking(False)
+            self._configure_socket(self._socket)
+            await asyncio.wait_for(
+                self._loop.sock_connect(self._socket, (self.config.ip_address, self.config.port)),
+                CONNECT_TIMEOUT
+            )
             self._socket.setblocking(False)
             self._connected = True
             logger.info(f"Connected to camera {self.config.id} at {self.config.ip_address}:{self.config.port}")
@@ -35,16 +207,15 @@ class CameraStream:
                 self._socket.close()
             self._socket = None
             self._connected = False
-            logger.error(f"Failed to connect to camera: {str(e)}")
-            raise ConnectionError(f"Failed to connect to camera {self.config.id}: {str(e)}")
+            reason = str(e) or type(e).__name__  # A timeout has no message
+            logger.error(f"Failed to connect to camera: {reason}")
+            raise ConnectionError(f"Failed to connect to camera {self.config.id}: {reason}")
 
     async def disconnect(self) -> None:
         """Disconnect from the camera stream"""
-        logger.info("Disconnecting from camera")
         if self._socket:
             try:
                 self._socket.close()
-                logger.info("Camera disconnected successfully")
             except Exception as e:
                 logger.error(f"Error disconnecting from camera: {str(e)}")
             finally:
@@ -78,3 +249,20 @@ class CameraStream:
             logger.error(f"Error reading from camera: {str(e)}")
             await self.disconnect()
             raise ConnectionError(f"Error reading from camera stream: {str(e)}")
+
+    async def read_into(self, buffer: memoryview) -> int:
+        """Read from the camera stream straight into a caller-owned buffer, returning the byte count"""
+        if not self.is_connected:
+            logger.error("Attempted to read from disconnected camera")
+            raise ConnectionError("Not connected to camera stream")
+
+        try:
+            nbytes = await self._loop.sock_recv_into(self._socket, buffer)
+            if not nbytes:
+                logger.warning("Camera stream returned no data")
+                raise ConnectionError("Camera stream ended")
+            return nbytes
+        except Exception as e:
+            logger.error(f"Error reading from camera: {str(e)}")
+            await self.disconnect()
+            raise ConnectionError(f"Error reading from camera stream: {str(e)}")
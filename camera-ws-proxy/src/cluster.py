@@ -0,0 +1,201 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import websockets
+
+from .camera import CameraStream
+from .hub import Chunk, StreamHub
+
+logger = logging.getLogger(__name__)
+
+# First byte of every relay message
+RELAY_HEADER = 0  # Codec header to send ahead of the next GOP start
+RELAY_KEYFRAME = 1  # Chunk starting a GOP
+RELAY_CHUNK = 2
+REGISTRY_STALE_SECONDS = 10.0  # A registry entry not refreshed for this long describes a dead worker
+
+
+class Cluster:
+    """Coordinates the worker processes of one host through files in a shared directory.
+
+    Each camera is owned by exactly one worker at a time: the one holding an
+    exclusive flock on `{camera}.lock`. The lock is released by the kernel when its
+    worker dies, so any other worker can take over. Owners describe their cameras in
+    `{camera}.json` with the Unix socket their worker serves the app on, which other
+    workers use to relay streams and forward requests.
+
+    Workers are numbered the same way: each holds the lowest free `worker-{n}.lock`,
+    so a restarted worker takes its predecessor's number and its metrics keep their labels.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._locks: Dict[str, int] = {}  # File descriptors of the locks this worker holds
+        self.worker, self._worker_lock = self._claim_worker_number()
+        self.socket_path = self._socket_path(self.worker)
+
+    def _socket_path(self, worker: int) -> Path:
+        return self.directory / f"worker-{worker}.sock"
+
+    def _claim_worker_number(self) -> Tuple[int, int]:
+        worker = 0
+        while True:
+            fd = self._try_lock(self.directory / f"worker-{worker}.lock")
+            if fd is not None:
+                return worker, fd
+            worker += 1
+
+    @staticmethod
+    def _try_lock(path: Path) -> Optional[int]:
+        """An exclusively locked descriptor of `path`, or None if another live worker holds it"""
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def other_workers(self) -> List[Tuple[int, str]]:
+        """Number and socket of every other live worker"""
+        workers = []
+        for path in self.directory.glob("worker-*.lock"):
+            try:
+                worker = int(path.stem[len("worker-"):])
+            except ValueError:
+                continue
+            if worker == self.worker:
+                continue
+            fd = self._try_lock(path)
+            if fd is None:
+                workers.append((worker, str(self._socket_path(worker))))
+            else:
+                os.close(fd)  # Left by a worker that is gone
+        return sorted(workers)
+
+    def owns(self, camera_id: str) -> bool:
+        return camera_id in self._locks
+
+    def try_acquire(self, camera_id: str) -> bool:
+        """Become the owner of a camera unless another live worker is; True if this worker owns it"""
+        if camera_id in self._locks:
+            return True
+        fd = self._try_lock(self.directory / f"{camera_id}.lock")
+        if fd is None:
+            return False
+        self._locks[camera_id] = fd
+        logger.info(f"Worker {os.getpid()} now owns camera {camera_id}")
+        return True
+
+    def publish(self, camera_id: str, status: Dict[str, Any]) -> None:
+        """Describe an owned camera for the other workers; replaced atomically"""
+        entry = {"pid": os.getpid(), "socket": str(self.socket_path), "updated": time.time(), "status": status}
+        path = self.directory / f"{camera_id}.json"
+        temporary = path.with_suffix(f".{os.getpid()}.tmp")
+        temporary.write_text(json.dumps(entry))
+        os.replace(temporary, path)
+
+    def lookup(self, camera_id: str) -> Optional[Dict[str, Any]]:
+        """The registry entry of a camera's owner, or None if it has none that is alive"""
+        try:
+            entry = json.loads((self.directory / f"{camera_id}.json").read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+        if time.time() - entry["updated"] > REGISTRY_STALE_SECONDS:
+            return None
+        return entry
+
+    def owner_socket(self, camera_id: str) -> Optional[str]:
+        if self.owns(camera_id):
+            return str(self.socket_path)
+        entry = self.lookup(camera_id)
+        return entry["socket"] if entry else None
+
+    def release(self, camera_id: str) -> None:
+        """Stop owning a camera, e.g. one removed from the config"""
+        fd = self._locks.pop(camera_id, None)
+        if fd is None:
+            return
+        try:
+            (self.directory / f"{camera_id}.json").unlink()
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+    def close(self) -> None:
+        """Give up every camera so other workers can take over"""
+        for camera_id in list(self._locks):
+            self.release(camera_id)
+        try:
+            self.socket_path.unlink()
+        except FileNotFoundError:
+            pass
+        os.close(self._worker_lock)
+
+
+class RelayHub(StreamHub):
+    """Viewers in this worker of a camera another worker owns.
+
+    Instead of connecting to the camera, the hub subscribes to the owner's hub over
+    its Unix socket, receiving each chunk with its GOP-start flag and the codec
+    header, so local viewers join and resync exactly as they would at the owner.
+    If the owner goes away, `resolve` is asked again for whoever owns the camera now,
+    which may be this worker.
+    """
+
+    def __init__(self, camera: CameraStream, resolve: Callable[[], Optional[str]],
+                 reconnect_min: float = 0.5, reconnect_max: float = 10.0, **kwargs):
+        super().__init__(camera, **kwargs)
+        self.format = camera.config.ws_format
+        self.resolve = resolve
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
+        self._relay_header = b""
+        self._task: Optional[asyncio.Task] = None
+
+    async def _start(self) -> None:
+        self._task = asyncio.create_task(self._relay())
+
+    def _header(self) -> bytes:
+        return self._relay_header
+
+    async def _relay(self) -> None:
+        delay = self.reconnect_min
+        while True:
+            socket_path = self.resolve()
+            if socket_path is None:
+                logger.warning(f"No worker owns camera {self.config.id} yet")
+            else:
+                try:
+                    uri = f"ws://localhost/internal/relay/{self.config.id}"
+                    async with websockets.unix_connect(socket_path, uri, max_size=None) as upstream:
+                        logger.info(f"Relaying camera {self.config.id} from {socket_path}")
+                        self._relay_header = b""
+                        self._source_restarted()
+                        delay = self.reconnect_min
+                        async for message in upstream:
+                            kind = message[0]
+                            if kind == RELAY_HEADER:
+                                self._relay_header = message[1:]
+                            else:
+                                self._publish([Chunk(message[1:], kind == RELAY_KEYFRAME)])
+                except (OSError, websockets.WebSocketException) as e:
+                    logger.warning(f"Relay of camera {self.config.id} from {socket_path} failed: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.reconnect_max)
+
+    async def _stop(self) -> None:
+        task, self._task = self._task, None
+        if task and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
@@ -1,5 +1,79 @@
-from typing import Dict, Optional
-from pydantic import BaseModel, Field
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Literal, Optional, Set
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+try:
+    import yaml
+except ImportError:  # Only needed for YAML config files
+    yaml = None
+
+CONFIG_ENV = "CAMERA_PROXY_CONFIG"  # Path of the config file to load and watch
+# Camera fields applied to running streams as they are; any other change restarts the camera
+LIVE_CAMERA_FIELDS = {"name", "location", "motion", "recording", "snapshot"}
+MPEG1_FRAMERATES = {24, 25, 30, 50, 60}  # Integer frame rates MPEG-1 video can signal
+# Built in, and overridden by config entries of the same name
+DEFAULT_ENCODER_PROFILES: Dict[str, Dict[str, Any]] = {
+    "jsmpeg": {"width": 800, "height": 450, "bitrate": 500, "fallback": "jsmpeg-low"},
+    "jsmpeg-low": {"width": 480, "height": 270, "bitrate": 250},
+    "hls": {"fallback": "hls-low"},
+    "hls-low": {"height": 360, "framerate": 15, "bitrate": 600},
+}
+
+
+class HlsRendition(BaseModel):
+    name: str  # Used in the variant playlist and segment file names, e.g. "720p"
+    height: Optional[int] = None  # Scaled height, or the camera's native resolution if unset
+    bitrate: int  # kbit/s; encoder target, and the BANDWIDTH advertised in the master playlist
+
+
+class EncoderProfile(BaseModel):
+    """How a camera is encoded for one output; the codec is the output's own, MPEG-1 or H.264"""
+    # Scaled size; with only one of them set the other follows the aspect ratio, native if neither is
+    width: Optional[int] = None
+    height: Optional[int] = None
+    framerate: Optional[int] = None  # Frames per second encoded, the camera's if unset; MPEG-1 only allows 24, 25, 30, 50 or 60
+    bitrate: Optional[int] = None  # kbit/s target; libx264's default constant quality if unset
+    preset: str = "ultrafast"  # libx264 speed preset; slower ones compress better for more CPU
+    # Cheaper profile used instead while encoders need more CPU than the budget, unless the camera is high priority
+    fallback: Optional[str] = None
+
+
+class MotionZone(BaseModel):
+    # Fractions of the frame, so a mask still fits if the thumbnail size changes
+    x: float
+    y: float
+    width: float
+    height: float
+
+
+class MotionConfig(BaseModel):
+    enabled: bool = False
+    width: int = 160  # Grayscale thumbnail the detector compares
+    height: int = 90
+    fps: float = 4.0  # Thumbnails compared per second
+    keyframes_only: bool = False  # Decode only IDR frames: about one per GOP, but far cheaper to decode
+    pixel_threshold: int = 25  # Grey levels a pixel must change by to count, above sensor noise
+    threshold: float = 0.01  # Fraction of unmasked pixels that must change for a frame to show motion
+    min_frames: int = 2  # Consecutive frames with motion before an event starts, ignoring one-frame flicker
+    cooldown: float = 5.0  # Seconds without motion before an event ends
+    mask: List[MotionZone] = Field(default_factory=list)  # Areas to ignore, e.g. a swaying tree or a busy road
+
+
+class RecordingConfig(BaseModel):
+    enabled: bool = False
+    segment_bytes: int = 64 * 1024 * 1024  # Segment files are cut at the first keyframe past this size
+    max_bytes: Optional[int] = 10 * 1024 ** 3  # Oldest segments are deleted beyond this much footage
+    max_age: Optional[float] = None  # Seconds of footage kept, unlimited if unset
+
+
+class SnapshotConfig(BaseModel):
+    width: int = 320  # Thumbnail size; height follows the aspect ratio if unset
+    height: Optional[int] = None
+    quality: int = 5  # JPEG quantizer, 2 (best) to 31
+    refresh: float = 5.0  # Seconds a decoded JPEG is served before a newer keyframe is decoded
+    idle_timeout: float = 60.0  # Seconds without requests before the cached keyframe is dropped
 
 
 class CameraConfig(BaseModel):
@@ -11,10 +85,93 @@ class CameraConfig(BaseModel):
     resolution: Dict[str, int] = Field(default_factory=lambda: {"width": 1280, "height": 720})
     framerate: int = 30
     enabled: bool = True
+    recv_buffer_size: Optional[int] = None  # SO_RCVBUF for the upstream socket, OS default if unset
+    read_timeout: float = 5.0  # Seconds without data before the camera is treated as stalled
+    passthrough: bool = False  # Remux the camera's H.264 into HLS instead of re-encoding it
+    # WebSocket payload: MPEG-TS for JSMpeg, raw H.264 access units for WebCodecs or fMP4 fragments for MSE
+    ws_format: Literal["mpeg1", "h264", "fmp4"] = "mpeg1"
+    low_latency_hls: bool = False  # Serve LL-HLS parts from memory instead of HLS segments on disk
+    # ABR renditions encoded by one FFmpeg behind a master playlist; a single rendition if empty
+    hls_ladder: List[HlsRendition] = Field(default_factory=list)
+    ws_profile: str = "jsmpeg"  # Encoder profile of the MPEG-1 WebSocket stream
+    hls_profile: str = "hls"  # Encoder profile of HLS and LL-HLS unless passthrough; ladders keep their sizes and bitrates
+    # Low-priority encoders run at a higher nice level and are degraded first when CPU runs short; high ones never are
+    priority: Literal["high", "normal", "low"] = "normal"
+    motion: MotionConfig = Field(default_factory=MotionConfig)
+    recording: RecordingConfig = Field(default_factory=RecordingConfig)
+    snapshot: SnapshotConfig = Field(default_factory=SnapshotConfig)
+
+
+def output_framerate(profile: EncoderProfile, config: CameraConfig) -> int:
+    return profile.framerate or config.framerate
 
 
 class Config(BaseModel):
     cameras: Dict[str, CameraConfig]
+    max_transcoders: int = 8  # FFmpeg processes allowed at once across all cameras
+    log_summary_interval: float = 60.0  # Seconds between each active camera's traffic line in the log; 0 turns them off
+    recordings_dir: str = "recordings"  # Each recording camera gets a subdirectory
+    # Shared by the worker processes of one host; each camera is then owned by a single worker
+    cluster_dir: Optional[str] = None
+    # STUN/TURN URLs offered to WebRTC peers; none are needed on a LAN or tailnet
+    ice_servers: List[str] = Field(default_factory=list)
+    encoder_profiles: Dict[str, EncoderProfile] = Field(default_factory=dict, validate_default=True)
+    # Cores FFmpeg encoders may keep busy before low-priority cameras are degraded; all but one if unset
+    cpu_budget: Optional[float] = None
+
+    @field_validator("cameras", mode="before")
+    @classmethod
+    def _ids_from_keys(cls, cameras: Any) -> Any:
+        """Let config files leave out each camera's id, which is already its key"""
+        if isinstance(cameras, dict):
+            return {key: {"id": key, **value} if isinstance(value, dict) else value for key, value in cameras.items()}
+        return cameras
+
+    @field_validator("encoder_profiles", mode="before")
+    @classmethod
+    def _with_default_profiles(cls, profiles: Any) -> Any:
+        if isinstance(profiles, dict):
+            return {**DEFAULT_ENCODER_PROFILES, **profiles}
+        return profiles
+
+    @model_validator(mode="after")
+    def _check_profiles(self) -> "Config":
+        """Fail on load, not at the first encode, for a profile that is missing or that MPEG-1 cannot encode"""
+        for name, profile in self.encoder_profiles.items():
+            if profile.fallback is not None and profile.fallback not in self.encoder_profiles:
+                raise ValueError(f"Encoder profile {name} falls back to unknown profile {profile.fallback}")
+        for camera in self.cameras.values():
+            for name in (camera.ws_profile, camera.hls_profile):
+                if name not in self.encoder_profiles:
+                    raise ValueError(f"Camera {camera.id} uses unknown encoder profile {name}")
+            if camera.ws_format != "mpeg1":
+                continue
+            profile = self.encoder_profiles[camera.ws_profile]
+            for name in filter(None, (camera.ws_profile, profile.fallback)):
+                # A profile without its own framerate encodes at the camera's
+                framerate = output_framerate(self.encoder_profiles[name], camera)
+                if framerate not in MPEG1_FRAMERATES:
+                    raise ValueError(f"Encoder profile {name} of camera {camera.id}: MPEG-1 cannot encode {framerate} fps")
+        return self
+
+    @classmethod
+    def load(cls, path: Path) -> "Config":
+        """Read a JSON config file, or a YAML one if PyYAML is installed"""
+        text = path.read_text()
+        if path.suffix in (".yaml", ".yml"):
+            if yaml is None:
+                raise RuntimeError("YAML config files require PyYAML (pip install pyyaml)")
+            try:
+                data = yaml.safe_load(text)
+            except yaml.YAMLError as e:
+                raise ValueError(f"Invalid YAML in {path}: {e}") from e
+            return cls.model_validate(data)
+        return cls.model_validate(json.loads(text))
+
+    @classmethod
+    def config_path(cls) -> Optional[Path]:
+        path = os.environ.get(CONFIG_ENV)
+        return Path(path) if path else None
 
     @classmethod
     def load_default(cls) -> "Config":
@@ -27,3 +184,8 @@ class Config(BaseModel):
                 location="Test Location"
             )
         })
+
+
+def camera_changes(old: CameraConfig, new: CameraConfig) -> Set[str]:
+    """Names of the camera settings that differ between two versions of its config"""
+    return {name for name in CameraConfig.model_fields if getattr(old, name) != getattr(new, name)}
@@ -0,0 +1,236 @@
+import logging
+import os
+import time
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from .config import DEFAULT_ENCODER_PROFILES, CameraConfig, EncoderProfile, output_framerate
+from .metrics import process_cpu_seconds
+
+if TYPE_CHECKING:
+    from .transcoder import Transcoder
+
+logger = logging.getLogger(__name__)
+
+# Encoders yield to the proxy itself and to decoders, low-priority ones to everything else too
+NICE_LEVELS = {"high": 0, "normal": 5, "low": 10}
+DEGRADE_ORDER = {"low": 0, "normal": 1}  # Cameras degraded first come first; high priority ones never are
+BALANCE_INTERVAL = 5.0  # Seconds over which FFmpeg CPU use is measured
+BALANCE_COOLDOWN = 30.0  # Seconds after one encoder is degraded or restored before the next, so CPU use can settle
+RESTORE_HEADROOM = 0.8  # Fraction of the budget a restored encoder's estimated CPU use must fit within
+
+
+class Encoding(NamedTuple):
+    """Where and how one encoder process runs, decided when it starts"""
+    profile: EncoderProfile
+    threads: int
+    nice: int
+    degraded: bool  # Running its profile's fallback
+
+
+def encoder_filters(profile: EncoderProfile) -> List[str]:
+    """Filters bringing decoded frames to a profile's rate and size; frames are dropped before they are scaled"""
+    filters = []
+    if profile.framerate is not None:
+        filters.append(f"fps={profile.framerate}")
+    if profile.width is not None or profile.height is not None:
+        filters.append(f"scale={profile.width or -2}:{profile.height or -2}")
+    return filters
+
+
+def encoder_args(encoding: Encoding, codec: str, stream: str = "v", bitrate: Optional[int] = None) -> List[str]:
+    """FFmpeg options encoding the output stream `stream` to `codec` as placed by the scheduler.
+
+    `bitrate` overrides the profile's, for ladder renditions that carry their own.
+    """
+    profile = encoding.profile
+    args = [f"-c:{stream}", codec, f"-threads:{stream}", str(encoding.threads)]
+    if codec == "libx264":
+        args += [f"-preset:{stream}", profile.preset, f"-tune:{stream}", "zerolatency"]
+    bitrate = bitrate or profile.bitrate
+    if bitrate is not None:
+        args += [f"-b:{stream}", f"{bitrate}k"]
+        if codec == "libx264":
+            # Hold ABR renditions to the bandwidth their playlist advertises
+            args += [f"-maxrate:{stream}", f"{bitrate}k", f"-bufsize:{stream}", f"{2 * bitrate}k"]
+    return args
+
+
+def pixel_rate(profile: EncoderProfile, config: CameraConfig) -> float:
+    """Pixels per second a profile encodes, which its CPU use roughly follows"""
+    width, height = config.resolution["width"], config.resolution["height"]
+    if profile.width is not None and profile.height is not None:
+        width, height = profile.width, profile.height
+    elif profile.height is not None:
+        width, height = width * profile.height / height, profile.height
+    elif profile.width is not None:
+        width, height = profile.width, height * profile.width / width
+    return width * height * output_framerate(profile, config)
+
+
+class CpuScheduler:
+    """Shares the host's cores between encoders, and degrades low-priority cameras when they run short.
+
+    The running encoders share the budget evenly as `-threads`, and the cores likewise:
+    whenever one starts or stops, every encoder is pinned to its slice of the cores
+    again, never the first one, which is left to the proxy itself. `-threads` is fixed
+    when FFmpeg starts, so an encoder started while fewer were running keeps more
+    threads until it restarts, confined to as many cores as the others. Each encoder
+    is also niced by its camera's priority. `balance` measures what the FFmpeg
+    processes actually use. Over budget, it restarts the busiest encoder of the
+    lowest-priority camera with its profile's fallback; once the full profile fits
+    again, it restores it.
+    """
+
+    def __init__(self, profiles: Optional[Dict[str, EncoderProfile]] = None, cpu_budget: Optional[float] = None):
+        self.profiles = profiles or {
+            name: EncoderProfile.model_validate(profile) for name, profile in DEFAULT_ENCODER_PROFILES.items()
+        }
+        self.cpu_budget = cpu_budget
+        try:
+            available = sorted(os.sched_getaffinity(0))
+        except AttributeError:  # Not Linux
+            available = list(range(os.cpu_count() or 1))
+        self.cpus = available[1:] or available
+        self.degraded: Set[Tuple[str, str]] = set()  # Camera and encoder name of each encoder on its fallback
+        self._placed: Dict["Transcoder", Tuple[int, ...]] = {}  # Cores each placed encoder is pinned to
+        self._pids: Dict["Transcoder", int] = {}
+        self._usage: Dict["Transcoder", float] = {}  # Cores each process used over the last interval
+        self._samples: Dict[int, Tuple[float, float]] = {}  # CPU seconds of each PID, and when they were read
+        self._last_change = 0.0
+
+    @property
+    def budget(self) -> float:
+        return self.cpu_budget or len(self.cpus)
+
+    def place(self, transcoder: "Transcoder") -> Encoding:
+        """Choose the profile, threads, cores and nice level of an encoder process about to start"""
+        config = transcoder.camera.config
+        profile = self.profiles.get(transcoder.profile)
+        if profile is None:
+            # Only while a reload that dropped the profile is restarting the camera; the supervisor retries
+            raise ValueError(f"Unknown encoder profile {transcoder.profile}")
+        degraded = (profile.fallback in self.profiles and config.priority != "high"
+                    and (config.id, transcoder.name) in self.degraded)
+        if degraded:
+            profile = self.profiles[profile.fallback]
+        self._placed[transcoder] = ()
+        self._rebalance()
+        return Encoding(profile, self._share(), NICE_LEVELS[config.priority], degraded)
+
+    def pin(self, transcoder: "Transcoder", pid: int) -> None:
+        """Apply a placement to a process that just started; the threads it creates later inherit it"""
+        self._pids[transcoder] = pid
+        self._set_affinity(pid, self._placed[transcoder])
+        try:
+            os.setpriority(os.PRIO_PROCESS, pid, transcoder.encoding.nice)
+        except OSError as e:
+            logger.warning(f"Could not set nice {transcoder.encoding.nice} for PID {pid}: {e}")
+
+    def release(self, transcoder: "Transcoder") -> None:
+        """Free the cores of an encoder whose process ended"""
+        self._usage.pop(transcoder, None)
+        self._pids.pop(transcoder, None)
+        if self._placed.pop(transcoder, None) is not None:
+            self._rebalance()
+
+    def _share(self) -> int:
+        """Threads each placed encoder gets from the budget"""
+        return max(1, min(len(self.cpus), int(self.budget / max(1, len(self._placed)))))
+
+    def _rebalance(self) -> None:
+        """Spread the placed encoders evenly over the cores, moving running ones without a restart"""
+        count, cores = len(self._placed), len(self.cpus)
+        for number, transcoder in enumerate(self._placed):
+            if count >= cores:
+                cpus = (self.cpus[number % cores],)
+            else:
+                # Consecutive slices covering every core, differing in size by one at most
+                cpus = tuple(self.cpus[number * cores // count:(number + 1) * cores // count])
+            if cpus == self._placed[transcoder]:
+                continue
+            self._placed[transcoder] = cpus
+            pid = self._pids.get(transcoder)
+            if pid is not None:
+                self._set_affinity(pid, cpus)
+
+    def _set_affinity(self, pid: int, cpus: Tuple[int, ...]) -> None:
+        try:
+            # Every thread of a running process, since the affinity of a PID is only its main thread's
+            threads = [int(tid) for tid in os.listdir(f"/proc/{pid}/task")]
+        except OSError:
+            threads = [pid]
+        for tid in threads:
+            try:
+                os.sched_setaffinity(tid, cpus)
+            except ProcessLookupError:
+                continue  # The thread, or the whole process, already exited
+            except AttributeError:
+                return  # Not Linux; the OS schedules the encoder as it likes
+            except OSError as e:
+                logger.warning(f"Could not pin PID {pid} to CPUs {cpus}: {e}")
+                return
+
+    def measure(self, transcoders: List["Transcoder"]) -> float:
+        """Cores used by the running FFmpeg processes since the last call, decoders included"""
+        now = time.monotonic()
+        samples = {}
+        load = 0.0
+        for transcoder in transcoders:
+            process = transcoder.process
+            seconds = process_cpu_seconds(process.pid) if process else None
+            if seconds is None:
+                continue
+            samples[process.pid] = (seconds, now)
+            previous = self._samples.get(process.pid)
+            if previous is not None:
+                self._usage[transcoder] = (seconds - previous[0]) / (now - previous[1])
+                load += self._usage[transcoder]
+        self._samples = samples
+        return load
+
+    async def balance(self, transcoders: List["Transcoder"]) -> None:
+        """Measure the FFmpeg processes, then degrade or restore at most one encoder"""
+        load = self.measure(transcoders)
+        if time.monotonic() - self._last_change < BALANCE_COOLDOWN:
+            return
+        # Profiles are the reloaded config's, which may no longer have a running encoder's
+        placed = [
+            transcoder for transcoder in transcoders
+            if transcoder in self._placed and transcoder.encoding and transcoder.profile in self.profiles
+        ]
+        if load > self.budget:
+            candidates = [
+                transcoder for transcoder in placed
+                if not transcoder.encoding.degraded and transcoder.camera.config.priority in DEGRADE_ORDER
+                and self.profiles[transcoder.profile].fallback in self.profiles
+            ]
+            if not candidates:
+                return
+            transcoder = min(candidates, key=lambda t: (DEGRADE_ORDER[t.camera.config.priority], -self._usage.get(t, 0.0)))
+            fallback = self.profiles[transcoder.profile].fallback
+            logger.warning(f"Encoders use {load:.2f} of {self.budget:.2f} cores; switching {transcoder.name} "
+                           f"of {transcoder.camera_id} to encoder profile {fallback}")
+            self.degraded.add((transcoder.camera_id, transcoder.name))
+            await self._restart(transcoder)
+            return
+        # Highest priority first; each is restored only if its estimated use at the full profile fits
+        degraded = sorted((t for t in placed if t.encoding.degraded),
+                          key=lambda t: -DEGRADE_ORDER.get(t.camera.config.priority, len(DEGRADE_ORDER)))
+        for transcoder in degraded:
+            usage = self._usage.get(transcoder)
+            if usage is None:
+                continue
+            config = transcoder.camera.config
+            full = self.profiles[transcoder.profile]
+            estimate = usage * pixel_rate(full, config) / pixel_rate(transcoder.encoding.profile, config)
+            if load - usage + estimate > self.budget * RESTORE_HEADROOM:
+                continue
+            logger.info(f"Encoders use {load:.2f} of {self.budget:.2f} cores; restoring {transcoder.name} "
+                        f"of {transcoder.camera_id} to encoder profile {transcoder.profile}")
+            self.degraded.discard((transcoder.camera_id, transcoder.name))
+            await self._restart(transcoder)
+            return
+
+    async def _restart(self, transcoder: "Transcoder") -> None:
+        self._last_change = time.monotonic()
+        await transcoder.restart()
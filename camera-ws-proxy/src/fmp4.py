@@ -0,0 +1,156 @@
+import logging
+import struct
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Boxes that may precede a moof and belong to the fragment that follows
+FRAGMENT_PREFIX_BOXES = {b"styp", b"sidx", b"prft", b"emsg"}
+SAMPLE_IS_NON_SYNC = 0x00010000
+
+
+class Fragment(NamedTuple):
+    data: bytes  # moof + mdat, with any prefix boxes
+    keyframe: bool  # First sample is a sync sample
+    decode_time: int  # baseMediaDecodeTime in timescale units
+    duration: int  # Sum of sample durations in timescale units
+
+
+def iter_boxes(data: memoryview, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[bytes, int, int, int]]:
+    """Yield (type, box start, payload start, box end) for every complete box in data[start:end]"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack_from(">Q", data, pos + 8)[0]
+            header = 16
+        if size < header or pos + size > end:
+            return
+        yield box_type, pos, pos + header, pos + size
+        pos += size
+
+
+def find_box(data: memoryview, path: List[bytes], start: int = 0, end: Optional[int] = None) -> Optional[Tuple[int, int]]:
+    """Payload range of the first box matching a path such as [b"moov", b"trak", b"mdia"]"""
+    for box_type, _, payload, box_end in iter_boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return payload, box_end
+            return find_box(data, path[1:], payload, box_end)
+    return None
+
+
+class FragmentParser:
+    """Splits fragmented MP4 (as written by FFmpeg with empty_moov+default_base_moof) into
+    an init segment and self-contained moof+mdat fragments.
+
+    Only box headers and the few fields needed for keyframe and timing information are
+    decoded; sample data is never touched.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.init: Optional[bytes] = None
+        self.timescale = 90000
+        self._default_sample_flags = 0
+
+    def feed(self, data: memoryview) -> List[Fragment]:
+        """Append muxer output and return every fragment it completes"""
+        self._buffer += data
+        view = memoryview(self._buffer)
+        fragments: List[Fragment] = []
+        consumed = 0  # Everything before this offset has been handed out
+        pending: Optional[int] = None  # Start of an init segment or fragment still being assembled
+        try:
+            for box_type, box_start, payload, box_end in iter_boxes(view):
+                if box_type == b"ftyp" or box_type in FRAGMENT_PREFIX_BOXES or box_type == b"moof":
+                    if pending is None:
+                        pending = box_start
+                    continue
+                if box_type == b"moov":
+                    self._parse_moov(view, payload, box_end)
+                    self.init = bytes(view[box_start if pending is None else pending:box_end])
+                elif box_type == b"mdat" and pending is not None:
+                    fragments.append(self._fragment(view, pending, box_end))
+                pending = None
+                consumed = box_end
+        finally:
+            view.release()
+        if consumed:
+            del self._buffer[:consumed]
+        return fragments
+
+    def _parse_moov(self, view: memoryview, start: int, end: int) -> None:
+        mdhd = find_box(view, [b"trak", b"mdia", b"mdhd"], start, end)
+        if mdhd:
+            version = view[mdhd[0]]
+            # Skip version/flags and creation/modification times
+            offset = mdhd[0] + (20 if version == 1 else 12)
+            self.timescale = struct.unpack_from(">I", view, offset)[0]
+        trex = find_box(view, [b"mvex", b"trex"], start, end)
+        if trex:
+            self._default_sample_flags = struct.unpack_from(">I", view, trex[0] + 20)[0]
+
+    def _fragment(self, view: memoryview, start: int, end: int) -> Fragment:
+        keyframe = False
+        decode_time = 0
+        duration = 0
+        moof = find_box(view, [b"moof"], start, end)
+        traf = find_box(view, [b"traf"], *moof) if moof else None
+        if traf:
+            default_duration = 0
+            default_flags = self._default_sample_flags
+            for box_type, _, payload, box_end in iter_boxes(view, *traf):
+                flags = struct.unpack_from(">I", view, payload)[0] & 0xFFFFFF
+                if box_type == b"tfhd":
+                    offset = payload + 8  # version/flags + track_ID
+                    if flags & 0x01:
+                        offset += 8  # base_data_offset
+                    if flags & 0x02:
+                        offset += 4  # sample_description_index
+                    if flags & 0x08:
+                        default_duration = struct.unpack_from(">I", view, offset)[0]
+                        offset += 4
+                    if flags & 0x10:
+                        offset += 4  # default_sample_size
+                    if flags & 0x20:
+                        default_flags = struct.unpack_from(">I", view, offset)[0]
+                elif box_type == b"tfdt":
+                    if view[payload] == 1:
+                        decode_time = struct.unpack_from(">Q", view, payload + 4)[0]
+                    else:
+                        decode_time = struct.unpack_from(">I", view, payload + 4)[0]
+                elif box_type == b"trun":
+                    keyframe, duration = self._parse_trun(view, payload, flags, default_duration, default_flags)
+        return Fragment(bytes(view[start:end]), keyframe, decode_time, duration)
+
+    @staticmethod
+    def _parse_trun(view: memoryview, payload: int, flags: int, default_duration: int,
+                    default_flags: int) -> Tuple[bool, int]:
+        count = struct.unpack_from(">I", view, payload + 4)[0]
+        offset = payload + 8
+        if flags & 0x01:
+            offset += 4  # data_offset
+        first_flags = default_flags
+        if flags & 0x04:
+            first_flags = struct.unpack_from(">I", view, offset)[0]
+            offset += 4
+        # Each of duration/size/flags/composition offset present adds 4 bytes per sample
+        sample_size = 4 * bin(flags & 0xF00).count("1")
+        duration = 0
+        for index in range(count):
+            field = offset + index * sample_size
+            if flags & 0x100:
+                duration += struct.unpack_from(">I", view, field)[0]
+                field += 4
+            else:
+                duration += default_duration
+            if flags & 0x200:
+                field += 4
+            if index == 0 and flags & 0x400 and not flags & 0x04:
+                first_flags = struct.unpack_from(">I", view, field)[0]
+        return not first_flags & SAMPLE_IS_NON_SYNC, duration
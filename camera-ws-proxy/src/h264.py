@@ -0,0 +1,206 @@
+import logging
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+START_CODE = b"\x00\x00\x01"
+START_CODE_PATTERN = re.compile(re.escape(START_CODE))  # Searches a memoryview without copying it
+
+NAL_SLICE = 1
+NAL_IDR = 5
+NAL_SEI = 6
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+VCL_TYPES = {NAL_SLICE, NAL_IDR}
+# NAL types that may only appear before the first slice of an access unit
+PREFIX_TYPES = {NAL_SEI, NAL_SPS, NAL_PPS, NAL_AUD}
+
+
+class AccessUnit(NamedTuple):
+    data: bytes  # Annex-B NAL units, start codes included
+    keyframe: bool  # Contains an IDR slice
+
+
+class AccessUnitParser:
+    """Splits a raw Annex-B H.264 byte stream (as sent by libcamera-vid) into access units.
+
+    Each access unit is copied out of the receive buffer once, as a single contiguous
+    slice. The latest SPS and PPS are kept so they can be sent ahead of a cached IDR
+    when the camera does not repeat them inline.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._scan = 0  # Offset to resume the start code search from
+        self._au_start: Optional[int] = None
+        self._au_has_vcl = False
+        self._au_keyframe = False
+        self._nal_start: Optional[int] = None
+        self._nal_type = 0
+        self.sps: Optional[bytes] = None
+        self.pps: Optional[bytes] = None
+
+    @property
+    def parameter_sets(self) -> bytes:
+        """SPS and PPS as Annex-B NAL units, or empty until both have been seen"""
+        if self.sps is None or self.pps is None:
+            return b""
+        return self.sps + self.pps
+
+    @property
+    def pending(self) -> bytes:
+        """Bytes fed since the last access unit boundary, so a consumer joining now can start on one"""
+        if self._au_start is None:
+            return b""
+        return bytes(self._buffer[self._au_start:])
+
+    def feed(self, data: memoryview) -> List[AccessUnit]:
+        """Append camera bytes and return every access unit they complete"""
+        self._buffer += data
+        buffer = self._buffer
+        units: List[AccessUnit] = []
+        while True:
+            pos = buffer.find(START_CODE, self._scan)
+            # Need the NAL header and the first slice header byte to classify the unit
+            if pos == -1 or pos + 4 >= len(buffer):
+                if pos == -1:
+                    self._scan = max(len(buffer) - 3, self._scan)
+                break
+            start = pos - 1 if pos and buffer[pos - 1] == 0 else pos
+            self._begin_nal(start, buffer[pos + 3] & 0x1F, buffer[pos + 4], units)
+            self._scan = pos + 3
+        self._compact()
+        return units
+
+    def _begin_nal(self, start: int, nal_type: int, first_byte: int, units: List[AccessUnit]) -> None:
+        if self._nal_start is not None and self._nal_type in (NAL_SPS, NAL_PPS):
+            nal = bytes(self._buffer[self._nal_start:start])
+            if self._nal_type == NAL_SPS:
+                self.sps = nal
+            else:
+                self.pps = nal
+
+        # first_mb_in_slice is ue(v) coded, so a leading 1 bit means the slice starts a new picture
+        new_picture = nal_type in PREFIX_TYPES or (nal_type in VCL_TYPES and first_byte & 0x80)
+        if self._au_start is not None and self._au_has_vcl and new_picture:
+            units.append(AccessUnit(bytes(self._buffer[self._au_start:start]), self._au_keyframe))
+            self._au_start = None
+            self._au_has_vcl = False
+            self._au_keyframe = False
+
+        if self._au_start is None:
+            self._au_start = start
+        if nal_type in VCL_TYPES:
+            self._au_has_vcl = True
+            self._au_keyframe = self._au_keyframe or nal_type == NAL_IDR
+        self._nal_start = start
+        self._nal_type = nal_type
+
+    def _compact(self) -> None:
+        """Release bytes no unfinished access unit or NAL unit still refers to"""
+        keep = [offset for offset in (self._au_start, self._nal_start) if offset is not None]
+        drop = min(keep) if keep else self._scan
+        if not drop:
+            return
+        del self._buffer[:drop]
+        self._scan -= drop
+        if self._au_start is not None:
+            self._au_start -= drop
+        if self._nal_start is not None:
+            self._nal_start -= drop
+
+
+class AccessUnitTracker:
+    """Follows a raw Annex-B H.264 byte stream without copying it, for the camera's read loop.
+
+    Only the start codes in each chunk are looked at: it remembers the latest SPS
+    and PPS, and where in the last chunk the first access unit began, so a consumer
+    joining mid-stream can start on a picture boundary. The access units themselves
+    are never buffered.
+    """
+
+    def __init__(self):
+        self._carry = b""  # Tail of the previous chunk: a start code cut in two, with its leading zero
+        self._nal_type = 0
+        self._parameter_set: Optional[bytearray] = None  # SPS or PPS being read, if that is the current NAL unit
+        self._au_has_vcl = True  # Whatever comes before the first picture boundary is not worth joining on
+        self.access_unit_start: Optional[int] = None  # Offset in the last chunk, if an access unit began there
+        self.sps: Optional[bytes] = None
+        self.pps: Optional[bytes] = None
+
+    @property
+    def parameter_sets(self) -> bytes:
+        """SPS and PPS as Annex-B NAL units, or empty until both have been seen"""
+        if self.sps is None or self.pps is None:
+            return b""
+        return self.sps + self.pps
+
+    def feed(self, data: memoryview) -> None:
+        """Scan the next chunk of camera bytes"""
+        self.access_unit_start = None
+        end = 0  # Offset up to which the current NAL unit has been taken in
+        for start, nal_type, first_byte in self._nal_starts(data):
+            if self._parameter_set is not None:
+                if start < 0:
+                    # Its start code began in the previous chunk, which was taken in whole
+                    del self._parameter_set[start:]
+                else:
+                    self._parameter_set += data[end:start]
+                self._end_parameter_set()
+            end = max(start, 0)
+            self._begin_nal(start, nal_type, first_byte)
+        if self._parameter_set is not None:
+            self._parameter_set += data[end:]
+        self._carry = (self._carry + bytes(data[-5:]))[-5:]
+
+    def _nal_starts(self, data: memoryview) -> List[Tuple[int, int, int]]:
+        """Offset, type and first payload byte of every NAL unit whose header is complete by the end of `data`.
+
+        A start code whose header only completes in this chunk gets a negative offset
+        from the previous one.
+        """
+        starts = []
+        carry = self._carry
+        if carry:
+            joined = carry + bytes(data[:5])
+            for match in START_CODE_PATTERN.finditer(joined, 0, len(carry) + 2):
+                pos = match.start()
+                # Start codes with their header already in the previous chunk were handled there
+                if pos + 4 < len(carry) or pos + 4 >= len(joined):
+                    continue
+                start = pos - 1 if pos and joined[pos - 1] == 0 else pos
+                starts.append((start - len(carry), joined[pos + 3] & 0x1F, joined[pos + 4]))
+        for match in START_CODE_PATTERN.finditer(data):
+            pos = match.start()
+            # Need the NAL header and the first slice header byte to classify the unit
+            if pos + 4 >= len(data):
+                break
+            start = pos - 1 if pos and data[pos - 1] == 0 else pos
+            starts.append((start, data[pos + 3] & 0x1F, data[pos + 4]))
+        return starts
+
+    def _begin_nal(self, start: int, nal_type: int, first_byte: int) -> None:
+        # first_mb_in_slice is ue(v) coded, so a leading 1 bit means the slice starts a new picture
+        new_picture = nal_type in PREFIX_TYPES or (nal_type in VCL_TYPES and first_byte & 0x80)
+        if self._au_has_vcl and new_picture:
+            self._au_has_vcl = False
+            if start >= 0 and self.access_unit_start is None:
+                self.access_unit_start = start
+        if nal_type in VCL_TYPES:
+            self._au_has_vcl = True
+        self._nal_type = nal_type
+        if nal_type in (NAL_SPS, NAL_PPS):
+            # The part of a start code that was in the previous chunk
+            self._parameter_set = bytearray(self._carry[start:] if start < 0 else b"")
+        else:
+            self._parameter_set = None
+
+    def _end_parameter_set(self) -> None:
+        nal = bytes(self._parameter_set)
+        if self._nal_type == NAL_SPS:
+            self.sps = nal
+        else:
+            self.pps = nal
+        self._parameter_set = None
@@ -0,0 +1,130 @@
+import logging
+from pathlib import Path
+from typing import List, Optional
+
+from .config import CameraConfig, HlsRendition
+from .encoder import Encoding, encoder_args, encoder_filters
+
+logger = logging.getLogger(__name__)
+
+HLS_SEGMENT_SECONDS = 1
+
+
+def ladder_renditions(config: CameraConfig) -> List[HlsRendition]:
+    """The configured ladder without renditions that would upscale past the camera's resolution"""
+    native_height = config.resolution["height"]
+    renditions = []
+    for rendition in config.hls_ladder:
+        if rendition.height is not None and rendition.height >= native_height:
+            logger.warning(f"Skipping HLS rendition {rendition.name} for {config.id}: "
+                           f"{rendition.height}p is not below the native {native_height}p")
+            continue
+        renditions.append(rendition)
+    return renditions
+
+
+def _passthrough_timestamps(config: CameraConfig, stream: str = "v") -> List[str]:
+    # Raw H.264 carries no timestamps and stream copy does not invent them, so stamp one per frame
+    return [f"-bsf:{stream}", f"setts=ts=N/({config.framerate}*TB)"]
+
+
+def hls_encodes(config: CameraConfig) -> bool:
+    """Whether HLS for the camera runs an encoder, rather than only remuxing its H.264"""
+    return not config.passthrough or any(rendition.height is not None for rendition in config.hls_ladder)
+
+
+def build_hls_command(config: CameraConfig, output_dir: Path, encoding: Optional[Encoding]) -> List[str]:
+    """FFmpeg command that reads the camera's H.264 on stdin and writes HLS into output_dir.
+
+    With an `hls_ladder` the input is decoded once and split into one scaled encode per
+    rendition, written as `{name}.m3u8` variant playlists behind an `index.m3u8` master
+    playlist. Keyframes are forced at the same instants in every rendition so players can
+    switch at any segment boundary. Encodes follow `encoding`, except that renditions keep
+    their own height and bitrate.
+    """
+    segment_type = "fmp4" if config.passthrough else "mpegts"
+    extension = "m4s" if config.passthrough else "ts"
+    # Passthrough renditions follow the camera's own keyframes; otherwise cut one every segment
+    keyframes = "source" if config.passthrough else f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})"
+    renditions = ladder_renditions(config)
+
+    input_args = [
+        "ffmpeg",
+        "-nostats",               # Progress comes from -progress; keep the status line out of stderr
+        "-fflags", "nobuffer+genpts",
+        "-flags", "low_delay",
+        "-strict", "experimental",
+        "-probesize", "32",
+        "-analyzeduration", "0",
+        "-f", "h264",             # Raw H.264 from the shared camera connection
+        "-framerate", str(config.framerate),
+        "-i", "pipe:0",
+    ]
+    hls_args = [
+        "-f", "hls",
+        "-hls_time", str(HLS_SEGMENT_SECONDS),
+        "-hls_list_size", "5",
+        "-hls_segment_type", segment_type,
+        "-progress", "pipe:2",    # Output progress to stderr
+    ]
+
+    if not renditions:
+        if config.passthrough:
+            # Segment the camera's own H.264 as fMP4; segments follow the camera's keyframe interval
+            codec_args = ["-c:v", "copy", *_passthrough_timestamps(config)]
+        else:
+            filters = encoder_filters(encoding.profile)
+            codec_args = [*(["-vf", ",".join(filters)] if filters else []), *encoder_args(encoding, "libx264")]
+        return [
+            *input_args,
+            *codec_args,
+            *hls_args,
+            "-hls_flags", "delete_segments+omit_endlist",
+            str(output_dir / "index.m3u8")
+        ]
+
+    # Encoded renditions share one decode through split; a passthrough camera's native one is copied
+    framerate = encoding.profile.framerate if encoding else None
+    encoded = [rendition for rendition in renditions if rendition.height is not None
+               or (framerate is not None and not config.passthrough)]
+    # Frames beyond the profile's rate are dropped ahead of the split, so no rendition scales them
+    head = [f"fps={framerate}"] if framerate is not None else []
+    filters = []
+    if len(encoded) > 1:
+        filters.append("[0:v]" + ",".join([*head, f"split={len(encoded)}"])
+                       + "".join(f"[s{i}]" for i in range(len(encoded))))
+        head = []
+        sources = [f"[s{i}]" for i in range(len(encoded))]
+    else:
+        sources = ["[0:v]"]
+    for number, (source, rendition) in enumerate(zip(sources, encoded)):
+        chain = head + ([f"scale=-2:{rendition.height}"] if rendition.height is not None else [])
+        filters.append(f"{source}{','.join(chain) or 'null'}[r{number}]")
+
+    map_args: List[str] = []
+    codec_args: List[str] = []
+    for index, rendition in enumerate(renditions):
+        map_args += ["-map", f"[r{encoded.index(rendition)}]" if rendition in encoded else "0:v"]
+        if rendition.height is None and config.passthrough:
+            # The bitrate only feeds the master playlist's BANDWIDTH for a copied stream
+            codec_args += [f"-c:v:{index}", "copy", *_passthrough_timestamps(config, f"v:{index}"),
+                           f"-b:v:{index}", f"{rendition.bitrate}k"]
+            continue
+        codec_args += [
+            *encoder_args(encoding, "libx264", f"v:{index}", rendition.bitrate),
+            f"-force_key_frames:v:{index}", keyframes,
+        ]
+
+    return [
+        *input_args,
+        *(["-filter_complex", ";".join(filters)] if filters else []),
+        *map_args,
+        *codec_args,
+        *hls_args,
+        "-hls_flags", "delete_segments+omit_endlist+independent_segments",
+        "-var_stream_map", " ".join(f"v:{index},name:{rendition.name}" for index, rendition in enumerate(renditions)),
+        "-master_pl_name", "index.m3u8",
+        "-hls_segment_filename", str(output_dir / f"%v_%03d.{extension}"),
+        "-hls_fmp4_init_filename", "%v_init.mp4",
+        str(output_dir / "%v.m3u8")
+    ]
@@ -0,0 +1,537 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+import socket
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Deque, Dict, Iterable, List, NamedTuple, Optional, Type
+
+from .camera import CallbackSink, CameraStream
+from .encoder import encoder_args, encoder_filters, output_framerate
+from .fmp4 import FragmentParser
+from .h264 import AccessUnitParser
+from .mpegts import PacketBuffer, TSScanner
+from .transcoder import Transcoder, TranscoderSupervisor
+
+logger = logging.getLogger(__name__)
+
+READ_BUFFER_SIZE = 65536
+
+
+class Chunk(NamedTuple):
+    data: bytes
+    keyframe: bool  # Chunk starts at a random access point, so a decoder can resume here
+
+
+class Subscriber:
+    """A single viewer attached to a StreamHub, reading the shared ring with its own cursor.
+
+    The distance between the cursor and the ring head is the viewer's send queue.
+    When it grows past `max_queue` the viewer skips ahead to the newest GOP start,
+    so a slow client loses frames instead of adding latency for anyone else.
+    """
+
+    def __init__(self, hub: "StreamHub", cursor: int, max_queue: int, client: str = ""):
+        self._hub = hub
+        self.cursor = cursor
+        self.max_queue = max_queue
+        self.client = client
+        self.connected_at = time.time()
+        self.resyncing = False  # Discarding data until the next GOP start
+        self.lagging = False  # Resyncing because it fell behind, so the discarded data counts as dropped
+        self.backlog: Deque[bytes] = deque()  # Cached GOP sent ahead of live data
+        # What the last read returned: whether it starts a GOP, and how many bytes of codec header lead it
+        self.at_keyframe = False
+        self.header_length = 0
+        self._backlog_header: Optional[int] = None  # Header length of the first backlog chunk, a GOP start
+        self.sent_chunks = 0
+        self.sent_bytes = 0
+        self.dropped_chunks = 0
+        self.drop_events = 0
+        self.send_latency = 0.0  # Smoothed seconds the client took to accept a chunk
+
+    @property
+    def queue_depth(self) -> int:
+        return max(self._hub._head - self.cursor, 0)
+
+    async def read(self) -> Optional[bytes]:
+        """Wait for the next chunk, or return None once the stream has stopped"""
+        return await self._hub._read(self)
+
+    def record_send(self, seconds: float) -> None:
+        """Fold the time one send took into the smoothed send latency"""
+        self.send_latency += (seconds - self.send_latency) * 0.1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "client": self.client,
+            "connected_at": self.connected_at,
+            "queue_depth": self.queue_depth,
+            "max_queue": self.max_queue,
+            "sent_chunks": self.sent_chunks,
+            "sent_bytes": self.sent_bytes,
+            "dropped_chunks": self.dropped_chunks,
+            "drop_events": self.drop_events,
+            "send_latency": self.send_latency,
+        }
+
+
+class StreamHub(ABC):
+    """Shares one stream of a camera between any number of viewers.
+
+    The source writes chunks into a ring buffer. Each subscriber keeps its own
+    position in the ring, so the source never waits on a viewer. The most recent
+    GOP is also kept aside and replayed to new viewers, so they get a picture
+    without waiting for the next keyframe. The source is started by the first
+    subscriber and stopped `grace_period` seconds after the last one leaves.
+
+    Subclasses provide the source (`_start`/`_stop`) and the codec header
+    (`_header`) that must precede a replayed GOP.
+    """
+
+    format = ""
+    media_type = "application/octet-stream"
+
+    def __init__(self, camera: CameraStream, ring_size: int = 256, max_queue: int = 64,
+                 grace_period: float = 10.0, gop_cache_bytes: int = 4 * 1024 * 1024):
+        self.camera = camera
+        self.config = camera.config
+        self.max_queue = min(max_queue, ring_size)
+        self.grace_period = grace_period
+        self.gop_cache_bytes = gop_cache_bytes
+        self._gop: List[bytes] = []  # Chunks since the last random access point, empty if unknown
+        self._gop_size = 0
+        self._ring: Deque[Chunk] = deque(maxlen=ring_size)
+        self._head = 0  # Sequence number of the next chunk written to the ring
+        self._wakeup = asyncio.Event()
+        self._running = False
+        self._subscribers: List[Subscriber] = []
+        # Totals over every viewer there has been, for rates in the periodic log summary
+        self.sent_bytes = 0
+        self.dropped_chunks = 0
+        self._stop_handle: Optional[asyncio.TimerHandle] = None
+        self._start_lock = asyncio.Lock()
+
+    @property
+    def is_running(self) -> bool:
+        return self._running
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscriber_stats(self) -> List[Dict[str, Any]]:
+        return [subscriber.stats() for subscriber in self._subscribers]
+
+    @asynccontextmanager
+    async def subscribe(self, client: str = "", live: bool = False) -> AsyncGenerator[Subscriber, None]:
+        """Attach a viewer, starting the source if this is the first one.
+
+        With `live`, the viewer skips the cached GOP and starts at the next random access
+        point, for players that pace frames by timestamp rather than show them on arrival.
+        """
+        self._cancel_scheduled_stop()
+        await self._ensure_started()
+        subscriber = Subscriber(self, self._head, self.max_queue, client)
+        if self._gop and not live:
+            header = self._header()
+            subscriber.backlog.append(header + self._gop[0])
+            subscriber.backlog.extend(self._gop[1:])
+            subscriber._backlog_header = len(header)
+        else:
+            # Nothing cached yet; start at the first live random access point
+            subscriber.resyncing = True
+        self._subscribers.append(subscriber)
+        logger.info(f"Viewer joined camera {self.config.id} ({self.subscriber_count} watching)")
+        try:
+            yield subscriber
+        finally:
+            self._subscribers.remove(subscriber)
+            logger.info(f"Viewer left camera {self.config.id} ({self.subscriber_count} watching)")
+            if not self._subscribers:
+                self._schedule_stop()
+
+    async def start(self) -> None:
+        """Start the source without attaching a viewer"""
+        self._cancel_scheduled_stop()
+        await self._ensure_started()
+
+    async def _ensure_started(self) -> None:
+        async with self._start_lock:
+            if self._running:
+                return
+            self._reset_gop()
+            await self._start()
+            self._running = True
+
+    @abstractmethod
+    async def _start(self) -> None:
+        """Start the source, which publishes chunks until `_stop`"""
+
+    @abstractmethod
+    async def _stop(self) -> None:
+        """Stop the source"""
+
+    @property
+    def header(self) -> bytes:
+        return self._header()
+
+    def _header(self) -> bytes:
+        """Codec or container header a decoder needs before the cached GOP"""
+        return b""
+
+    def _publish(self, chunks: Iterable[Chunk]) -> None:
+        for chunk in chunks:
+            self._cache_gop(chunk)
+            self._ring.append(chunk)
+            self._head += 1
+        self._notify()
+
+    def _source_restarted(self) -> None:
+        """The source began a new stream; viewers pick it up at its first random access point"""
+        self._reset_gop()
+        for subscriber in self._subscribers:
+            subscriber.backlog.clear()
+            subscriber._backlog_header = None
+            subscriber.cursor = self._head
+            subscriber.resyncing = True
+            subscriber.lagging = False
+
+    def _source_ended(self) -> None:
+        self._running = False
+        # Wake subscribers so they notice the source is gone
+        self._notify()
+
+    def _notify(self) -> None:
+        self._wakeup.set()
+        self._wakeup = asyncio.Event()
+
+    def _reset_gop(self) -> None:
+        self._gop = []
+        self._gop_size = 0
+
+    def _cache_gop(self, chunk: Chunk) -> None:
+        """Track the chunks of the current GOP, starting at its random access point"""
+        if chunk.keyframe:
+            self._reset_gop()
+        elif not self._gop:
+            return
+        if self._gop_size + len(chunk.data) > self.gop_cache_bytes:
+            # GOP too long to hold; new viewers wait for the next keyframe instead
+            self._reset_gop()
+            return
+        self._gop.append(chunk.data)
+        self._gop_size += len(chunk.data)
+
+    async def _read(self, subscriber: Subscriber) -> Optional[bytes]:
+        if subscriber.backlog:
+            data = subscriber.backlog.popleft()
+            subscriber.at_keyframe = subscriber._backlog_header is not None
+            subscriber.header_length = subscriber._backlog_header or 0
+            subscriber._backlog_header = None
+            subscriber.sent_chunks += 1
+            subscriber.sent_bytes += len(data)
+            self.sent_bytes += len(data)
+            return data
+        while True:
+            if self._head <= subscriber.cursor:
+                if not self._running:
+                    return None
+                await self._wakeup.wait()
+                continue
+            oldest = self._head - len(self._ring)
+            if subscriber.cursor < oldest or self._head - subscriber.cursor > subscriber.max_queue:
+                self._skip_to_keyframe(subscriber, oldest)
+                continue
+            chunk = self._ring[subscriber.cursor - oldest]
+            subscriber.cursor += 1
+            data = chunk.data
+            subscriber.at_keyframe = chunk.keyframe
+            subscriber.header_length = 0
+            if subscriber.resyncing:
+                if not chunk.keyframe:
+                    if subscriber.lagging:
+                        subscriber.dropped_chunks += 1
+                        self.dropped_chunks += 1
+                    continue
+                subscriber.resyncing = False
+                subscriber.lagging = False
+                # Resend the header in case the viewer never had it or the encoder restarted
+                header = self._header()
+                data = header + data
+                subscriber.header_length = len(header)
+            subscriber.sent_chunks += 1
+            subscriber.sent_bytes += len(data)
+            self.sent_bytes += len(data)
+            return data
+
+    def _skip_to_keyframe(self, subscriber: Subscriber, oldest: int) -> None:
+        """Move a lagging viewer to the newest GOP start within its queue limit, dropping everything before it"""
+        target = None
+        lowest = max(subscriber.cursor, oldest, self._head - subscriber.max_queue)
+        for seq in range(self._head - 1, lowest - 1, -1):
+            if self._ring[seq - oldest].keyframe:
+                target = seq
+                break
+        if target is None:
+            # No GOP start buffered yet; jump to live and wait for the next one
+            target = self._head
+            subscriber.resyncing = True
+            subscriber.lagging = True
+        subscriber.dropped_chunks += target - subscriber.cursor
+        self.dropped_chunks += target - subscriber.cursor
+        subscriber.drop_events += 1
+        subscriber.cursor = target
+        # A viewer on a bad link can fall behind every GOP; later drops show up in the summaries
+        if subscriber.drop_events == 1:
+            logger.warning(f"Viewer {subscriber.client or '?'} on camera {self.config.id} fell behind, "
+                           f"dropped {subscriber.dropped_chunks} chunks")
+
+    def _schedule_stop(self) -> None:
+        self._cancel_scheduled_stop()
+        loop = asyncio.get_running_loop()
+        self._stop_handle = loop.call_later(
+            self.grace_period, lambda: asyncio.ensure_future(self._stop_if_idle())
+        )
+
+    def _cancel_scheduled_stop(self) -> None:
+        if self._stop_handle is not None:
+            self._stop_handle.cancel()
+            self._stop_handle = None
+
+    async def _stop_if_idle(self) -> None:
+        self._stop_handle = None
+        if not self._subscribers:
+            logger.info(f"No viewers left for camera {self.config.id}, stopping {self.format} stream")
+            await self.stop()
+
+    async def stop(self) -> None:
+        """Stop the source and release the upstream connection"""
+        self._cancel_scheduled_stop()
+        async with self._start_lock:
+            await self._stop()
+            self._ring.clear()
+            self._reset_gop()
+            self._source_ended()
+
+
+class EncoderHub(StreamHub):
+    """StreamHub whose source is a supervised FFmpeg process fed from the shared camera connection.
+
+    If FFmpeg exits it is restarted, and connected viewers resume at the new
+    process's first random access point instead of being disconnected.
+    """
+
+    def __init__(self, camera: CameraStream, supervisor: Optional[TranscoderSupervisor] = None, **kwargs):
+        super().__init__(camera, **kwargs)
+        self.supervisor = supervisor or TranscoderSupervisor()
+        self.transcoder: Optional[Transcoder] = None
+
+    @abstractmethod
+    def build_command(self) -> List[str]:
+        """FFmpeg command reading H.264 on stdin and writing the hub's format to stdout"""
+
+    def encoder_profile(self) -> Optional[str]:
+        """Name of the encoder profile FFmpeg encodes with, or None if it only remuxes"""
+        return None
+
+    def _reset_output(self) -> None:
+        """Forget parser state left over from a previous FFmpeg process"""
+
+    @abstractmethod
+    def _receive_buffer(self) -> memoryview:
+        """Buffer the next read from FFmpeg's stdout goes into"""
+
+    @abstractmethod
+    def _received(self, nbytes: int) -> List[Chunk]:
+        """Turn `nbytes` just read into the receive buffer into ring chunks"""
+
+    async def _start(self) -> None:
+        # FFmpeg writes stdout into a socket so we can sock_recv_into a preallocated buffer
+        self.transcoder = self.supervisor.create(
+            f"{self.format}-encoder", self.camera, self.build_command, read_output=self._read_stdout,
+            profile=self.encoder_profile()
+        )
+        self.transcoder.start()
+
+    async def _read_stdout(self, stdout: socket.socket) -> None:
+        """Publish one FFmpeg process's output until it closes stdout"""
+        loop = asyncio.get_running_loop()
+        self._reset_output()
+        self._source_restarted()
+        while True:
+            nbytes = await loop.sock_recv_into(stdout, self._receive_buffer())
+            if not nbytes:
+                logger.info(f"FFmpeg stdout stream ended for {self.config.id}.")
+                break
+            if self.transcoder:
+                self.transcoder.mark_ready()
+            self._publish(self._received(nbytes))
+
+    async def _stop(self) -> None:
+        transcoder, self.transcoder = self.transcoder, None
+        if transcoder:
+            await transcoder.stop()
+
+
+class MpegTsHub(EncoderHub):
+    """MPEG-1 video in MPEG-TS for JSMpeg, transcoded by FFmpeg"""
+
+    format = "mpeg1"
+    media_type = "video/mp2t"
+
+    def __init__(self, camera: CameraStream, **kwargs):
+        super().__init__(camera, **kwargs)
+        self._buffer = PacketBuffer()
+        self._scanner = TSScanner()
+
+    def encoder_profile(self) -> Optional[str]:
+        return self.config.ws_profile
+
+    def build_command(self) -> List[str]:
+        """FFmpeg command that encodes the camera stream to MPEG-TS for JSMpeg"""
+        encoding = self.transcoder.encoding
+        filters = encoder_filters(encoding.profile)
+        return [
+            "ffmpeg",
+            "-nostats",               # Progress comes from -progress; keep the status line out of stderr
+            "-loglevel", "info",
+            "-fflags", "+igndts+nobuffer",
+            "-probesize", "32",       # Start decoding as soon as the first NAL units arrive
+            "-analyzeduration", "0",
+            "-re",                    # Read input at native rate
+            "-f", "h264",             # Raw H.264 from the shared camera connection
+            "-framerate", str(self.config.framerate),
+            "-i", "pipe:0",
+            *(["-vf", ",".join(filters)] if filters else []),
+            *encoder_args(encoding, "mpeg1video"),  # CRITICAL: Encode to MPEG1 video
+            "-bf", "0",               # No B-frames (recommended for JSMpeg)
+            # One GOP per second bounds join and resync delay
+            "-g", str(output_framerate(encoding.profile, self.config)),
+            "-f", "mpegts",           # Output MPEG-TS container
+            "-muxdelay", "0.01",      # Small mux delay
+            "-an",                    # No audio
+            "-progress", "pipe:2",    # Output progress to stderr
+            "pipe:1"                  # Output to stdout
+        ]
+
+    def _reset_output(self) -> None:
+        self._buffer = PacketBuffer()
+        self._scanner = TSScanner()
+
+    def _header(self) -> bytes:
+        return b"".join(self._scanner.tables)
+
+    def _receive_buffer(self) -> memoryview:
+        return self._buffer.free
+
+    def _received(self, nbytes: int) -> List[Chunk]:
+        """Copy whole packets out of the buffer once, split so every random access point starts a chunk"""
+        self._buffer.commit(nbytes)
+        packets = self._buffer.packets()
+        random_access = self._scanner.find_random_access(packets)
+        bounds = [0] + [offset for offset in random_access if offset] + [len(packets)]
+        chunks = [
+            Chunk(bytes(packets[start:end]), start in random_access)
+            for start, end in zip(bounds, bounds[1:])
+            if end > start
+        ]
+        self._buffer.consume()
+        return chunks
+
+
+class Fmp4Hub(EncoderHub):
+    """The camera's H.264 remuxed into fragmented MP4 without re-encoding, for MSE players.
+
+    Each WebSocket message is one moof+mdat fragment; the init segment is sent
+    ahead of the first one.
+    """
+
+    format = "fmp4"
+    media_type = "video/mp4"
+
+    def __init__(self, camera: CameraStream, **kwargs):
+        super().__init__(camera, **kwargs)
+        self._buffer = memoryview(bytearray(READ_BUFFER_SIZE))
+        self._parser = FragmentParser()
+
+    def build_command(self) -> List[str]:
+        """FFmpeg command that remuxes the camera stream into fragmented MP4"""
+        return [
+            "ffmpeg",
+            "-nostats",               # Progress comes from -progress; keep the status line out of stderr
+            "-loglevel", "info",
+            "-fflags", "+genpts+nobuffer",  # Raw H.264 has no timestamps of its own
+            "-analyzeduration", "0",
+            "-f", "h264",
+            "-framerate", str(self.config.framerate),
+            "-i", "pipe:0",
+            "-c:v", "copy",           # No re-encode
+            "-an",
+            "-f", "mp4",
+            "-movflags", "empty_moov+default_base_moof+frag_keyframe",
+            "-frag_duration", "100000",  # Cut a fragment at least every 100ms for low latency
+            "-progress", "pipe:2",
+            "pipe:1"
+        ]
+
+    def _reset_output(self) -> None:
+        self._parser = FragmentParser()
+
+    def _header(self) -> bytes:
+        return self._parser.init or b""
+
+    def _receive_buffer(self) -> memoryview:
+        return self._buffer
+
+    def _received(self, nbytes: int) -> List[Chunk]:
+        return [Chunk(fragment.data, fragment.keyframe) for fragment in self._parser.feed(self._buffer[:nbytes])]
+
+
+class H264Hub(StreamHub):
+    """The camera's own H.264 passed straight through as Annex-B access units, for WebCodecs players.
+
+    No FFmpeg process is involved: the hub reads the shared camera connection
+    directly and sends one access unit per WebSocket message.
+    """
+
+    format = "h264"
+    media_type = "video/h264"
+
+    def __init__(self, camera: CameraStream, **kwargs):
+        super().__init__(camera, **kwargs)
+        self._parser = AccessUnitParser()
+        self._sink: Optional[CallbackSink] = None
+
+    async def _start(self) -> None:
+        self._parser = AccessUnitParser()
+        self._sink = CallbackSink(f"h264-passthrough[{self.config.id}]", self._on_data)
+        self.camera.attach(self._sink)
+
+    def _on_data(self, data: memoryview) -> None:
+        units = self._parser.feed(data)
+        if units:
+            self._publish(Chunk(unit.data, unit.keyframe) for unit in units)
+
+    def _header(self) -> bytes:
+        return self._parser.parameter_sets
+
+    async def _stop(self) -> None:
+        sink, self._sink = self._sink, None
+        if sink:
+            await self.camera.detach(sink)
+            sink.close()
+
+
+HUB_FORMATS: Dict[str, Type[StreamHub]] = {
+    hub.format: hub for hub in (MpegTsHub, Fmp4Hub, H264Hub)
+}
+
+
+def create_hub(camera: CameraStream, supervisor: Optional[TranscoderSupervisor] = None, **kwargs) -> StreamHub:
+    """Build the hub for the WebSocket format a camera is configured with"""
+    hub_class = HUB_FORMATS[camera.config.ws_format]
+    if issubclass(hub_class, EncoderHub):
+        kwargs["supervisor"] = supervisor
+    return hub_class(camera, **kwargs)
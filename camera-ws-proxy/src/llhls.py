@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Deque, List, NamedTuple, Optional
+
+from .camera import CameraStream
+from .encoder import encoder_args, encoder_filters, output_framerate
+from .hub import Chunk, Fmp4Hub
+
+logger = logging.getLogger(__name__)
+
+
+class Part(NamedTuple):
+    data: bytes
+    duration: float
+    independent: bool  # Starts with a keyframe
+
+
+class Segment:
+    def __init__(self, msn: int, discontinuity: bool = False):
+        self.msn = msn
+        self.parts: List[Part] = []
+        self.duration = 0.0
+        self.complete = False
+        self.discontinuity = discontinuity
+        self.program_date_time = time.time()
+
+    @property
+    def data(self) -> bytes:
+        return b"".join(part.data for part in self.parts)
+
+
+class SegmentStore:
+    """In-memory LL-HLS media playlist for one rendition.
+
+    Fragments arrive as partial segments; a new segment starts at the first
+    independent part once the current one has reached `target_duration`. Only the
+    last `window` complete segments are kept, so nothing touches the disk.
+    Playlist and part requests can block until the media they ask for exists.
+    """
+
+    def __init__(self, target_duration: float = 1.0, part_target: float = 0.334, window: int = 6):
+        self.target_duration = target_duration
+        self.part_target = part_target
+        self.window = window
+        self.init: Optional[bytes] = None
+        self._segments: Deque[Segment] = deque()
+        self._next_msn = 0
+        self._discontinuity = False
+        self._changed = asyncio.Event()
+        self.updated_at: Optional[float] = None  # When the last part arrived
+
+    @property
+    def ready(self) -> bool:
+        return self.init is not None and any(segment.complete for segment in self._segments)
+
+    def reset(self) -> None:
+        """Drop buffered media, e.g. after the encoder restarted; sequence numbers keep counting"""
+        if self._segments:
+            self._discontinuity = True
+        self._segments.clear()
+        self.init = None
+        self._notify()
+
+    def add_part(self, data: bytes, duration: float, independent: bool) -> None:
+        current = self._segments[-1] if self._segments else None
+        # Small tolerance so frame durations summing to just under the target still close the segment
+        if current is None or (independent and current.parts and current.duration >= self.target_duration - 0.001):
+            if current is not None:
+                current.complete = True
+            elif not independent:
+                return  # A segment must start with a keyframe
+            current = Segment(self._next_msn, self._discontinuity)
+            self._next_msn += 1
+            self._discontinuity = False
+            self._segments.append(current)
+            while sum(1 for segment in self._segments if segment.complete) > self.window:
+                self._segments.popleft()
+        current.parts.append(Part(data, duration, independent))
+        current.duration += duration
+        self.updated_at = time.time()
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def is_too_far_ahead(self, msn: int) -> bool:
+        """Blocking requests more than two segments past the live edge are rejected, per the LL-HLS spec"""
+        return msn > self._next_msn + 1
+
+    def _find(self, msn: int) -> Optional[Segment]:
+        if not self._segments or msn < self._segments[0].msn:
+            return None
+        index = msn - self._segments[0].msn
+        return self._segments[index] if index < len(self._segments) else None
+
+    def _has(self, msn: int, part: Optional[int]) -> bool:
+        if self._segments and self._segments[-1].msn > msn:
+            return True
+        segment = self._find(msn)
+        if segment is None:
+            return False
+        if part is None:
+            return segment.complete
+        return segment.complete or len(segment.parts) > part
+
+    async def wait_for(self, msn: int, part: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+        """Block until segment `msn` (or part `part` of it) is available, as for _HLS_msn/_HLS_part"""
+        timeout = timeout if timeout is not None else 3 * self.target_duration
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not self._has(msn, part):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def get_segment(self, msn: int) -> Optional[bytes]:
+        segment = self._find(msn)
+        return segment.data if segment is not None and segment.complete else None
+
+    def get_part(self, msn: int, part: int) -> Optional[bytes]:
+        segment = self._find(msn)
+        if segment is None or part >= len(segment.parts):
+            return None
+        return segment.parts[part].data
+
+    def playlist(self) -> str:
+        segments = list(self._segments)
+        longest = max((segment.duration for segment in segments if segment.complete), default=self.target_duration)
+        part_target = max(
+            [self.part_target] + [part.duration for segment in segments for part in segment.parts]
+        )
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:9",
+            f"#EXT-X-TARGETDURATION:{max(1, math.ceil(longest))}",
+            f"#EXT-X-PART-INF:PART-TARGET={part_target:.3f}",
+            f"#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={3 * part_target:.3f}",
+            f"#EXT-X-MEDIA-SEQUENCE:{segments[0].msn if segments else self._next_msn}",
+            '#EXT-X-MAP:URI="init.mp4"',
+        ]
+        # Parts are only listed for segments close to the live edge
+        part_cutoff = len(segments) - 3
+        for index, segment in enumerate(segments):
+            if segment.discontinuity:
+                lines.append("#EXT-X-DISCONTINUITY")
+            if index == 0 or segment.discontinuity:
+                stamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(segment.program_date_time))
+                lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{stamp}.{int(segment.program_date_time % 1 * 1000):03d}Z")
+            if index >= part_cutoff:
+                for number, part in enumerate(segment.parts):
+                    independent = ",INDEPENDENT=YES" if part.independent else ""
+                    lines.append(
+                        f'#EXT-X-PART:DURATION={part.duration:.3f},URI="part_{segment.msn}_{number}.m4s"{independent}'
+                    )
+            if segment.complete:
+                lines.append(f"#EXTINF:{segment.duration:.3f},")
+                lines.append(f"segment_{segment.msn}.m4s")
+        if segments:
+            last = segments[-1]
+            msn, part = (last.msn + 1, 0) if last.complete else (last.msn, len(last.parts))
+            lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="part_{msn}_{part}.m4s"')
+        return "\n".join(lines) + "\n"
+
+
+class LLHlsHub(Fmp4Hub):
+    """Packages a camera into LL-HLS parts held in a SegmentStore instead of files on disk.
+
+    FFmpeg writes fragmented MP4 cut every `part_target` seconds; each fragment
+    becomes one partial segment. Passthrough cameras are remuxed, others are
+    encoded with libx264 to their HLS encoder profile, with a keyframe forced at
+    every segment boundary.
+    """
+
+    format = "llhls"
+
+    def __init__(self, camera: CameraStream, store: Optional[SegmentStore] = None, **kwargs):
+        super().__init__(camera, **kwargs)
+        self.store = store or SegmentStore()
+
+    def encoder_profile(self) -> Optional[str]:
+        return None if self.config.passthrough else self.config.hls_profile
+
+    def build_command(self) -> List[str]:
+        encoding = self.transcoder.encoding
+        if encoding is None:
+            codec_args = ["-c:v", "copy"]
+            framerate = self.config.framerate
+        else:
+            filters = encoder_filters(encoding.profile)
+            codec_args = [
+                *(["-vf", ",".join(filters)] if filters else []),
+                *encoder_args(encoding, "libx264"),
+                "-force_key_frames", f"expr:gte(t,n_forced*{self.store.target_duration})",
+            ]
+            framerate = output_framerate(encoding.profile, self.config)
+        return [
+            "ffmpeg",
+            "-nostats",               # Progress comes from -progress; keep the status line out of stderr
+            "-loglevel", "info",
+            "-fflags", "+genpts+nobuffer",
+            "-analyzeduration", "0",
+            "-f", "h264",
+            "-framerate", str(self.config.framerate),
+            "-i", "pipe:0",
+            *codec_args,
+            "-an",
+            "-f", "mp4",
+            "-movflags", "empty_moov+default_base_moof+frag_keyframe",
+            # FFmpeg cuts once a fragment exceeds this, so leave a frame of headroom under the part target
+            "-frag_duration", str(int((self.store.part_target - 1 / framerate) * 1_000_000)),
+            "-progress", "pipe:2",
+            "pipe:1"
+        ]
+
+    def _reset_output(self) -> None:
+        super()._reset_output()
+        self.store.reset()
+
+    def _received(self, nbytes: int) -> List[Chunk]:
+        for fragment in self._parser.feed(self._buffer[:nbytes]):
+            if self.store.init is None:
+                self.store.init = self._parser.init
+            self.store.add_part(fragment.data, fragment.duration / self._parser.timescale, fragment.keyframe)
+        # Parts live in the store; nothing goes through the viewer ring
+        return []
@@ -0,0 +1,78 @@
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Optional, Tuple
+
+LOG_QUEUE_SIZE = 10000  # Records waiting for the writer thread before new ones are dropped
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_records: "queue.Queue[Optional[Tuple[logging.LogRecord, List[logging.Handler]]]]" = queue.Queue(LOG_QUEUE_SIZE)
+_listener: Optional["LogWriter"] = None
+_handlers: List["DroppingQueueHandler"] = []
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Hands records to the writer thread, dropping them rather than blocking when it falls behind.
+
+    Records are queued as they are, so even the message is formatted on the writer
+    thread, by the handlers the logger had before.
+    """
+
+    def __init__(self, targets: List[logging.Handler]):
+        super().__init__(_records)
+        self.targets = targets
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait((record, self.targets))
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogWriter(QueueListener):
+    """The one thread that formats and writes every queued record, so lines keep their order"""
+
+    def __init__(self):
+        super().__init__(_records)
+
+    def handle(self, item: Tuple[logging.LogRecord, List[logging.Handler]]) -> None:
+        record, targets = item
+        for handler in targets:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+def dropped_records() -> int:
+    return sum(handler.dropped for handler in _handlers)
+
+
+def _route_through_queue(logger: logging.Logger) -> None:
+    """Replace a logger's handlers with one that queues records for them"""
+    targets = [handler for handler in logger.handlers if not isinstance(handler, QueueHandler)]
+    if not targets:
+        return
+    for handler in targets:
+        logger.removeHandler(handler)
+    queue_handler = DroppingQueueHandler(targets)
+    logger.addHandler(queue_handler)
+    _handlers.append(queue_handler)
+
+
+def setup_logging(level: int = logging.INFO) -> None:
+    """Log through a queue, so formatting and writing to stderr happen off the event loop.
+
+    Covers the root logger and Uvicorn's own, when Uvicorn configured them before importing the app.
+    """
+    global _listener
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+    for name in ("", "uvicorn", "uvicorn.access"):
+        _route_through_queue(logging.getLogger(name))
+    if _listener is None:
+        _listener = LogWriter()
+        _listener.start()
+        atexit.register(_listener.stop)
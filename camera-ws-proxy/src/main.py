@@ -1,11 +1,8 @@
-import logging
+from .logs import setup_logging
 from .server import CameraServer
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+setup_logging()
 
 # Create the FastAPI app
 server = CameraServer()
@@ -18,5 +15,6 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         log_level="info",
+        access_log=False,  # A line per request adds up with LL-HLS players fetching several parts a second
         reload=False # Disable auto-reload for testing FFmpeg stability
     )
@@ -0,0 +1,209 @@
+import logging
+import math
+import os
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from .logs import dropped_records as dropped_log_records
+
+if TYPE_CHECKING:
+    from .server import CameraServer
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"  # Starlette appends the charset
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+Labels = Dict[str, str]
+# A family as it travels between workers: type, description and (labels, value) samples
+Family = Tuple[str, str, List[Tuple[Labels, float]]]
+
+
+class Exposition:
+    """Metrics in the Prometheus text format, written by hand; only gauges and counters are needed.
+
+    `labels` are added to every sample, e.g. the worker in multi-worker mode.
+    """
+
+    def __init__(self, **labels: str):
+        self.labels = labels
+        self._families: Dict[str, Family] = {}
+
+    @property
+    def families(self) -> Dict[str, Family]:
+        return self._families
+
+    def add(self, name: str, kind: str, description: str, value: Optional[float], **labels: str) -> None:
+        """Record one sample; a None value (not known yet) only declares the family"""
+        _, _, samples = self._families.setdefault(name, (kind, description, []))
+        if value is not None:
+            samples.append(({**labels, **self.labels}, value))
+
+    def merge(self, families: Dict[str, Family]) -> None:
+        """Add another worker's samples, which already carry its labels"""
+        for name, (kind, description, samples) in families.items():
+            _, _, merged = self._families.setdefault(name, (kind, description, []))
+            merged.extend((labels, value) for labels, value in samples)
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, description, samples) in self._families.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        escaped = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if isinstance(value, bool) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def process_cpu_seconds(pid: int) -> Optional[float]:
+    """User plus system CPU time of a process from /proc, or None where that is unavailable"""
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            # Fields after the command name, which is parenthesised and may contain spaces
+            fields = stat.read().rsplit(")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def newest_playlist_age(output_dir: Path, now: float) -> Optional[float]:
+    """Seconds since FFmpeg last rewrote a playlist in output_dir, i.e. since its last segment"""
+    try:
+        newest = max((path.stat().st_mtime for path in output_dir.glob("*.m3u8")), default=None)
+    except OSError:
+        return None  # A playlist was replaced while we looked; try again next scrape
+    return now - newest if newest is not None else None
+
+
+def collect_metrics(server: "CameraServer") -> Exposition:
+    """The current state of this worker's cameras, encoders and viewers"""
+    metrics = Exposition(**({"worker": str(server.cluster.worker)} if server.cluster else {}))
+    now = time.time()
+
+    metrics.add("camera_proxy_cpu_seconds_total", "counter", "CPU time used by the proxy process itself",
+                process_cpu_seconds(os.getpid()))
+    metrics.add("camera_proxy_log_records_dropped_total", "counter", "Log records dropped because the log writer fell behind",
+                dropped_log_records())
+
+    for camera_id, camera in server.cameras.items():
+        if server.cluster and not server.cluster.owns(camera_id):
+            continue  # Only its owner reads the camera
+        metrics.add("camera_upstream_connected", "gauge", "Whether the TCP connection to the camera is open",
+                    int(camera.is_connected), camera=camera_id)
+        metrics.add("camera_upstream_bytes_total", "counter", "Bytes of H.264 received from the camera",
+                    camera.bytes_received, camera=camera_id)
+        metrics.add("camera_upstream_reconnects_total", "counter", "Reconnect attempts after the camera dropped or stalled",
+                    camera.reconnects, camera=camera_id)
+        metrics.add("camera_upstream_consumers", "gauge", "Encoders and in-process readers attached to the camera",
+                    camera.sink_count, camera=camera_id)
+
+    for transcoder in server.supervisor.transcoders:
+        labels = {"camera": transcoder.camera_id, "encoder": transcoder.name}
+        process = transcoder.process
+        metrics.add("camera_encoder_up", "gauge", "Whether the FFmpeg process is currently running",
+                    int(process is not None), **labels)
+        metrics.add("camera_encoder_restarts_total", "counter", "Times FFmpeg exited unexpectedly and was restarted",
+                    transcoder.restarts, **labels)
+        metrics.add("camera_encoder_cpu_seconds_total", "counter", "CPU time used by the current FFmpeg process",
+                    process_cpu_seconds(process.pid) if process else None, **labels)
+        metrics.add("camera_encoder_fps", "gauge", "Frames per second FFmpeg is producing",
+                    transcoder.progress_value("fps"), **labels)
+        metrics.add("camera_encoder_speed", "gauge", "Encoding speed relative to real time",
+                    transcoder.progress_value("speed"), **labels)
+        metrics.add("camera_encoder_frames_total", "counter", "Frames output by the current FFmpeg process",
+                    transcoder.progress_value("frame"), **labels)
+        metrics.add("camera_encoder_output_bytes_total", "counter", "Bytes written by the current FFmpeg process",
+                    transcoder.progress_value("total_size"), **labels)
+        metrics.add("camera_encoder_dropped_frames_total", "counter", "Frames FFmpeg dropped to keep up",
+                    transcoder.progress_value("drop_frames"), **labels)
+        metrics.add("camera_encoder_duplicated_frames_total", "counter", "Frames FFmpeg duplicated to fill gaps",
+                    transcoder.progress_value("dup_frames"), **labels)
+        if transcoder.encoding is not None and transcoder.process is not None:
+            metrics.add("camera_encoder_threads", "gauge", "Encoder threads the CPU scheduler gave the FFmpeg process",
+                        transcoder.encoding.threads, **labels)
+            metrics.add("camera_encoder_degraded", "gauge", "Whether FFmpeg runs its profile's fallback to save CPU",
+                        int(transcoder.encoding.degraded), **labels)
+        if transcoder.progress_time is not None:
+            metrics.add("camera_encoder_progress_age_seconds", "gauge", "Seconds since FFmpeg last reported progress",
+                        now - transcoder.progress_time, **labels)
+
+    # Viewers of this worker only; a camera another worker owns is watched through its relay
+    for camera_id, hub in {**server.relays, **server.hubs}.items():
+        metrics.add("camera_viewers", "gauge", "WebSocket viewers connected",
+                    hub.subscriber_count, camera=camera_id, format=hub.format)
+        # Aggregated per camera: a series per client would grow with every connection ever made
+        viewers = hub.subscriber_stats()
+        labels = {"camera": camera_id}
+        metrics.add("camera_viewer_send_latency_max_seconds", "gauge",
+                    "Smoothed time the slowest viewer takes to accept one chunk",
+                    max((viewer["send_latency"] for viewer in viewers), default=0.0), **labels)
+        metrics.add("camera_viewer_queue_depth_max", "gauge", "Chunks waiting to be sent to the furthest behind viewer",
+                    max((viewer["queue_depth"] for viewer in viewers), default=0), **labels)
+        metrics.add("camera_viewer_queued_chunks", "gauge", "Chunks waiting to be sent, summed over viewers",
+                    sum(viewer["queue_depth"] for viewer in viewers), **labels)
+        metrics.add("camera_viewer_sent_bytes_total", "counter", "Bytes sent to viewers",
+                    hub.sent_bytes, **labels)
+        metrics.add("camera_viewer_dropped_chunks_total", "counter", "Chunks skipped because a viewer fell behind",
+                    hub.dropped_chunks, **labels)
+
+    for camera_id, detector in server.motion.items():
+        metrics.add("camera_motion_active", "gauge", "Whether a motion event is in progress",
+                    int(detector.active), camera=camera_id)
+        metrics.add("camera_motion_score", "gauge", "Fraction of unmasked pixels that changed in the last compared frame",
+                    detector.score, camera=camera_id)
+        metrics.add("camera_motion_events_total", "counter", "Motion events started",
+                    detector.events_total, camera=camera_id)
+        metrics.add("camera_motion_frames_total", "counter", "Thumbnails compared by the motion detector",
+                    detector.frames, camera=camera_id)
+
+    for camera_id, recorder in server.recorders.items():
+        metrics.add("camera_recording_bytes", "gauge", "Bytes of footage kept on disk",
+                    recorder.total_bytes, camera=camera_id)
+        metrics.add("camera_recording_written_bytes_total", "counter", "Bytes recorded since the proxy started",
+                    recorder.bytes_written, camera=camera_id)
+        if recorder.segments:
+            metrics.add("camera_recording_oldest_seconds", "gauge", "Age of the oldest footage kept",
+                        now - recorder.segments[0].start, camera=camera_id)
+            metrics.add("camera_recording_last_write_age_seconds", "gauge", "Seconds since footage was last recorded",
+                        now - recorder.segments[-1].end, camera=camera_id)
+
+    for camera_id, cache in server.snapshots.items():
+        metrics.add("camera_snapshot_decodes_total", "counter", "Keyframes decoded into snapshot JPEGs",
+                    cache.decodes, camera=camera_id)
+        metrics.add("camera_snapshot_hits_total", "counter", "Snapshot requests answered from the cached JPEG",
+                    cache.hits, camera=camera_id)
+
+    if server.webrtc:
+        for camera_id, peers in server.webrtc.peer_counts().items():
+            metrics.add("camera_webrtc_peers", "gauge", "WebRTC peer connections open",
+                        peers, camera=camera_id)
+
+    for camera_id, transcoder in server.transcoders.items():
+        if transcoder.is_running:
+            metrics.add("camera_hls_segment_age_seconds", "gauge", "Seconds since the newest HLS segment was written",
+                        newest_playlist_age(server.streams_dir / camera_id, now), camera=camera_id)
+    for camera_id, hub in server.ll_hls.items():
+        if hub.is_running and hub.store.updated_at is not None:
+            metrics.add("camera_hls_segment_age_seconds", "gauge", "Seconds since the newest HLS segment was written",
+                        now - hub.store.updated_at, camera=camera_id)
+
+    return metrics
@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import math
+import socket
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Deque, Dict, List, Optional, Set
+
+try:
+    import numpy as np
+except ImportError:  # Only needed by cameras with motion detection enabled
+    np = None
+
+from .camera import CameraStream
+from .config import MotionConfig
+from .transcoder import Transcoder, TranscoderSupervisor
+
+logger = logging.getLogger(__name__)
+
+EVENT_HISTORY = 100  # Finished events kept per camera for GET /cameras/{id}/motion
+LISTENER_QUEUE = 32  # Messages a slow WebSocket listener may fall behind before missing some
+FRAME_TIMEOUT = 10.0  # Seconds without a thumbnail after which an event in progress is ended
+
+
+class MotionEvent:
+    """One period of motion, from the first frame over the threshold until the cooldown ran out"""
+
+    def __init__(self, started_at: float, score: float):
+        self.started_at = started_at
+        self.ended_at: Optional[float] = None
+        self.peak_score = score
+        self.frames = 0  # Compared frames during the event that showed motion
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "started_at": self.started_at,
+            "ended_at": self.ended_at,
+            "peak_score": self.peak_score,
+            "frames": self.frames,
+        }
+
+
+def build_mask(config: MotionConfig) -> "np.ndarray":
+    """Boolean thumbnail-sized array that is False inside every ignored zone"""
+    mask = np.ones((config.height, config.width), dtype=bool)
+    for zone in config.mask:
+        left = max(int(zone.x * config.width), 0)
+        top = max(int(zone.y * config.height), 0)
+        right = min(math.ceil((zone.x + zone.width) * config.width), config.width)
+        bottom = min(math.ceil((zone.y + zone.height) * config.height), config.height)
+        mask[top:bottom, left:right] = False
+    return mask
+
+
+class MotionDetector:
+    """Flags motion on a camera by comparing consecutive grayscale thumbnails.
+
+    A supervised FFmpeg decodes the shared camera connection and writes a few small
+    gray frames per second to a socket. Each frame is received into one preallocated
+    buffer and compared with the previous frame by NumPy without per-frame
+    allocations. An event starts once enough unmasked pixels change for
+    `min_frames` frames in a row, and ends after `cooldown` seconds without motion.
+    """
+
+    def __init__(self, camera: CameraStream, supervisor: TranscoderSupervisor):
+        if np is None:
+            raise RuntimeError("Motion detection requires NumPy (pip install numpy)")
+        self.camera = camera
+        self.config = camera.config.motion
+        self.supervisor = supervisor
+        self.transcoder: Optional[Transcoder] = None
+        self.active = False
+        self.score: Optional[float] = None  # Fraction of unmasked pixels that changed in the last frame
+        self.frames = 0
+        self.events_total = 0
+        self.current: Optional[MotionEvent] = None
+        self.events: Deque[MotionEvent] = deque(maxlen=EVENT_HISTORY)
+        self._listeners: Set[asyncio.Queue] = set()
+
+        shape = (self.config.height, self.config.width)
+        self._frame = bytearray(self.config.width * self.config.height)
+        self._pixels = np.frombuffer(self._frame, dtype=np.uint8).reshape(shape)  # View, not a copy
+        self._previous = np.zeros(shape, dtype=np.int16)  # Signed so the difference can go negative
+        self._difference = np.empty(shape, dtype=np.int16)
+        self._changed = np.empty(shape, dtype=bool)
+        self._mask = build_mask(self.config)
+        self._mask_pixels = max(int(np.count_nonzero(self._mask)), 1)
+        self._has_previous = False
+        self._moving_frames = 0
+        self._last_motion = 0.0
+
+    @property
+    def camera_id(self) -> str:
+        return self.camera.config.id
+
+    @property
+    def is_running(self) -> bool:
+        return self.transcoder is not None and self.transcoder.is_running
+
+    def build_command(self) -> List[str]:
+        config = self.config
+        cmd = [
+            "ffmpeg",
+            "-nostats",
+            "-loglevel", "info",
+            "-fflags", "+genpts+nobuffer",
+            "-analyzeduration", "0",
+            "-threads", "1",                # One decoder thread is plenty for a few thumbnails a second
+            "-skip_loop_filter", "all",     # Deblocking only matters for how the picture looks
+        ]
+        if config.keyframes_only:
+            cmd += ["-skip_frame", "nokey"]
+        filters = f"scale={config.width}:{config.height}:flags=fast_bilinear,format=gray"
+        if not config.keyframes_only:
+            filters = f"fps={config.fps}," + filters
+        cmd += [
+            "-f", "h264",
+            "-framerate", str(self.camera.config.framerate),
+            "-i", "pipe:0",
+            "-vf", filters,
+            # Without it, rawvideo output repeats each decoded keyframe to fill the input frame rate
+            *(["-fps_mode", "passthrough"] if config.keyframes_only else []),
+            "-an",
+            "-f", "rawvideo",
+            "-pix_fmt", "gray",
+            "-progress", "pipe:2",
+            "pipe:1"
+        ]
+        return cmd
+
+    def start(self) -> None:
+        """Start the thumbnail decoder under the supervisor"""
+        if self.is_running:
+            return
+        self.transcoder = self.supervisor.create("motion", self.camera, self.build_command, read_output=self._read_frames)
+        self.transcoder.start()
+
+    async def stop(self) -> None:
+        transcoder, self.transcoder = self.transcoder, None
+        if transcoder:
+            await transcoder.stop()
+        if self.active:
+            self._end_event(time.time())
+
+    def status(self) -> Dict[str, Any]:
+        """Current state plus recent events, newest first"""
+        events = ([self.current] if self.current else []) + list(reversed(self.events))
+        return {
+            "enabled": True,
+            "running": self.is_running,
+            "active": self.active,
+            "score": self.score,
+            "events": [event.as_dict() for event in events],
+        }
+
+    @asynccontextmanager
+    async def listen(self) -> AsyncGenerator[asyncio.Queue, None]:
+        """Queue receiving a message each time an event starts or ends"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=LISTENER_QUEUE)
+        self._listeners.add(queue)
+        try:
+            yield queue
+        finally:
+            self._listeners.discard(queue)
+
+    async def _read_frames(self, stdout: socket.socket) -> None:
+        """Analyse one FFmpeg process's thumbnails until it closes stdout"""
+        loop = asyncio.get_running_loop()
+        buffer = memoryview(self._frame)
+        filled = 0
+        # The first frame from a new process has nothing to compare with
+        self._has_previous = False
+        while True:
+            try:
+                nbytes = await asyncio.wait_for(loop.sock_recv_into(stdout, buffer[filled:]), FRAME_TIMEOUT)
+            except asyncio.TimeoutError:
+                # The camera is down or stalled, so the event would otherwise never end
+                if self.current is not None:
+                    self._end_event(time.time())
+                continue
+            if not nbytes:
+                logger.info(f"Motion thumbnails ended for {self.camera_id}")
+                break
+            filled += nbytes
+            if filled < len(buffer):
+                continue
+            filled = 0
+            if self.transcoder:
+                self.transcoder.mark_ready()
+            self._analyse(time.time())
+
+    def _analyse(self, now: float) -> None:
+        if not self._has_previous:
+            self._previous[...] = self._pixels
+            self._has_previous = True
+            return
+        np.subtract(self._pixels, self._previous, out=self._difference)
+        np.abs(self._difference, out=self._difference)
+        np.greater(self._difference, self.config.pixel_threshold, out=self._changed)
+        self._changed &= self._mask
+        score = np.count_nonzero(self._changed) / self._mask_pixels
+        self._previous[...] = self._pixels
+        self.frames += 1
+        self.score = score
+
+        moving = score >= self.config.threshold
+        if moving:
+            self._moving_frames += 1
+            self._last_motion = now
+        else:
+            self._moving_frames = 0
+
+        if self.current is None:
+            if self._moving_frames >= self.config.min_frames:
+                self._start_event(now, score)
+        elif moving:
+            self.current.frames += 1
+            self.current.peak_score = max(self.current.peak_score, score)
+        elif now - self._last_motion >= self.config.cooldown:
+            self._end_event(now)
+
+    def _start_event(self, now: float, score: float) -> None:
+        self.current = MotionEvent(now, score)
+        self.current.frames = self._moving_frames
+        self.active = True
+        self.events_total += 1
+        logger.info(f"Motion started on {self.camera_id} (score {score:.3f})")
+        self._broadcast("motion_start", self.current)
+
+    def _end_event(self, now: float) -> None:
+        event, self.current = self.current, None
+        self.active = False
+        event.ended_at = now
+        self.events.append(event)
+        logger.info(f"Motion ended on {self.camera_id} after {now - event.started_at:.1f}s "
+                    f"(peak score {event.peak_score:.3f})")
+        self._broadcast("motion_end", event)
+
+    def _broadcast(self, kind: str, event: MotionEvent) -> None:
+        message = {"type": kind, "camera": self.camera_id, "event": event.as_dict()}
+        for queue in self._listeners:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                pass  # A stalled listener misses events rather than holding memory
@@ -0,0 +1,148 @@
+import logging
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+TS_PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+PAT_PID = 0x0000
+# MPEG-1, MPEG-2, H.264 and HEVC video stream types from the PMT
+VIDEO_STREAM_TYPES = {0x01, 0x02, 0x1B, 0x24}
+
+
+class PacketBuffer:
+    """Preallocated receive buffer that hands out whole MPEG-TS packets without copying.
+
+    Callers read straight into `free` (e.g. with `sock_recv_into`), `commit` the byte
+    count, inspect `packets()` in place and then `consume()` them. Only the trailing
+    partial packet (< 188 bytes) is ever moved.
+    """
+
+    def __init__(self, size: int = 256 * 1024):
+        self._buffer = bytearray(size - size % TS_PACKET_SIZE)
+        self._view = memoryview(self._buffer)
+        self._filled = 0
+        self._aligned = 0
+
+    @property
+    def free(self) -> memoryview:
+        return self._view[self._filled:]
+
+    def commit(self, nbytes: int) -> None:
+        self._filled += nbytes
+
+    def packets(self) -> memoryview:
+        """View over every whole packet currently buffered, valid until `consume`"""
+        if self._filled and self._buffer[0] != SYNC_BYTE:
+            self._resync()
+        self._aligned = self._filled - self._filled % TS_PACKET_SIZE
+        return self._view[:self._aligned]
+
+    def consume(self) -> None:
+        """Drop the packets returned by `packets`, keeping any partial packet that follows"""
+        tail = self._filled - self._aligned
+        if tail:
+            self._buffer[:tail] = self._buffer[self._aligned:self._filled]
+        self._filled = tail
+        self._aligned = 0
+
+    def _resync(self) -> None:
+        """Discard bytes up to the next sync byte that is followed by another one a packet later"""
+        pos = self._buffer.find(SYNC_BYTE, 1, self._filled)
+        while pos != -1 and pos + TS_PACKET_SIZE < self._filled and self._buffer[pos + TS_PACKET_SIZE] != SYNC_BYTE:
+            pos = self._buffer.find(SYNC_BYTE, pos + 1, self._filled)
+        drop = self._filled if pos == -1 else pos
+        logger.warning(f"Lost MPEG-TS sync, skipping {drop} bytes")
+        remaining = self._filled - drop
+        self._buffer[:remaining] = self._buffer[drop:self._filled]
+        self._filled = remaining
+
+
+def _payload_offset(packet: memoryview) -> int:
+    """Offset of the payload inside a packet, past the header and any adaptation field"""
+    if packet[3] & 0x20:
+        return 5 + packet[4]
+    return 4
+
+
+class TSScanner:
+    """Follows PAT/PMT to find the video PID and the random access points on it.
+
+    Packets are read in place; only PAT/PMT packets are copied so they can be
+    replayed ahead of a cached GOP.
+    """
+
+    def __init__(self):
+        self.pmt_pid: Optional[int] = None
+        self.video_pid: Optional[int] = None
+        self.pat: Optional[bytes] = None
+        self.pmt: Optional[bytes] = None
+
+    @property
+    def tables(self) -> List[bytes]:
+        """Latest PAT and PMT packets, or nothing until both have been seen"""
+        if self.pat is None or self.pmt is None:
+            return []
+        return [self.pat, self.pmt]
+
+    def find_random_access(self, packets: memoryview) -> List[int]:
+        """Offsets of video packets that start a PES with the random access indicator set"""
+        offsets = []
+        for offset in range(0, len(packets), TS_PACKET_SIZE):
+            pid = ((packets[offset + 1] & 0x1F) << 8) | packets[offset + 2]
+            unit_start = packets[offset + 1] & 0x40
+            if pid == self.video_pid:
+                # Adaptation field present, non-empty and flagged random access
+                if unit_start and packets[offset + 3] & 0x20 and packets[offset + 4] and packets[offset + 5] & 0x40:
+                    offsets.append(offset)
+            elif pid == PAT_PID:
+                packet = packets[offset:offset + TS_PACKET_SIZE]
+                self.pat = bytes(packet)
+                if unit_start:
+                    self._parse_pat(packet)
+            elif pid == self.pmt_pid:
+                packet = packets[offset:offset + TS_PACKET_SIZE]
+                self.pmt = bytes(packet)
+                if unit_start:
+                    self._parse_pmt(packet)
+        return offsets
+
+    def _section(self, packet: memoryview) -> Optional[memoryview]:
+        start = _payload_offset(packet)
+        if start >= TS_PACKET_SIZE:
+            return None
+        start += 1 + packet[start]  # Skip pointer_field
+        section = packet[start:]
+        if len(section) < 3:
+            return None
+        length = ((section[1] & 0x0F) << 8) | section[2]
+        return section[:3 + length]
+
+    def _parse_pat(self, packet: memoryview) -> None:
+        section = self._section(packet)
+        if section is None or section[0] != 0x00:
+            return
+        # Program loop runs from byte 8 to the CRC
+        for pos in range(8, len(section) - 4, 4):
+            program = (section[pos] << 8) | section[pos + 1]
+            if program != 0:
+                pmt_pid = ((section[pos + 2] & 0x1F) << 8) | section[pos + 3]
+                if pmt_pid != self.pmt_pid:
+                    self.pmt_pid = pmt_pid
+                    self.video_pid = None
+                return
+
+    def _parse_pmt(self, packet: memoryview) -> None:
+        section = self._section(packet)
+        if section is None or section[0] != 0x02 or len(section) < 12:
+            return
+        pos = 12 + (((section[10] & 0x0F) << 8) | section[11])
+        while pos + 5 <= len(section) - 4:
+            stream_type = section[pos]
+            pid = ((section[pos + 1] & 0x1F) << 8) | section[pos + 2]
+            if stream_type in VIDEO_STREAM_TYPES:
+                if pid != self.video_pid:
+                    logger.debug(f"MPEG-TS video stream type 0x{stream_type:02x} on PID {pid}")
+                self.video_pid = pid
+                return
+            pos += 5 + (((section[pos + 3] & 0x0F) << 8) | section[pos + 4])
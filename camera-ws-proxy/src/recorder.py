@@ -0,0 +1,399 @@
+import asyncio
+import bisect
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from collections import deque
+from functools import partial
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Deque, Dict, Iterator, List, NamedTuple, Optional
+
+from .camera import CallbackSink, CameraStream
+from .h264 import NAL_SPS, AccessUnit, AccessUnitParser
+
+logger = logging.getLogger(__name__)
+
+# One index record per keyframe: wall-clock time, segment number, byte offset in that segment
+RECORD = struct.Struct("<dIQ")
+INDEX_NAME = "index"
+CLIP_CHUNK_SIZE = 1024 * 1024
+# Rewrite the index without deleted segments' records once they are this many and outnumber the live ones
+COMPACT_MIN_RECORDS = 4096
+# Access units waiting for the disk, about 30s at 30 fps, before recording skips to the next keyframe
+MAX_PENDING_WRITES = 900
+
+
+def segment_name(seq: int) -> str:
+    return f"{seq:08d}.h264"
+
+
+class RecordedSegment:
+    """One segment file; it starts with a keyframe and SPS/PPS so it decodes on its own"""
+
+    def __init__(self, seq: int, start: float, first_record: int, size: int = 0):
+        self.seq = seq
+        self.start = start
+        self.end = start  # Time of the newest access unit written
+        self.size = size
+        self.first_record = first_record  # Number of the segment's first keyframe record, counted since the index began
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"segment": self.seq, "start": self.start, "end": self.end, "bytes": self.size}
+
+
+class ClipRange(NamedTuple):
+    seq: int
+    start: int
+    end: int
+
+
+class _IndexTimes:
+    """Read-only sequence of keyframe times in a mapped index, so bisect can search it in place"""
+
+    def __init__(self, index: mmap.mmap, count: int):
+        self._index = index
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, position: int) -> float:
+        return RECORD.unpack_from(self._index, position * RECORD.size)[0]
+
+
+class DiskWriter:
+    """A thread running one recorder's file operations in order, so a slow disk never stalls the camera's pump"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._operations: "queue.Queue[Optional[Callable[[], None]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        return self._operations.qsize()
+
+    def submit(self, operation: Callable[[], None]) -> None:
+        self._operations.put_nowait(operation)
+
+    def _run(self) -> None:
+        while True:
+            operation = self._operations.get()
+            if operation is None:
+                return
+            try:
+                operation()
+            except OSError as e:
+                logger.error(f"{self.name} failed: {e}")
+            except Exception:
+                logger.exception(f"{self.name} failed")
+
+    async def close(self) -> None:
+        """Finish every queued operation, then end the thread"""
+        self._operations.put_nowait(None)
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+
+
+class Recorder:
+    """Continuously records a camera's H.264 to disk, without re-encoding, for later clip export.
+
+    Access units from the shared camera connection are appended to fixed-size
+    segment files, each cut at a keyframe. Every keyframe also gets a fixed-size
+    record in an append-only index. The index maps wall-clock time to segment and
+    byte offset, and is binary searched through mmap, so finding a clip costs the
+    same after days of footage. The oldest segments are deleted to stay within
+    `max_bytes` and `max_age`.
+
+    The bookkeeping happens on the event loop as access units arrive, while the files
+    are written, deleted and compacted by a DiskWriter thread, so the disk may lag
+    behind `segments` by whatever is still queued.
+    """
+
+    def __init__(self, camera: CameraStream, directory: Path):
+        self.camera = camera
+        self.config = camera.config.recording
+        self.directory = directory
+        self.segments: Deque[RecordedSegment] = deque()
+        self.total_bytes = 0
+        self.bytes_written = 0
+        self._parser = AccessUnitParser()
+        self._sink: Optional[CallbackSink] = None
+        self._writer: Optional[DiskWriter] = None
+        self._segment_open = False  # A segment was started since recording started
+        self._skipping = False  # Dropping access units until the next keyframe, after the disk fell behind
+        self._records = 0  # Index records written since the index began, including those of deleted segments
+        self._last_time = 0.0
+        self._compacted_to = 0  # First record kept by the last compaction asked of the writer
+        # Only used by the writer thread
+        self._file: Optional[BinaryIO] = None  # Segment currently being written
+        self._index: Optional[BinaryIO] = None
+        # First record still in the index file; changed by the writer and read by clip_ranges under the lock
+        self._index_base = 0
+        self._index_lock = threading.Lock()
+
+    @property
+    def camera_id(self) -> str:
+        return self.camera.config.id
+
+    @property
+    def is_running(self) -> bool:
+        return self._sink is not None
+
+    @property
+    def index_path(self) -> Path:
+        return self.directory / INDEX_NAME
+
+    def start(self) -> None:
+        """Pick up the existing recordings and start appending to them"""
+        if self.is_running:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._load_index()
+        self._writer = DiskWriter(f"recorder[{self.camera_id}]")
+        self._writer.submit(self._open_index)
+        self._segment_open = False
+        self._skipping = False
+        self._parser = AccessUnitParser()
+        self._sink = CallbackSink(f"recorder[{self.camera_id}]", self._on_data)
+        self.camera.attach(self._sink)
+        logger.info(f"Recording {self.camera_id} to {self.directory} "
+                    f"({len(self.segments)} segments, {self.total_bytes} bytes kept)")
+
+    async def stop(self) -> None:
+        sink, self._sink = self._sink, None
+        if sink:
+            await self.camera.detach(sink)
+            sink.close()
+        writer, self._writer = self._writer, None
+        if writer:
+            writer.submit(self._close_files)
+            await writer.close()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "recording": self.is_running,
+            "start": self.segments[0].start if self.segments else None,
+            "end": self.segments[-1].end if self.segments else None,
+            "bytes": self.total_bytes,
+            "segments": [segment.as_dict() for segment in self.segments],
+        }
+
+    def _load_index(self) -> None:
+        """Rebuild the segment list from the index; the only file read besides one stat per segment"""
+        self.segments.clear()
+        self.total_bytes = 0
+        try:
+            data = self.index_path.read_bytes()
+        except FileNotFoundError:
+            data = b""
+        whole = len(data) - len(data) % RECORD.size
+        if whole != len(data):
+            # A record cut short by a crash; drop it so appends stay aligned
+            logger.warning(f"Truncating partial record at the end of {self.index_path}")
+            os.truncate(self.index_path, whole)
+        self._records = whole // RECORD.size
+        self._index_base = 0
+        self._compacted_to = 0
+        for position, (when, seq, _) in enumerate(RECORD.iter_unpack(data[:whole])):
+            if not self.segments or self.segments[-1].seq != seq:
+                self.segments.append(RecordedSegment(seq, when, position))
+            self.segments[-1].end = when
+            self._last_time = max(self._last_time, when)
+        for segment in list(self.segments):
+            try:
+                segment.size = (self.directory / segment_name(segment.seq)).stat().st_size
+            except FileNotFoundError:
+                self.segments.remove(segment)  # Deleted by retention just before a restart
+                continue
+            self.total_bytes += segment.size
+
+    def _on_data(self, data: memoryview) -> None:
+        for unit in self._parser.feed(data):
+            self._write(unit)
+
+    def _write(self, unit: AccessUnit) -> None:
+        if self._writer.pending >= MAX_PENDING_WRITES:
+            if not self._skipping:
+                logger.warning(f"Disk is not keeping up with recording {self.camera_id}, skipping to the next keyframe")
+            self._skipping = True
+            return
+        if self._skipping and not unit.keyframe:
+            return
+        self._skipping = False
+        # Clamped so the index stays sorted if the wall clock steps back
+        now = max(time.time(), self._last_time)
+        self._last_time = now
+        data = unit.data
+        record = None
+        if unit.keyframe:
+            if not self._segment_open or self.segments[-1].size >= self.config.segment_bytes:
+                self._open_segment(now)
+            if not self._starts_with_sps(data):
+                # Make every indexed keyframe a point a decoder can start from
+                data = self._parser.parameter_sets + data
+            segment = self.segments[-1]
+            record = RECORD.pack(now, segment.seq, segment.size)
+            self._records += 1
+        elif not self._segment_open:
+            return  # A segment has to start at a keyframe
+        segment = self.segments[-1]
+        self._writer.submit(partial(self._append, record, data))
+        segment.size += len(data)
+        segment.end = now
+        self.total_bytes += len(data)
+        self.bytes_written += len(data)
+
+    @staticmethod
+    def _starts_with_sps(data: bytes) -> bool:
+        start = data.find(b"\x00\x00\x01")
+        return start != -1 and start + 3 < len(data) and data[start + 3] & 0x1F == NAL_SPS
+
+    def _open_segment(self, now: float) -> None:
+        seq = self.segments[-1].seq + 1 if self.segments else 0
+        self._writer.submit(partial(self._create_segment, seq))
+        self._segment_open = True
+        self.segments.append(RecordedSegment(seq, now, self._records))
+        self._enforce_retention(now)
+
+    # Run on the writer thread
+
+    def _open_index(self) -> None:
+        self._index = open(self.index_path, "ab", buffering=0)
+
+    def _create_segment(self, seq: int) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+        try:
+            self._file = open(self.directory / segment_name(seq), "wb", buffering=0)
+        except OSError as e:
+            logger.error(f"Could not create recording segment {seq} of {self.camera_id}, "
+                         f"skipping it until the next segment: {e}")
+
+    def _append(self, record: Optional[bytes], data: bytes) -> None:
+        if self._file is None:
+            return  # The segment failed and was logged; recording resumes with the next one
+        try:
+            # Unbuffered, so everything written can be exported while the segment grows
+            view = memoryview(data)
+            while view:
+                view = view[self._file.write(view):]
+        except OSError as e:
+            logger.error(f"Failed to write recording segment of {self.camera_id}, "
+                         f"skipping it until the next segment: {e}")
+            self._file.close()
+            self._file = None
+            return
+        # Only once the data is on disk, so the index never points past the end of a segment
+        if record is not None and self._index is not None:
+            self._index.write(record)
+
+    def _delete_segment(self, seq: int) -> None:
+        try:
+            (self.directory / segment_name(seq)).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _close_files(self) -> None:
+        for handle in (self._file, self._index):
+            if handle:
+                handle.close()
+        self._file = None
+        self._index = None
+
+    def _enforce_retention(self, now: float) -> None:
+        """Delete the oldest segments past the size or age limit, never the one being written"""
+        while len(self.segments) > 1:
+            oldest = self.segments[0]
+            too_big = self.config.max_bytes is not None and self.total_bytes > self.config.max_bytes
+            too_old = self.config.max_age is not None and oldest.end < now - self.config.max_age
+            if not (too_big or too_old):
+                break
+            self.segments.popleft()
+            self.total_bytes -= oldest.size
+            self._writer.submit(partial(self._delete_segment, oldest.seq))
+            logger.info(f"Deleted recording segment {oldest.seq} of {self.camera_id}")
+        self._compact_index()
+
+    def _compact_index(self) -> None:
+        """Drop deleted segments' records from the front of the index once they are most of it"""
+        first_live = self.segments[0].first_record
+        dead = first_live - self._compacted_to
+        if dead < COMPACT_MIN_RECORDS or dead < self._records - first_live:
+            return
+        self._compacted_to = first_live
+        self._writer.submit(partial(self._rewrite_index, first_live))
+
+    def _rewrite_index(self, first_live: int) -> None:
+        """On the writer thread, which alone appends to the index, so nothing is written meanwhile"""
+        dead = first_live - self._index_base
+        with open(self.index_path, "rb") as index:
+            index.seek(dead * RECORD.size)
+            live = index.read()
+        replacement = self.index_path.with_suffix(".tmp")
+        replacement.write_bytes(live)
+        with self._index_lock:
+            os.replace(replacement, self.index_path)
+            self._index_base = first_live
+        self._index.close()
+        self._index = open(self.index_path, "ab", buffering=0)
+        logger.info(f"Compacted recording index of {self.camera_id}, dropped {dead} records")
+
+    def clip_ranges(self, start: float, end: float) -> List[ClipRange]:
+        """Byte ranges of the segments covering [start, end], from the last keyframe at or before start"""
+        if not self.segments or end <= start:
+            return []
+        with self._index_lock:
+            # The file and its first record number must come from the same side of a compaction
+            index_file = open(self.index_path, "rb")
+            first_live = self.segments[0].first_record - self._index_base
+        with index_file:
+            if os.fstat(index_file.fileno()).st_size < RECORD.size:
+                return []  # The first record is still queued for the disk
+            with mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ) as index:
+                count = len(index) // RECORD.size
+                times = _IndexTimes(index, count)
+                first = max(bisect.bisect_right(times, start, first_live) - 1, first_live)
+                after = bisect.bisect_left(times, end, first)
+                if first >= count:
+                    return []
+                _, first_seq, first_offset = RECORD.unpack_from(index, first * RECORD.size)
+                # The keyframe after the range ends the clip; without one it runs to the live edge
+                last_seq, last_offset = None, None
+                if after < count:
+                    _, last_seq, last_offset = RECORD.unpack_from(index, after * RECORD.size)
+
+        ranges = []
+        for segment in self.segments:
+            if segment.seq < first_seq or (last_seq is not None and segment.seq > last_seq):
+                continue
+            range_start = first_offset if segment.seq == first_seq else 0
+            range_end = last_offset if segment.seq == last_seq else segment.size
+            if range_end > range_start:
+                ranges.append(ClipRange(segment.seq, range_start, range_end))
+        return ranges
+
+    def read_clip(self, ranges: List[ClipRange]) -> Iterator[bytes]:
+        """Stream byte ranges straight out of mapped segment files.
+
+        A plain generator: blocking page faults happen in the thread Starlette iterates it on.
+        The clip ends early if retention deletes a segment before it is reached.
+        """
+        for seq, start, end in ranges:
+            try:
+                segment_file = open(self.directory / segment_name(seq), "rb")
+            except FileNotFoundError:
+                logger.warning(f"Recording segment {seq} of {self.camera_id} was deleted during export")
+                return
+            if os.fstat(segment_file.fileno()).st_size <= start:
+                segment_file.close()
+                return  # Still queued for the disk
+            with segment_file, mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                end = min(end, len(data))
+                for offset in range(start, end, CLIP_CHUNK_SIZE):
+                    yield data[offset:min(offset + CLIP_CHUNK_SIZE, end)]
@@ -1,30 +1,81 @@
 import asyncio
 import logging
-from typing import Dict
+import os
+import re
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
 from pathlib import Path
-import subprocess
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
+import httpx
+import uvicorn
+import websockets
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request, Query
 from starlette.websockets import WebSocketState # For checking WebSocket state
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 
-from .config import Config, CameraConfig
+from .config import LIVE_CAMERA_FIELDS, Config, CameraConfig, camera_changes
 from .camera import CameraStream
+from .cluster import RELAY_CHUNK, RELAY_HEADER, RELAY_KEYFRAME, Cluster, RelayHub
+from .encoder import CpuScheduler
+from .hub import H264Hub, StreamHub, create_hub
+from .hls import build_hls_command, hls_encodes
+from .llhls import LLHlsHub
+from .motion import MotionDetector
+from .recorder import Recorder
+from .snapshot import SnapshotCache, SnapshotError
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, collect_metrics
+from .transcoder import Transcoder, TranscoderLimitError, TranscoderSupervisor
+from .webrtc import WebRtcGateway, WebRtcOffer
+
+PART_PATTERN = re.compile(r"part_(\d+)_(\d+)\.m4s")
+SEGMENT_PATTERN = re.compile(r"segment_(\d+)\.m4s")
+HLS_READY_TIMEOUT = 10.0  # Seconds start_hls waits for the first playlist before answering
+SNAPSHOT_TIMEOUT = 5.0  # Seconds a snapshot request waits for a keyframe from a camera not yet watched
+SNAPSHOT_DECODES = 2  # Snapshot FFmpegs allowed at once across all cameras
+CONFIG_POLL_INTERVAL = 2.0  # Seconds between checks of the config file for changes
+STARTUP_STAGGER = 0.1  # Seconds between starting background cameras, so dozens do not spawn FFmpeg at once
+CLUSTER_REFRESH = 2.0  # Seconds between registry updates and takeover attempts in multi-worker mode
+WORKER_QUERY_TIMEOUT = 2.0  # Seconds /metrics and /viewers wait for each other worker's share
+# Requests that need the camera's owner: its LL-HLS store, transcoder, detector, recorder or snapshot cache
+OWNER_PATH_PATTERN = re.compile(r"/cameras/([^/]+)/(?:hls/|motion|recordings|snapshot|webrtc)|/streams/([^/]+)/")
+HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "date", "server"}
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG) # Changed to DEBUG to see chunk logs
 
 class CameraServer:
-    def __init__(self):
-        self.app = FastAPI(title="Camera Stream Proxy")
-        self.config = Config.load_default()
+    def __init__(self, config: Optional[Config] = None, config_path: Optional[Path] = None):
+        self.app = FastAPI(title="Camera Stream Proxy", lifespan=self.lifespan)
+        self.config_path = config_path or (Config.config_path() if config is None else None)
+        if config is None:
+            config = Config.load(self.config_path) if self.config_path else Config.load_default()
+        self.config = config
+        self.supervisor = TranscoderSupervisor(
+            self.config.max_transcoders, CpuScheduler(self.config.encoder_profiles, self.config.cpu_budget)
+        )
         self.cameras: Dict[str, CameraStream] = {}
-        self.transcoders: Dict[str, subprocess.Popen] = {}
+        self.transcoders: Dict[str, Transcoder] = {}
+        self.hubs: Dict[str, StreamHub] = {}
+        self.ll_hls: Dict[str, LLHlsHub] = {}
+        self.motion: Dict[str, MotionDetector] = {}
+        self.recorders: Dict[str, Recorder] = {}
+        self.snapshots: Dict[str, SnapshotCache] = {}
+        self.snapshot_decodes = asyncio.Semaphore(SNAPSHOT_DECODES)
+        self.relays: Dict[str, RelayHub] = {}
+        self.webrtc_hubs: Dict[str, H264Hub] = {}  # For cameras whose WebSocket hub is not already H.264
+        self.webrtc: Optional[WebRtcGateway] = None
+        self.cluster = Cluster(Path(self.config.cluster_dir)) if self.config.cluster_dir else None
+        self._owner_clients: Dict[str, httpx.AsyncClient] = {}
+        self._restarts: Dict[str, asyncio.Event] = {}  # Cameras restarting for a config change, set once they are back
+        self._restarted_hubs: "weakref.WeakSet[StreamHub]" = weakref.WeakSet()  # Hubs those restarts stopped
 
         # Create streams directory for HLS
         self.streams_dir = Path("streams")
         self.streams_dir.mkdir(exist_ok=True)
+        self.recordings_dir = Path(self.config.recordings_dir)
 
         # Setup CORS
         self.app.add_middleware(
@@ -35,12 +86,13 @@ class CameraServer:
             allow_headers=["*"],
         )
 
+        if self.cluster:
+            self.app.middleware("http")(self.forward_to_owner)
+
         # Register routes
         self.setup_routes()
 
     def setup_routes(self):
-        # Mount static files for HLS streams
-        self.app.mount("/streams", StaticFiles(directory="streams"), name="streams")
         # Mount static files for web player
         self.app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -48,17 +100,16 @@ class CameraServer:
         async def list_cameras():
             cameras = []
             for cam_id, cam in self.config.cameras.items():
-                hls_ready = (self.streams_dir / cam_id / "index.m3u8").exists()
                 cameras.append({
                     "id": cam_id,
                     "name": cam.name,
                     "location": cam.location,
                     "enabled": cam.enabled,
                     "resolution": cam.resolution,
-                    "status": {
-                        "websocket": cam_id in self.cameras,
-                        "hls": hls_ready
-                    }
+                    "passthrough": cam.passthrough,
+                    "ws_format": cam.ws_format,
+                    "low_latency_hls": cam.low_latency_hls,
+                    "status": self.camera_status(cam_id)
                 })
             return {"cameras": cameras}
 
@@ -71,55 +122,189 @@ class CameraServer:
             if not camera_config.enabled:
                 raise HTTPException(status_code=400, detail=f"Camera {camera_id} is disabled")
 
-            output_dir = self.streams_dir / camera_id
-            output_dir.mkdir(parents=True, exist_ok=True)
-            output_path = output_dir / "index.m3u8"
-
-            if camera_id in self.transcoders and self.transcoders[camera_id].poll() is None:
-                return {"status": "already running", "hls_url": f"/streams/{camera_id}/index.m3u8"}
-
-            cmd = [
-                "ffmpeg",
-                "-fflags", "nobuffer",
-                "-flags", "low_delay",
-                "-strict", "experimental",
-                "-probesize", "32",
-                "-analyzeduration", "0",
-                "-i", f"tcp://{camera_config.ip_address}:{camera_config.port}",
-                "-c:v", "libx264",
-                "-preset", "ultrafast",
-                "-tune", "zerolatency",
-                "-f", "hls",
-                "-hls_time", "1",
-                "-hls_list_size", "5",
-                "-hls_flags", "delete_segments+omit_endlist",
-                "-progress", "pipe:2",    # Output progress to stderr
-                str(output_path)
-            ]
-
-            logger.info(f"Starting ffmpeg for HLS: {' '.join(cmd)}")
             try:
-                proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                self.transcoders[camera_id] = proc
+                started = await self.start_hls_output(camera_id)
+            except TranscoderLimitError as e:
+                raise HTTPException(status_code=503, detail=str(e))
             except Exception as e:
-                logger.error(f"Failed to start ffmpeg: {e}")
+                logger.error(f"Failed to start HLS for {camera_id}: {e}")
                 raise HTTPException(status_code=500, detail="Failed to start HLS stream")
-
-            return {"status": "started", "hls_url": f"/streams/{camera_id}/index.m3u8"}
+            response: Dict[str, Any] = {
+                "status": "started" if started else "already running",
+                "hls_url": f"/streams/{camera_id}/index.m3u8"
+            }
+            if not camera_config.low_latency_hls:
+                transcoder = self.transcoders[camera_id]
+                # Answer once the first segment is listed, so the player's first request succeeds
+                response["ready"] = await transcoder.wait_ready(HLS_READY_TIMEOUT) if started else transcoder.is_ready
+            return response
 
         @self.app.post("/cameras/{camera_id}/hls/stop")
         async def stop_hls(camera_id: str):
-            proc = self.transcoders.get(camera_id)
-            if proc:
-                proc.terminate()
-                proc.wait()
-                del self.transcoders[camera_id]
+            hub = self.ll_hls.get(camera_id)
+            if hub:
+                await hub.stop()
+            await self.stop_transcoder(camera_id)
             return {"status": "stopped"}
 
+        @self.app.get("/streams/{camera_id}/{path:path}")
+        async def hls_file(
+            camera_id: str,
+            path: str,
+            msn: Optional[int] = Query(None, alias="_HLS_msn"),
+            part: Optional[int] = Query(None, alias="_HLS_part"),
+        ):
+            """Serve HLS from memory for LL-HLS cameras, falling back to FFmpeg's files on disk"""
+            hub = self.ll_hls.get(camera_id)
+            if hub is None or not hub.is_running:
+                streams_root = self.streams_dir.resolve()
+                file_path = (streams_root / camera_id / path).resolve()
+                if streams_root not in file_path.parents or not file_path.is_file():
+                    raise HTTPException(status_code=404, detail="Not found")
+                return FileResponse(file_path)
+
+            store = hub.store
+            if path == "index.m3u8":
+                # Blocking playlist reload: hold the request until the asked-for part exists
+                if msn is not None and store.is_too_far_ahead(msn):
+                    raise HTTPException(status_code=400, detail="_HLS_msn is too far ahead of the live edge")
+                if msn is not None and not await store.wait_for(msn, part):
+                    raise HTTPException(status_code=503, detail="Requested part not available")
+                return Response(
+                    store.playlist(),
+                    media_type="application/vnd.apple.mpegurl",
+                    headers={"Cache-Control": "no-cache"}
+                )
+            if path == "init.mp4":
+                if store.init is None:
+                    raise HTTPException(status_code=404, detail="Init segment not ready")
+                return Response(store.init, media_type="video/mp4")
+            match = PART_PATTERN.fullmatch(path)
+            if match:
+                part_msn, part_index = int(match.group(1)), int(match.group(2))
+                # Preload hints name parts before they exist
+                await store.wait_for(part_msn, part_index)
+                data = store.get_part(part_msn, part_index)
+            else:
+                match = SEGMENT_PATTERN.fullmatch(path)
+                data = store.get_segment(int(match.group(1))) if match else None
+            if data is None:
+                raise HTTPException(status_code=404, detail="Not found")
+            return Response(data, media_type="video/iso.segment", headers={"Cache-Control": "max-age=60"})
+
+        @self.app.get("/metrics")
+        async def metrics():
+            """Prometheus scrape endpoint; in multi-worker mode every worker's metrics, labelled by worker"""
+            exposition = collect_metrics(self)
+            for _, families in await self.ask_workers("/internal/metrics"):
+                exposition.merge(families)
+            return Response(exposition.render(), media_type=METRICS_CONTENT_TYPE)
+
+        @self.app.get("/internal/metrics")
+        async def worker_metrics(request: Request):
+            """This worker's own metrics, for the worker answering /metrics; only served on the Unix socket"""
+            if self.cluster is None or request.client is not None:
+                raise HTTPException(status_code=404, detail="Not found")
+            return collect_metrics(self).families
+
+        @self.app.get("/cameras/{camera_id}/motion")
+        async def get_motion(camera_id: str):
+            if camera_id not in self.config.cameras:
+                raise HTTPException(status_code=404, detail=f"Camera {camera_id} not found")
+            detector = self.motion.get(camera_id)
+            if detector is None:
+                return {"enabled": False, "running": False, "active": False, "score": None, "events": []}
+            return detector.status()
+
+        @self.app.get("/cameras/{camera_id}/snapshot.jpg")
+        async def snapshot(camera_id: str):
+            """Thumbnail of the camera's latest keyframe, for previews without a stream"""
+            if camera_id not in self.config.cameras:
+                raise HTTPException(status_code=404, detail=f"Camera {camera_id} not found")
+            camera_config = self.config.cameras[camera_id]
+            if not camera_config.enabled:
+                raise HTTPException(status_code=400, detail=f"Camera {camera_id} is disabled")
+            cache = self.snapshots.get(camera_id)
+            if cache is None:
+                cache = SnapshotCache(self.get_camera(camera_id), self.snapshot_decodes)
+                self.snapshots[camera_id] = cache
+            try:
+                jpeg = await cache.get(SNAPSHOT_TIMEOUT)
+            except SnapshotError as e:
+                logger.warning(f"No snapshot for {camera_id}: {e}")
+                raise HTTPException(status_code=503, detail=str(e))
+            return Response(jpeg, media_type="image/jpeg", headers={
+                "Cache-Control": f"max-age={int(camera_config.snapshot.refresh)}",
+                "X-Snapshot-Age": f"{cache.age or 0.0:.1f}"
+            })
+
+        @self.app.get("/cameras/{camera_id}/recordings")
+        async def list_recordings(camera_id: str):
+            if camera_id not in self.config.cameras:
+                raise HTTPException(status_code=404, detail=f"Camera {camera_id} not found")
+            recorder = self.recorders.get(camera_id)
+            if recorder is None:
+                return {"recording": False, "start": None, "end": None, "bytes": 0, "segments": []}
+            return recorder.status()
+
+        @self.app.get("/cameras/{camera_id}/recordings/clip.h264")
+        async def export_clip(camera_id: str, start: float, end: float):
+            """Raw H.264 from the keyframe at or before `start` until `end`, copied from the segment files"""
+            if camera_id not in self.config.cameras:
+                raise HTTPException(status_code=404, detail=f"Camera {camera_id} not found")
+            if end <= start:
+                raise HTTPException(status_code=400, detail="end must be after start")
+            recorder = self.recorders.get(camera_id)
+            ranges = recorder.clip_ranges(start, end) if recorder else []
+            if not ranges:
+                raise HTTPException(status_code=404, detail="No recording in that time range")
+            # Chunked rather than a Content-Length: retention may delete a segment before it is streamed
+            return StreamingResponse(
+                recorder.read_clip(ranges),
+                media_type="video/h264",
+                headers={"Content-Disposition": f'attachment; filename="{camera_id}-{int(start)}.h264"'}
+            )
+
+        @self.app.post("/cameras/{camera_id}/webrtc")
+        async def webrtc_offer(camera_id: str, offer: WebRtcOffer, request: Request):
+            """Answer a WebRTC offer with the camera's H.264, sent as RTP without re-encoding"""
+            if camera_id not in self.config.cameras:
+                raise HTTPException(status_code=404, detail=f"Camera {camera_id} not found")
+            if not self.config.cameras[camera_id].enabled:
+                raise HTTPException(status_code=400, detail=f"Camera {camera_id} is disabled")
+            if self.webrtc is None:
+                try:
+                    self.webrtc = WebRtcGateway(self.config.ice_servers)
+                except RuntimeError as e:
+                    raise HTTPException(status_code=501, detail=str(e))
+            client = f"{request.client.host}:{request.client.port}" if request.client else ""
+            try:
+                answer = await self.webrtc.answer(self.get_webrtc_hub(camera_id), offer.sdp, client)
+            except Exception as e:  # aiortc raises plain exceptions for offers it cannot answer, e.g. without H.264
+                logger.warning(f"Cannot answer WebRTC offer for {camera_id}: {type(e).__name__} - {e}")
+                raise HTTPException(status_code=400, detail=f"Cannot answer offer: {e}")
+            return {"type": "answer", "sdp": answer}
+
+        @self.app.get("/cameras/{camera_id}/viewers")
+        async def list_viewers(camera_id: str):
+            if camera_id not in self.config.cameras:
+                raise HTTPException(status_code=404, detail=f"Camera {camera_id} not found")
+            viewers = self.local_viewers(camera_id)
+            for _, others in await self.ask_workers(f"/internal/viewers/{camera_id}"):
+                viewers += others
+            return {"viewers": viewers}
+
+        @self.app.get("/internal/viewers/{camera_id}")
+        async def worker_viewers(request: Request, camera_id: str):
+            """Viewers connected to this worker, for the worker answering /viewers; only served on the Unix socket"""
+            if self.cluster is None or request.client is not None:
+                raise HTTPException(status_code=404, detail="Not found")
+            return self.local_viewers(camera_id)
+
         @self.app.websocket("/stream/{camera_id}")
         async def stream_proxy(websocket: WebSocket, camera_id: str):
-            """Proxy camera stream over WebSocket as MPEG-TS"""
-            logger.info(f"MPEG-TS WebSocket connection request for camera {camera_id}")
+            """Proxy camera stream over WebSocket in the camera's `ws_format`: MPEG-1 in MPEG-TS, raw H.264 or fMP4"""
+            logger.info(f"WebSocket connection request for camera {camera_id}")
 
             if camera_id not in self.config.cameras:
                 logger.warning(f"Camera {camera_id} not found")
@@ -136,90 +321,32 @@ class CameraServer:
             await websocket.accept()
             logger.info(f"Accepted MPEG-TS WebSocket connection for camera {camera_id}")
 
-            ffmpeg_cmd = [
-                "ffmpeg",
-                # "-hide_banner",
-                "-loglevel", "info",
-                "-fflags", "+igndts",
-                "-re", # Read input at native rate
-                "-i", f"tcp://{camera_config.ip_address}:{camera_config.port}",
-                "-c:v", "mpeg1video",     # CRITICAL: Encode to MPEG1 video
-                "-bf", "0",               # No B-frames (recommended for JSMpeg)
-                "-vf", "scale=800:450",   # Scale output video
-                "-b:v", "500k",          # Target bitrate
-                "-f", "mpegts",           # Output MPEG-TS container
-                "-muxdelay", "0.01",      # Small mux delay
-                "-an",                     # No audio
-                "-progress", "pipe:2",    # Output progress to stderr
-                "pipe:1"                  # Output to stdout
-            ]
-
-            process = None
-            stderr_logger_task = None
+            hub = self.get_hub(camera_id)
             try:
-                logger.info(f"Starting FFmpeg for MPEG-TS: {' '.join(ffmpeg_cmd)}")
-                process = await asyncio.create_subprocess_exec(
-                    *ffmpeg_cmd,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE  # Capture stderr
-                )
-                logger.info(f"FFmpeg process started for {camera_id}. PID: {process.pid}")
-
-                # Coroutine to log FFmpeg's stderr
-                async def log_ffmpeg_stderr():
-                    while True:
-                        line = await process.stderr.readline()
-                        if not line:
-                            logger.info(f"FFmpeg stderr stream ended for {camera_id}.")
-                            break
-                        logger.error(f"FFmpeg stderr [{camera_id}]: {line.decode(errors='ignore').strip()}")
-                
-                stderr_logger_task = asyncio.create_task(log_ffmpeg_stderr())
+                client = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else ""
+                while hub is not None:
+                    async with hub.subscribe(client) as subscriber:
+                        while True:
+                            chunk = await subscriber.read()
+                            if chunk is None:
+                                break
+                            sent_at = time.perf_counter()
+                            await websocket.send_bytes(chunk)
+                            subscriber.record_send(time.perf_counter() - sent_at)
+                    # A config change replaces the hub; the viewer carries on with the new one
+                    hub = await self.replacement_hub(camera_id, hub)
+                logger.info(f"Encoder for {camera_id} stopped, ending WebSocket stream")
 
-                # Read from FFmpeg's stdout and send to WebSocket
-                READ_CHUNK_SIZE = 65536
-                while True:
-                    chunk = await process.stdout.read(READ_CHUNK_SIZE)
-                    if not chunk:
-                        logger.info(f"FFmpeg stdout stream ended for {camera_id}. FFmpeg might have exited.")
-                        break
-                    logger.debug(f"Read {len(chunk)} bytes from FFmpeg for {camera_id}, sending to WebSocket.")
-                    await websocket.send_bytes(chunk)
-                    logger.debug(f"Sent {len(chunk)} bytes to WebSocket for {camera_id}.")
-            
-            except WebSocketDisconnect:
+            except TranscoderLimitError as e:
+                logger.warning(f"Cannot start encoder for {camera_id}: {e}")
+                await websocket.close(code=1013, reason="Too many streams, try again later") # 1013 Try Again Later
+            except (WebSocketDisconnect, websockets.ConnectionClosed):
                 logger.info(f"WebSocket disconnected by client for camera {camera_id}")
             except ConnectionResetError:
                 logger.info(f"Client connection reset for camera {camera_id}")
             except Exception as e:
                 logger.error(f"Error in MPEG-TS stream proxy for {camera_id}: {type(e).__name__} - {e}")
             finally:
-                if stderr_logger_task and not stderr_logger_task.done():
-                    stderr_logger_task.cancel()
-                    try:
-                        await stderr_logger_task
-                    except asyncio.CancelledError:
-                        logger.info(f"FFmpeg stderr logger task cancelled for {camera_id}.")
-                    except Exception as e_log_cancel:
-                        logger.error(f"Error awaiting cancelled stderr_logger_task for {camera_id}: {e_log_cancel}")
-
-                if process and process.returncode is None:
-                    logger.info(f"FFmpeg process for {camera_id} (PID: {process.pid}) still running. Terminating...")
-                    try:
-                        process.terminate()
-                        # Give it a moment to terminate gracefully
-                        await asyncio.wait_for(process.wait(), timeout=5.0) 
-                        logger.info(f"FFmpeg process for {camera_id} terminated with code {process.returncode}.")
-                    except asyncio.TimeoutError:
-                        logger.warning(f"Timeout terminating FFmpeg for {camera_id}, killing. PID: {process.pid}")
-                        process.kill()
-                        await process.wait()
-                        logger.info(f"FFmpeg process for {camera_id} killed. Return code: {process.returncode}")
-                    except Exception as e_term:
-                        logger.error(f"Error during FFmpeg termination for {camera_id}: {e_term}")
-                elif process:
-                    logger.info(f"FFmpeg process for {camera_id} (PID: {process.pid}) already exited with code {process.returncode}.")
-                
                 logger.info(f"Closing WebSocket connection for {camera_id}")
                 try:
                     # Check current state before attempting to close
@@ -232,8 +359,578 @@ class CameraServer:
                     logger.warning(f"RuntimeError while closing websocket for {camera_id}: {e_ws_close}")
                 except Exception as e_ws_close_generic:
                     logger.error(f"Generic error while closing websocket for {camera_id}: {e_ws_close_generic}")
-                    proc.terminate()
-                    await proc.wait()
+
+        @self.app.websocket("/motion/{camera_id}")
+        async def motion_events(websocket: WebSocket, camera_id: str):
+            """Push motion start and end events for a camera as JSON"""
+            if camera_id in self.config.cameras and not self.ensure_owner(camera_id):
+                await self.forward_websocket(websocket, camera_id, f"/motion/{camera_id}")
+                return
+            detector = self.motion.get(camera_id)
+            if detector is None:
+                await websocket.close(code=1008, reason=f"Motion detection is not enabled for {camera_id}")
+                return
+
+            await websocket.accept()
+            try:
+                async with detector.listen() as events:
+                    status = detector.status()
+                    await websocket.send_json({
+                        "type": "status",
+                        "camera": camera_id,
+                        "active": status["active"],
+                        "score": status["score"],
+                        "event": status["events"][0] if detector.active else None
+                    })
+                    # Events can be minutes apart, so watch for the client leaving in the meantime
+                    disconnected = asyncio.create_task(self._wait_for_disconnect(websocket))
+                    try:
+                        while True:
+                            message = asyncio.create_task(events.get())
+                            await asyncio.wait({message, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                            if disconnected.done():
+                                message.cancel()
+                                break
+                            await websocket.send_json(message.result())
+                    finally:
+                        disconnected.cancel()
+                logger.info(f"Motion WebSocket disconnected for camera {camera_id}")
+            except WebSocketDisconnect:
+                logger.info(f"Motion WebSocket disconnected for camera {camera_id}")
+            except Exception as e:
+                logger.error(f"Error in motion WebSocket for {camera_id}: {type(e).__name__} - {e}")
+
+        @self.app.websocket("/internal/relay/{camera_id}")
+        async def relay_stream(websocket: WebSocket, camera_id: str):
+            """Feed another worker's RelayHub from the hub this worker owns.
+
+            Only served on the worker's Unix socket, where Uvicorn reports no client address.
+            """
+            if self.cluster is None or websocket.client is not None or camera_id not in self.config.cameras:
+                await websocket.close(code=1008)
+                return
+            if not self.ensure_owner(camera_id):
+                await websocket.close(code=1013, reason=f"Worker {os.getpid()} does not own {camera_id}")
+                return
+
+            await websocket.accept()
+            hub = self.get_hub(camera_id)
+            sent_header = None
+            try:
+                async with hub.subscribe("worker relay") as subscriber:
+                    while True:
+                        data = await subscriber.read()
+                        if data is None:
+                            break
+                        if subscriber.at_keyframe:
+                            header = hub.header
+                            if header != sent_header:
+                                await websocket.send_bytes(bytes([RELAY_HEADER]) + header)
+                                sent_header = header
+                            kind = RELAY_KEYFRAME
+                        else:
+                            kind = RELAY_CHUNK
+                        # The receiving hub adds the header itself when its viewers need it
+                        await websocket.send_bytes(bytes([kind]) + data[subscriber.header_length:])
+                await websocket.close()
+            except TranscoderLimitError as e:
+                logger.warning(f"Cannot start encoder for {camera_id}: {e}")
+                await websocket.close(code=1013, reason="Too many streams, try again later")
+            except (WebSocketDisconnect, websockets.ConnectionClosed):
+                logger.info(f"Worker relay of {camera_id} disconnected")
+
+    @asynccontextmanager
+    async def lifespan(self, app: FastAPI) -> AsyncGenerator[None, None]:
+        """Start recording and motion detection, and stop every stream and FFmpeg process when the app shuts down"""
+        internal_server = None
+        maintenance = None
+        if self.cluster:
+            # Other workers relay streams and forward requests over this socket
+            internal_server = uvicorn.Server(uvicorn.Config(
+                self.app, uds=str(self.cluster.socket_path), lifespan="off", log_config=None, access_log=False
+            ))
+            internal_server.install_signal_handlers = lambda: None  # The public server handles signals
+            internal_serving = asyncio.create_task(internal_server.serve())
+            maintenance = asyncio.create_task(self.maintain_cluster())
+        else:
+            # Off the startup path: the app serves requests while cameras come up
+            maintenance = asyncio.create_task(self.start_cameras())
+        watcher = asyncio.create_task(self.watch_config()) if self.config_path else None
+        summaries = asyncio.create_task(self.log_summaries())
+        balancing = asyncio.create_task(self.supervisor.balance())
+        yield
+        logger.info("Shutting down streams")
+        for task in (maintenance, watcher, summaries, balancing):
+            if task:
+                task.cancel()
+        if self.webrtc:
+            await self.webrtc.close()
+        for hub in list(self.hubs.values()) + list(self.ll_hls.values()) + list(self.relays.values()) \
+                + list(self.webrtc_hubs.values()):
+            await hub.stop()
+        for detector in self.motion.values():
+            await detector.stop()
+        for recorder in self.recorders.values():
+            await recorder.stop()
+        for cache in self.snapshots.values():
+            await cache.evict()
+        self.transcoders.clear()
+        await self.supervisor.shutdown()
+        for camera in self.cameras.values():
+            await camera.close()
+        if internal_server:
+            internal_server.should_exit = True
+            await internal_serving
+            for client in self._owner_clients.values():
+                await client.aclose()
+            self.cluster.close()
+
+    @staticmethod
+    async def _wait_for_disconnect(websocket: WebSocket) -> None:
+        """Discard anything a push-only client sends until it goes away"""
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    def runs_in_background(self, camera_id: str) -> bool:
+        """Whether the camera is recorded or watched for motion without any viewer"""
+        camera_config = self.config.cameras[camera_id]
+        return camera_config.enabled and (camera_config.recording.enabled or camera_config.motion.enabled)
+
+    def start_background(self, camera_id: str) -> None:
+        """Start the recorder and motion detector the camera asks for; they run until shutdown"""
+        camera_config = self.config.cameras[camera_id]
+        if not camera_config.enabled:
+            return
+        if camera_config.recording.enabled and camera_id not in self.recorders:
+            recorder = Recorder(self.get_camera(camera_id), self.recordings_dir / camera_id)
+            try:
+                recorder.start()
+                self.recorders[camera_id] = recorder
+            except OSError as e:
+                logger.error(f"Cannot start recording {camera_id}: {e}")
+        if camera_config.motion.enabled and camera_id not in self.motion:
+            try:
+                detector = MotionDetector(self.get_camera(camera_id), self.supervisor)
+                detector.start()
+                self.motion[camera_id] = detector
+            except RuntimeError as e:  # NumPy missing, or a TranscoderLimitError
+                logger.error(f"Cannot start motion detection for {camera_id}: {e}")
+
+    async def start_cameras(self) -> None:
+        """Start every camera that records or detects motion, a few at a time"""
+        for camera_id in list(self.config.cameras):
+            if camera_id in self.config.cameras and self.runs_in_background(camera_id):
+                self.resume_camera(camera_id)
+                await asyncio.sleep(STARTUP_STAGGER)
+
+    def resume_camera(self, camera_id: str) -> None:
+        """Start what the camera runs without viewers, if this worker is or can become its owner"""
+        if self.cluster is None or self.cluster.owns(camera_id):
+            self.start_background(camera_id)
+        elif self.runs_in_background(camera_id):
+            self.ensure_owner(camera_id)
+
+    async def stop_camera(self, camera_id: str) -> None:
+        """Stop everything running for a camera and close its connection; viewers are disconnected"""
+        for hubs in (self.hubs, self.ll_hls, self.relays, self.webrtc_hubs):
+            hub = hubs.pop(camera_id, None)
+            if hub:
+                await hub.stop()
+        await self.stop_transcoder(camera_id)
+        detector = self.motion.pop(camera_id, None)
+        if detector:
+            await detector.stop()
+        recorder = self.recorders.pop(camera_id, None)
+        if recorder:
+            await recorder.stop()
+        cache = self.snapshots.pop(camera_id, None)
+        if cache:
+            await cache.evict()
+        camera = self.cameras.pop(camera_id, None)
+        if camera:
+            await camera.close()
+
+    async def restart_camera(self, camera_id: str) -> None:
+        """Stop a camera whose new settings need a new connection, then start again what was running.
+
+        HLS comes back from the new config, and WebSocket viewers move to the new hub
+        through `replacement_hub`; WebRTC peers have to negotiate again.
+        """
+        transcoder = self.transcoders.get(camera_id)
+        ll_hls = self.ll_hls.get(camera_id)
+        hls_running = (transcoder is not None and transcoder.is_running) or (ll_hls is not None and ll_hls.is_running)
+        restarted = asyncio.Event()
+        self._restarts[camera_id] = restarted
+        for hubs in (self.hubs, self.relays):
+            if camera_id in hubs:
+                self._restarted_hubs.add(hubs[camera_id])
+        try:
+            await self.stop_camera(camera_id)
+            self.resume_camera(camera_id)
+            if hls_running and self.config.cameras[camera_id].enabled:
+                try:
+                    await self.start_hls_output(camera_id)
+                except Exception as e:
+                    logger.error(f"Could not restart HLS for {camera_id} after its config changed: {e}")
+        finally:
+            del self._restarts[camera_id]
+            restarted.set()
+
+    async def replacement_hub(self, camera_id: str, hub: StreamHub) -> Optional[StreamHub]:
+        """The hub taking over from one a config change stopped, or None if its viewers have to go"""
+        if hub not in self._restarted_hubs:
+            return None  # Stopped for good: shutdown, or the camera was removed
+        restarted = self._restarts.get(camera_id)
+        if restarted is not None:
+            await restarted.wait()
+        camera_config = self.config.cameras.get(camera_id)
+        if camera_config is None or not camera_config.enabled or camera_config.ws_format != hub.format:
+            return None  # The player has to reconnect for a different format
+        return self.get_hub(camera_id)
+
+    async def log_summaries(self) -> None:
+        """Log one line of traffic per active camera every `log_summary_interval` seconds.
+
+        Stands in for per-chunk logging, which costs noticeable CPU at a few Mbit/s per viewer.
+        """
+        totals: Dict[str, Tuple[int, int, int]] = {}
+        last = time.monotonic()
+        while True:
+            interval = self.config.log_summary_interval
+            await asyncio.sleep(interval if interval > 0 else CONFIG_POLL_INTERVAL)
+            now = time.monotonic()
+            elapsed, last = now - last, now
+            if interval <= 0:
+                continue
+            for camera_id, camera in list(self.cameras.items()):
+                hubs = [hubs[camera_id] for hubs in (self.hubs, self.relays, self.webrtc_hubs) if camera_id in hubs]
+                current = (
+                    camera.bytes_received,
+                    sum(hub.sent_bytes for hub in hubs),
+                    sum(hub.dropped_chunks for hub in hubs),
+                )
+                previous = totals.get(camera_id, (0, 0, 0))
+                # Counters restart with their hub or connection, so a total that went down is a new one
+                received, sent, dropped = (
+                    total - before if total >= before else total for total, before in zip(current, previous)
+                )
+                totals[camera_id] = current
+                if not (received or sent or camera.is_connected):
+                    continue
+                line = (f"Camera {camera_id}: upstream {received * 8 / elapsed / 1e6:.2f} Mbit/s, "
+                        f"{sum(hub.subscriber_count for hub in hubs)} viewers, "
+                        f"sent {sent * 8 / elapsed / 1e6:.2f} Mbit/s")
+                if dropped:
+                    line += f", {dropped} chunks dropped"
+                for transcoder in self.supervisor.transcoders:
+                    if transcoder.camera_id == camera_id and transcoder.progress:
+                        line += (f", {transcoder.name} {transcoder.progress_value('fps') or 0:.1f} fps "
+                                 f"at {transcoder.progress_value('speed') or 0:.2f}x")
+                logger.info(line)
+
+    async def watch_config(self) -> None:
+        """Apply changes to the config file as it is edited"""
+        def signature():
+            stat = self.config_path.stat()
+            return stat.st_mtime_ns, stat.st_size
+
+        try:
+            loaded = signature()
+        except OSError:
+            loaded = None
+        while True:
+            await asyncio.sleep(CONFIG_POLL_INTERVAL)
+            try:
+                current = signature()
+            except OSError:
+                continue  # Mid-replace, or deleted; keep running what was loaded
+            if current == loaded:
+                continue
+            loaded = current
+            try:
+                config = Config.load(self.config_path)
+            except (OSError, ValueError, RuntimeError) as e:
+                logger.error(f"Ignoring invalid config {self.config_path}: {e}")
+                continue
+            logger.info(f"Reloading config from {self.config_path}")
+            await self.apply_config(config)
+
+    async def apply_config(self, config: Config) -> None:
+        """Switch to a new config, restarting only the cameras whose settings changed"""
+        old = self.config
+        for name in ("recordings_dir", "cluster_dir"):
+            if getattr(config, name) != getattr(old, name):
+                logger.warning(f"Changing {name} takes a restart; still using {getattr(old, name)!r}")
+        config = config.model_copy(update={"recordings_dir": old.recordings_dir, "cluster_dir": old.cluster_dir})
+        self.supervisor.max_processes = config.max_transcoders
+        self.supervisor.scheduler.profiles = config.encoder_profiles
+        self.supervisor.scheduler.cpu_budget = config.cpu_budget
+        self.config = config
+
+        # Encoders of unchanged cameras pick up edited profiles, including the fallback they may be on
+        edited = {
+            name for name, profile in config.encoder_profiles.items() if old.encoder_profiles.get(name) != profile
+        }
+        for transcoder in self.supervisor.transcoders:
+            profile = config.encoder_profiles.get(transcoder.profile or "")
+            if profile is None:
+                continue  # Not an encoder, or its camera switched profiles and restarts below anyway
+            if {transcoder.profile, profile.fallback} & edited:
+                logger.info(f"Restarting {transcoder.name} of {transcoder.camera_id} for its changed encoder profile")
+                await transcoder.restart()
+
+        for camera_id in old.cameras.keys() - config.cameras.keys():
+            logger.info(f"Camera {camera_id} removed")
+            await self.stop_camera(camera_id)
+            if self.cluster:
+                self.cluster.release(camera_id)
+        for camera_id, camera_config in config.cameras.items():
+            previous = old.cameras.get(camera_id)
+            if previous is None:
+                logger.info(f"Camera {camera_id} added")
+                self.resume_camera(camera_id)
+                continue
+            changed = camera_changes(previous, camera_config)
+            if not changed:
+                continue
+            logger.info(f"Camera {camera_id} changed: {', '.join(sorted(changed))}")
+            if changed - LIVE_CAMERA_FIELDS:
+                await self.restart_camera(camera_id)
+                continue
+            # Its connection and streams stay up; only what depends on the changed settings restarts
+            for component in (self.cameras, self.hubs, self.ll_hls, self.relays, self.webrtc_hubs):
+                if camera_id in component:
+                    component[camera_id].config = camera_config
+            if "motion" in changed and camera_id in self.motion:
+                await self.motion.pop(camera_id).stop()
+            if "recording" in changed and camera_id in self.recorders:
+                await self.recorders.pop(camera_id).stop()
+            if "snapshot" in changed and camera_id in self.snapshots:
+                await self.snapshots.pop(camera_id).evict()
+            self.resume_camera(camera_id)
+
+    def camera_status(self, camera_id: str) -> Dict[str, bool]:
+        """What runs for a camera; in multi-worker mode as reported by the worker owning it"""
+        if self.cluster and not self.cluster.owns(camera_id):
+            entry = self.cluster.lookup(camera_id)
+            status = dict(entry["status"]) if entry else {"websocket": False, "hls": False, "motion": False, "recording": False}
+            relay = self.relays.get(camera_id)
+            status["websocket"] = status["websocket"] or (relay is not None and relay.is_running)
+            return status
+        if camera_id in self.ll_hls:
+            hls_ready = self.ll_hls[camera_id].store.ready
+        else:
+            hls_ready = (self.streams_dir / camera_id / "index.m3u8").exists()
+        return {
+            "websocket": camera_id in self.hubs and self.hubs[camera_id].is_running,
+            "hls": hls_ready,
+            "motion": camera_id in self.motion and self.motion[camera_id].active,
+            "recording": camera_id in self.recorders and self.recorders[camera_id].is_running
+        }
+
+    def ensure_owner(self, camera_id: str) -> bool:
+        """Whether this worker serves the camera itself, taking it over if no live worker does"""
+        if self.cluster is None or self.cluster.owns(camera_id):
+            return True
+        if not self.cluster.try_acquire(camera_id):
+            return False
+        self.start_background(camera_id)
+        self.cluster.publish(camera_id, self.camera_status(camera_id))
+        return True
+
+    async def maintain_cluster(self) -> None:
+        """Keep this worker's registry entries fresh and take over cameras whose owner died.
+
+        Cameras that only run for viewers are taken over by the next request for them instead.
+        """
+        while True:
+            for camera_id in self.config.cameras:
+                if self.cluster.owns(camera_id):
+                    self.cluster.publish(camera_id, self.camera_status(camera_id))
+                elif self.runs_in_background(camera_id):
+                    self.ensure_owner(camera_id)
+            await asyncio.sleep(CLUSTER_REFRESH)
+
+    def local_viewers(self, camera_id: str) -> List[Dict[str, Any]]:
+        """Stats of the camera's viewers connected to this worker, with its number in multi-worker mode"""
+        hub = self.hubs.get(camera_id) or self.relays.get(camera_id)
+        viewers = hub.subscriber_stats() if hub else []
+        if self.cluster:
+            for viewer in viewers:
+                viewer["worker"] = self.cluster.worker
+        return viewers
+
+    def worker_client(self, socket_path: str) -> httpx.AsyncClient:
+        """HTTP client for another worker's Unix socket, kept for reuse"""
+        client = self._owner_clients.get(socket_path)
+        if client is None:
+            client = httpx.AsyncClient(
+                transport=httpx.AsyncHTTPTransport(uds=socket_path),
+                base_url="http://worker",
+                timeout=httpx.Timeout(10.0, read=None)  # Blocking playlist reloads and clip exports take a while
+            )
+            self._owner_clients[socket_path] = client
+        return client
+
+    async def ask_workers(self, path: str) -> List[Tuple[int, Any]]:
+        """GET `path` from every other live worker at once, returning each answer with the worker's number.
+
+        A worker that does not answer in time is left out and logged.
+        """
+        if self.cluster is None:
+            return []
+        workers = self.cluster.other_workers()
+
+        async def ask(socket_path: str) -> Any:
+            response = await self.worker_client(socket_path).get(path, timeout=WORKER_QUERY_TIMEOUT)
+            response.raise_for_status()
+            return response.json()
+
+        answers = await asyncio.gather(*(ask(socket_path) for _, socket_path in workers), return_exceptions=True)
+        results = []
+        for (worker, _), answer in zip(workers, answers):
+            if isinstance(answer, Exception):
+                logger.warning(f"Worker {worker} did not answer {path}: {type(answer).__name__} - {answer}")
+                continue
+            results.append((worker, answer))
+        return results
+
+    async def forward_to_owner(self, request: Request, call_next):
+        """Middleware handing a camera's requests to the worker that owns it"""
+        match = OWNER_PATH_PATTERN.match(request.url.path)
+        if match is None:
+            return await call_next(request)
+        camera_id = match.group(1) or match.group(2)
+        camera_config = self.config.cameras.get(camera_id)
+        # Plain HLS lives on disk, which every worker can read
+        on_disk = match.group(2) is not None and not (camera_config and camera_config.low_latency_hls)
+        if camera_config is None or on_disk or self.ensure_owner(camera_id):
+            return await call_next(request)
+
+        socket_path = self.cluster.owner_socket(camera_id)
+        client = self.worker_client(socket_path) if socket_path else None
+        headers = [(name, value) for name, value in request.headers.items() if name not in HOP_HEADERS | {"host"}]
+        try:
+            if client is None:
+                raise httpx.ConnectError(f"no worker owns {camera_id}")
+            upstream = client.build_request(
+                request.method, request.url.path, params=request.query_params,
+                headers=headers, content=await request.body()
+            )
+            response = await client.send(upstream, stream=True)
+        except httpx.TransportError as e:
+            logger.warning(f"Cannot forward {request.url.path} to the owner of {camera_id}: {e}")
+            return JSONResponse({"detail": f"Worker serving camera {camera_id} is unavailable"}, status_code=503)
+        return StreamingResponse(
+            response.aiter_raw(),
+            status_code=response.status_code,
+            headers={name: value for name, value in response.headers.items() if name not in HOP_HEADERS},
+            background=BackgroundTask(response.aclose)
+        )
+
+    async def forward_websocket(self, websocket: WebSocket, camera_id: str, path: str) -> None:
+        """Pass messages from the owning worker's WebSocket at `path` through to the client"""
+        socket_path = self.cluster.owner_socket(camera_id)
+        if socket_path is None:
+            await websocket.close(code=1013, reason=f"No worker serves camera {camera_id}")
+            return
+        await websocket.accept()
+        disconnected = asyncio.create_task(self._wait_for_disconnect(websocket))
+        try:
+            async with websockets.unix_connect(socket_path, f"ws://worker{path}") as upstream:
+                while True:
+                    message = asyncio.create_task(upstream.recv())
+                    await asyncio.wait({message, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                    if disconnected.done():
+                        message.cancel()
+                        return
+                    await websocket.send_text(message.result())
+        except (OSError, websockets.WebSocketException) as e:
+            logger.info(f"Forwarded WebSocket {path} ended: {e}")
+        except WebSocketDisconnect:
+            pass
+        finally:
+            disconnected.cancel()
+            if websocket.client_state == WebSocketState.CONNECTED:
+                try:
+                    await websocket.close(code=1013)  # The owner went away; the client reconnects to whoever owns it next
+                except (RuntimeError, websockets.ConnectionClosed):
+                    pass
+
+    async def start_hls_output(self, camera_id: str) -> bool:
+        """Start the camera's HLS, from memory for LL-HLS or as FFmpeg's files; False if it already runs"""
+        camera_config = self.config.cameras[camera_id]
+        if camera_config.low_latency_hls:
+            hub = self.ll_hls.get(camera_id)
+            if hub is None:
+                hub = LLHlsHub(self.get_camera(camera_id), supervisor=self.supervisor)
+                self.ll_hls[camera_id] = hub
+            if hub.is_running:
+                return False
+            await hub.start()
+            return True
+
+        transcoder = self.transcoders.get(camera_id)
+        if transcoder and transcoder.is_running:
+            return False
+        output_dir = self.streams_dir / camera_id
+        output_dir.mkdir(parents=True, exist_ok=True)
+        transcoder = self.supervisor.create(
+            "hls",
+            self.get_camera(camera_id),
+            lambda: build_hls_command(camera_config, output_dir, transcoder.encoding),
+            ready_file=output_dir / "index.m3u8",
+            profile=camera_config.hls_profile if hls_encodes(camera_config) else None
+        )
+        transcoder.start()
+        self.transcoders[camera_id] = transcoder
+        return True
+
+    async def stop_transcoder(self, camera_id: str) -> None:
+        """Stop a camera's HLS transcoder; it detaches from the upstream connection itself"""
+        transcoder = self.transcoders.pop(camera_id, None)
+        if transcoder:
+            await transcoder.stop()
+
+    def get_camera(self, camera_id: str) -> CameraStream:
+        """Return the shared upstream connection for a camera, creating it on first use"""
+        camera = self.cameras.get(camera_id)
+        if camera is None:
+            camera = CameraStream(self.config.cameras[camera_id])
+            self.cameras[camera_id] = camera
+        return camera
+
+    def get_hub(self, camera_id: str) -> StreamHub:
+        """Return the shared MPEG-TS hub for a camera, creating it on first use.
+
+        In multi-worker mode only the camera's owner connects to it; other workers relay its hub.
+        """
+        if not self.ensure_owner(camera_id):
+            relay = self.relays.get(camera_id)
+            if relay is None:
+                relay = RelayHub(self.get_camera(camera_id), lambda: self.relay_source(camera_id))
+                self.relays[camera_id] = relay
+            return relay
+        hub = self.hubs.get(camera_id)
+        if hub is None:
+            hub = create_hub(self.get_camera(camera_id), supervisor=self.supervisor)
+            self.hubs[camera_id] = hub
+        return hub
+
+    def get_webrtc_hub(self, camera_id: str) -> StreamHub:
+        """Return a hub of the camera's own H.264, sharing the WebSocket one when that is H.264 too"""
+        if self.config.cameras[camera_id].ws_format == "h264":
+            return self.get_hub(camera_id)
+        hub = self.webrtc_hubs.get(camera_id)
+        if hub is None:
+            hub = H264Hub(self.get_camera(camera_id))
+            self.webrtc_hubs[camera_id] = hub
+        return hub
+
+    def relay_source(self, camera_id: str) -> Optional[str]:
+        """Socket of the worker a RelayHub should subscribe to now, taking the camera over if it is orphaned"""
+        self.ensure_owner(camera_id)
+        return self.cluster.owner_socket(camera_id)
 
     def get_app(self) -> FastAPI:
         return self.app
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from .camera import CallbackSink, CameraStream
+from .h264 import AccessUnitParser
+
+logger = logging.getLogger(__name__)
+
+DECODE_TIMEOUT = 10.0  # Seconds one FFmpeg may take to turn a keyframe into a JPEG
+
+
+class SnapshotError(RuntimeError):
+    """No snapshot could be produced, e.g. the camera has not sent a keyframe"""
+
+
+class SnapshotCache:
+    """Latest still image of a camera as a JPEG thumbnail, for previews.
+
+    While requested, a CallbackSink on the shared camera connection keeps the most
+    recent keyframe with its SPS/PPS, which costs no decoding. The first keyframe after
+    the JPEG is `refresh` seconds old is decoded into a new one by a short-lived FFmpeg,
+    so requests are answered from memory; only a cold cache makes a request wait for a
+    keyframe and its decode, which concurrent requests share. After `idle_timeout`
+    seconds without a request the sink is detached and everything cached is dropped.
+    """
+
+    def __init__(self, camera: CameraStream, decode_slots: asyncio.Semaphore):
+        self.camera = camera
+        self.config = camera.config.snapshot
+        self._decode_slots = decode_slots  # Shared by every camera, so a grid cannot start ten FFmpegs at once
+        self._parser = AccessUnitParser()
+        self._sink: Optional[CallbackSink] = None
+        self._keyframe: Optional[bytes] = None
+        self._keyframe_time: Optional[float] = None
+        self._keyframe_event = asyncio.Event()
+        self._jpeg: Optional[bytes] = None
+        self._jpeg_time: Optional[float] = None  # When the keyframe behind the JPEG arrived
+        self._decoding: Optional[asyncio.Task] = None
+        self._evict_handle: Optional[asyncio.TimerHandle] = None
+        self.decodes = 0
+        self.hits = 0
+
+    @property
+    def camera_id(self) -> str:
+        return self.camera.config.id
+
+    @property
+    def is_watching(self) -> bool:
+        return self._sink is not None
+
+    @property
+    def age(self) -> Optional[float]:
+        """Seconds since the frame in the cached JPEG arrived"""
+        return time.time() - self._jpeg_time if self._jpeg_time is not None else None
+
+    async def get(self, timeout: float) -> bytes:
+        """Return a JPEG no older than `refresh` seconds when the camera allows it"""
+        self._schedule_eviction()
+        if self._jpeg is not None and self.age < self.config.refresh:
+            self.hits += 1
+            return self._jpeg
+        self._watch()
+        if self._keyframe is None:
+            try:
+                await asyncio.wait_for(self._keyframe_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                raise SnapshotError(f"Camera {self.camera_id} sent no keyframe within {timeout:.0f}s")
+        elif self._keyframe_time == self._jpeg_time:
+            # No keyframe since the last decode, as with GOPs longer than `refresh`
+            self.hits += 1
+            return self._jpeg
+        # Shielded so one client going away does not cancel the decode others are waiting for
+        return await asyncio.shield(self._start_decode())
+
+    def _watch(self) -> None:
+        if self._sink is not None:
+            return
+        self._parser = AccessUnitParser()
+        self._sink = CallbackSink(f"snapshot[{self.camera_id}]", self._on_data)
+        self.camera.attach(self._sink)
+
+    def _on_data(self, data: memoryview) -> None:
+        for unit in self._parser.feed(data):
+            if unit.keyframe:
+                self._keyframe = self._parser.parameter_sets + unit.data
+                self._keyframe_time = time.time()
+                self._keyframe_event.set()
+                self._keyframe_event = asyncio.Event()
+                if self._jpeg is not None and self.age >= self.config.refresh:
+                    self._start_decode()
+
+    def _start_decode(self) -> asyncio.Task:
+        """Decode the cached keyframe unless a decode is already running"""
+        if self._decoding is None or self._decoding.done():
+            self._decoding = asyncio.create_task(self._decode(self._keyframe, self._keyframe_time))
+            self._decoding.add_done_callback(self._decoded)
+        return self._decoding
+
+    def _decoded(self, task: asyncio.Task) -> None:
+        # Retrieved here too, so a background refresh nobody awaits still reports its failure
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Snapshot of {self.camera_id} failed: {task.exception()}")
+
+    def build_command(self) -> List[str]:
+        config = self.config
+        return [
+            "ffmpeg",
+            "-nostats",
+            "-loglevel", "error",
+            "-f", "h264",
+            "-i", "pipe:0",
+            "-frames:v", "1",
+            "-vf", f"scale={config.width}:{config.height or -2}:flags=bilinear",
+            "-q:v", str(config.quality),
+            "-f", "mjpeg",
+            "pipe:1"
+        ]
+
+    async def _decode(self, keyframe: bytes, keyframe_time: float) -> bytes:
+        async with self._decode_slots:
+            started = time.perf_counter()
+            process = await asyncio.create_subprocess_exec(
+                *self.build_command(),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                jpeg, stderr = await asyncio.wait_for(process.communicate(keyframe), DECODE_TIMEOUT)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                raise SnapshotError(f"Decoding a snapshot of {self.camera_id} timed out")
+        if process.returncode != 0 or not jpeg:
+            message = stderr.decode(errors="ignore").strip()
+            raise SnapshotError(f"FFmpeg could not decode a snapshot of {self.camera_id}: {message}")
+        self.decodes += 1
+        logger.debug(f"Decoded snapshot of {self.camera_id} in {(time.perf_counter() - started) * 1000:.0f}ms")
+        self._jpeg = jpeg
+        self._jpeg_time = keyframe_time
+        return jpeg
+
+    def _schedule_eviction(self) -> None:
+        if self._evict_handle is not None:
+            self._evict_handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._evict_handle = loop.call_later(
+            self.config.idle_timeout, lambda: asyncio.ensure_future(self.evict())
+        )
+
+    async def evict(self) -> None:
+        """Stop watching the camera and forget the cached frames"""
+        if self._evict_handle is not None:
+            self._evict_handle.cancel()
+            self._evict_handle = None
+        sink, self._sink = self._sink, None
+        if sink:
+            logger.info(f"No snapshot requests for {self.camera_id}, releasing its keyframe cache")
+            await self.camera.detach(sink)
+            sink.close()
+        self._keyframe = None
+        self._keyframe_time = None
+        self._jpeg = None
+        self._jpeg_time = None
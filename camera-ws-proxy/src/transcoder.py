@@ -1,122 +1,288 @@
-import os
-import subprocess
+import asyncio
 import logging
-import threading
+import re
+import socket
 import time
-from typing import Dict, Optional
+from collections import deque
 from pathlib import Path
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
 
-from .config import CameraConfig
+from .camera import CameraStream, PipeSink
+from .encoder import BALANCE_INTERVAL, CpuScheduler, Encoding
 
 logger = logging.getLogger(__name__)
 
-class StreamTranscoder:
-    def __init__(self, stream_root: str = "streams"):
-        self.stream_root = Path(stream_root)
-        self.stream_root.mkdir(exist_ok=True)
-        self.transcoders: Dict[str, subprocess.Popen] = {}
-        self._lock = threading.Lock()
-
-    def get_hls_path(self, camera_id: str) -> Path:
-        """Get the HLS output directory for a camera"""
-        return self.stream_root / camera_id
-
-    def get_playlist_path(self, camera_id: str) -> Path:
-        """Get the m3u8 playlist path for a camera"""
-        return self.get_hls_path(camera_id) / "index.m3u8"
-
-    def start_transcoder(self, camera_id: str, config: CameraConfig) -> bool:
-        """Start an FFmpeg process to transcode the camera stream to HLS"""
-        with self._lock:
-            if camera_id in self.transcoders and self.transcoders[camera_id].poll() is None:
-                logger.info(f"Transcoder for camera {camera_id} is already running")
-                return True
-
-            hls_path = self.get_hls_path(camera_id)
-            hls_path.mkdir(parents=True, exist_ok=True)
-            # Ensure directory has correct permissions
-            os.chmod(str(hls_path), 0o755)
-            playlist_path = self.get_playlist_path(camera_id)
-
-            # Add verbose logging to FFmpeg
-            cmd = [
-                "ffmpeg",
-                "-loglevel", "debug",  # More detailed logging
-                "-i", f"tcp://{config.ip_address}:{config.port}",
-                "-c:v", "libx264",
-                "-preset", "ultrafast",
-                "-tune", "zerolatency",
-                "-f", "hls",
-                "-hls_time", "1",              # Each segment is 1 second
-                "-hls_list_size", "3",         # Keep only 3 segments in the playlist
-                "-hls_flags", "delete_segments+append_list",  # Delete old segments and append to list
-                "-hls_segment_type", "mpegts",  # Use MPEG-TS segments for lower latency
-                "-hls_init_time", "1",         # Start the first segment after 1 second
-                "-hls_segment_filename", str(hls_path.absolute() / "segment_%03d.ts"),
-                str(playlist_path.absolute())
-            ]
-            logger.info(f"Starting FFmpeg with command: {' '.join(cmd)}")
+OutputReader = Callable[[socket.socket], Awaitable[None]]
 
-            try:
-                # Start FFmpeg process with output redirection
-                process = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    universal_newlines=True,
-                    cwd=str(self.stream_root)  # Set working directory to streams folder
-                )
-                self.transcoders[camera_id] = process
-                
-                # Start a thread to monitor FFmpeg output
-                def monitor_output():
-                    for line in process.stderr:
-                        logger.info(f"FFmpeg [{camera_id}]: {line.strip()}")
-                    process.stdout.close()
-                    process.stderr.close()
-                
-                threading.Thread(target=monitor_output, daemon=True).start()
-                
-                # Wait a bit to check if FFmpeg starts successfully
-                time.sleep(1)
-                if process.poll() is not None:
-                    error = process.stderr.read()
-                    logger.error(f"FFmpeg failed to start: {error}")
-                    return False
-                
-                logger.info(f"Started HLS transcoder for camera {camera_id}")
-                return True
-            except Exception as e:
-                logger.error(f"Failed to start transcoder for camera {camera_id}: {str(e)}")
-                return False
-
-    def stop_transcoder(self, camera_id: str) -> None:
-        """Stop the FFmpeg transcoder for a camera"""
-        with self._lock:
-            if camera_id in self.transcoders:
-                process = self.transcoders[camera_id]
-                if process.poll() is None:  # Still running
-                    process.terminate()
-                    try:
-                        process.wait(timeout=5)
-                    except subprocess.TimeoutExpired:
-                        process.kill()
-                del self.transcoders[camera_id]
-                logger.info(f"Stopped HLS transcoder for camera {camera_id}")
-
-    def cleanup(self) -> None:
-        """Stop all transcoders"""
-        with self._lock:
-            for camera_id in list(self.transcoders.keys()):
-                self.stop_transcoder(camera_id)
-
-    def is_transcoding(self, camera_id: str) -> bool:
-        """Check if a camera is currently being transcoded"""
-        with self._lock:
-            if camera_id not in self.transcoders:
-                return False
-            process = self.transcoders[camera_id]
-            if process.poll() is not None:  # Process has ended
-                del self.transcoders[camera_id]
-                return False
+# A process that ran this long before exiting restarts from the minimum backoff again
+STABLE_RUN_SECONDS = 30.0
+READY_POLL_INTERVAL = 0.2
+# One `key=value` line of FFmpeg's -progress output; log lines always contain spaces
+PROGRESS_LINE = re.compile(r"(\w+)=\s*(\S*)")
+
+
+class TranscoderLimitError(RuntimeError):
+    """Starting another FFmpeg process would exceed the supervisor's limit"""
+
+
+class Transcoder:
+    """One supervised FFmpeg process fed from the shared camera connection.
+
+    The process is restarted with exponential backoff whenever it exits without being
+    asked to, rebuilding its command each time. With `read_output`, FFmpeg's stdout goes
+    to a socket handed to that coroutine once per process; otherwise it is discarded.
+    The transcoder is ready once `ready_file` exists or `mark_ready` is called.
+    An encoder names its camera's encoder `profile`; each process is then placed by
+    the supervisor's scheduler, and `build_command` reads the result from `encoding`.
+    """
+
+    def __init__(self, supervisor: "TranscoderSupervisor", name: str, camera: CameraStream,
+                 build_command: Callable[[], List[str]], read_output: Optional[OutputReader] = None,
+                 ready_file: Optional[Path] = None, profile: Optional[str] = None,
+                 restart_min: float = 1.0, restart_max: float = 30.0):
+        self.supervisor = supervisor
+        self.name = name
+        self.camera = camera
+        self.build_command = build_command
+        self.read_output = read_output
+        self.ready_file = ready_file
+        self.profile = profile
+        self.encoding: Optional[Encoding] = None
+        self.restart_min = restart_min
+        self.restart_max = restart_max
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.restarts = 0
+        self.progress: Dict[str, str] = {}  # Last complete -progress report, e.g. fps, speed, drop_frames
+        self.progress_time: Optional[float] = None
+        self._progress: Dict[str, str] = {}
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stderr_tail: Deque[str] = deque(maxlen=10)
+
+    @property
+    def camera_id(self) -> str:
+        return self.camera.config.id
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def mark_ready(self) -> None:
+        self._ready.set()
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for the first output, returning whether it arrived"""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
             return True
+        except asyncio.TimeoutError:
+            return False
+
+    def start(self) -> None:
+        """Launch the process under supervision without waiting for it"""
+        if self.is_running:
+            return
+        self.supervisor._claim(self)
+        self._ready.clear()
+        if self.ready_file is not None and self.ready_file.exists():
+            # Left behind by an earlier run; readiness must come from this one
+            self.ready_file.unlink()
+        self._task = asyncio.create_task(self._supervise())
+
+    async def stop(self) -> None:
+        """Terminate the process and stop restarting it"""
+        task, self._task = self._task, None
+        if task and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.supervisor._release(self)
+
+    async def restart(self) -> None:
+        """Replace a running process right away, e.g. to apply a new placement"""
+        if not self.is_running:
+            return
+        await self.stop()
+        try:
+            self.start()
+        except TranscoderLimitError as e:
+            logger.error(f"Could not restart FFmpeg {self.name} for {self.camera_id}: {e}")
+
+    async def _supervise(self) -> None:
+        delay = self.restart_min
+        watcher = asyncio.create_task(self._watch_ready_file()) if self.ready_file is not None else None
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    returncode = await self._run_once()
+                    output = " | ".join(self._stderr_tail)
+                    logger.warning(f"FFmpeg {self.name} for {self.camera_id} exited with code {returncode}: {output}")
+                except OSError as e:
+                    logger.error(f"Failed to start FFmpeg {self.name} for {self.camera_id}: {e}")
+                except Exception:
+                    # E.g. a bug building the command; ending here would keep the slot claimed forever
+                    logger.exception(f"FFmpeg {self.name} for {self.camera_id} failed")
+                if time.monotonic() - started > STABLE_RUN_SECONDS:
+                    delay = self.restart_min
+                self.restarts += 1
+                logger.info(f"Restarting FFmpeg {self.name} for {self.camera_id} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.restart_max)
+        finally:
+            if watcher:
+                watcher.cancel()
+
+    async def _run_once(self) -> Optional[int]:
+        """Run one FFmpeg process until it exits, cleaning up after it even when cancelled"""
+        scheduler = self.supervisor.scheduler
+        if self.profile is not None:
+            self.encoding = scheduler.place(self)
+        try:
+            return await self._run_placed()
+        finally:
+            scheduler.release(self)
+
+    async def _run_placed(self) -> Optional[int]:
+        cmd = self.build_command()
+        logger.info(f"Starting FFmpeg {self.name} for {self.camera_id}: {' '.join(cmd)}")
+        output, child_output = socket.socketpair() if self.read_output else (None, None)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=child_output.fileno() if child_output else asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except Exception:
+            if output:
+                output.close()
+            raise
+        finally:
+            if child_output:
+                child_output.close()
+        if self.encoding is not None:
+            # Before the camera's first bytes, so FFmpeg has yet to start its threads
+            self.supervisor.scheduler.pin(self, process.pid)
+        self.process = process
+        self._stderr_tail.clear()
+        self.progress = {}
+        self._progress = {}
+        sink = PipeSink(f"{self.name}[{process.pid}]", process.stdin)
+        self.camera.attach(sink)
+        tasks = [asyncio.create_task(self._drain_stderr(process))]
+        if output:
+            output.setblocking(False)
+            tasks.append(asyncio.create_task(self._read_output(output)))
+        try:
+            return await process.wait()
+        finally:
+            await self.camera.detach(sink)
+            sink.close()
+            await self._terminate(process)
+            # Let the readers reach EOF on their own before giving up on them
+            _, pending = await asyncio.wait(tasks, timeout=1.0)
+            for task in pending:
+                task.cancel()
+            self.process = None
+
+    async def _terminate(self, process: asyncio.subprocess.Process) -> None:
+        if process.returncode is not None:
+            return
+        logger.info(f"Terminating FFmpeg {self.name} for {self.camera_id} (PID: {process.pid})")
+        try:
+            process.terminate()
+            await asyncio.wait_for(process.wait(), timeout=5.0)
+        except asyncio.TimeoutError:
+            logger.warning(f"Timeout terminating FFmpeg {self.name} for {self.camera_id}, killing. PID: {process.pid}")
+            process.kill()
+            await process.wait()
+        except ProcessLookupError:
+            pass
+
+    async def _read_output(self, output: socket.socket) -> None:
+        try:
+            await self.read_output(output)
+        finally:
+            output.close()
+
+    async def _drain_stderr(self, process: asyncio.subprocess.Process) -> None:
+        """Collect -progress reports from FFmpeg's stderr; other lines are kept to log if it exits"""
+        while True:
+            line = await process.stderr.readline()
+            if not line:
+                break
+            text = line.decode(errors="ignore").strip()
+            match = PROGRESS_LINE.fullmatch(text)
+            if match:
+                key, value = match.groups()
+                self._progress[key] = value
+                # Every report ends with progress=continue (or end)
+                if key == "progress":
+                    self.progress, self._progress = self._progress, {}
+                    self.progress_time = time.time()
+                continue
+            self._stderr_tail.append(text)
+            logger.debug(f"FFmpeg {self.name} [{self.camera_id}]: {text}")
+
+    def progress_value(self, key: str) -> Optional[float]:
+        """A numeric field of the last progress report, e.g. fps, or speed without its trailing x"""
+        value = self.progress.get(key, "").rstrip("x")
+        try:
+            return float(value)
+        except ValueError:
+            return None  # Missing, or N/A before the first frame
+
+    async def _watch_ready_file(self) -> None:
+        while not self.ready_file.exists():
+            await asyncio.sleep(READY_POLL_INTERVAL)
+        logger.info(f"FFmpeg {self.name} for {self.camera_id} wrote its first output")
+        self.mark_ready()
+
+
+class TranscoderSupervisor:
+    """Owns every FFmpeg child of the server, caps how many run at once and schedules encoders on the CPUs"""
+
+    def __init__(self, max_processes: int = 8, scheduler: Optional[CpuScheduler] = None):
+        self.max_processes = max_processes
+        self.scheduler = scheduler or CpuScheduler()
+        self._running: List[Transcoder] = []
+
+    @property
+    def transcoders(self) -> List[Transcoder]:
+        return list(self._running)
+
+    def create(self, name: str, camera: CameraStream, build_command: Callable[[], List[str]],
+               **kwargs) -> Transcoder:
+        """Build a transcoder counted against this supervisor's limit once started"""
+        return Transcoder(self, name, camera, build_command, **kwargs)
+
+    def _claim(self, transcoder: Transcoder) -> None:
+        if len(self._running) >= self.max_processes:
+            raise TranscoderLimitError(
+                f"Already running {len(self._running)} FFmpeg processes (limit {self.max_processes})"
+            )
+        self._running.append(transcoder)
+
+    def _release(self, transcoder: Transcoder) -> None:
+        if transcoder in self._running:
+            self._running.remove(transcoder)
+
+    async def balance(self) -> None:
+        """Keep encoders within the CPU budget for as long as the server runs"""
+        while True:
+            await asyncio.sleep(BALANCE_INTERVAL)
+            try:
+                await self.scheduler.balance(self.transcoders)
+            except Exception:
+                logger.exception("CPU balancing failed")
+
+    async def shutdown(self) -> None:
+        """Stop every supervised process concurrently"""
+        await asyncio.gather(*(transcoder.stop() for transcoder in self.transcoders), return_exceptions=True)
@@ -0,0 +1,137 @@
+import asyncio
+import fractions
+import logging
+import time
+from contextlib import AsyncExitStack
+from typing import Dict, List, Literal, Optional
+
+from pydantic import BaseModel
+
+try:
+    import av
+    from aiortc import RTCConfiguration, RTCIceServer, RTCPeerConnection, RTCRtpSender, RTCSessionDescription
+    from aiortc.mediastreams import MediaStreamError, MediaStreamTrack
+except ImportError:  # Only needed once a browser asks for WebRTC
+    av = None
+    RTCPeerConnection = None
+    MediaStreamTrack = object
+
+from .hub import StreamHub, Subscriber
+
+logger = logging.getLogger(__name__)
+
+VIDEO_CLOCK_RATE = 90000  # RTP clock of every video payload
+CONNECT_TIMEOUT = 30.0  # Seconds a peer may take to finish ICE and DTLS before it is dropped
+
+
+class WebRtcOffer(BaseModel):
+    sdp: str  # With every ICE candidate included; candidates are not trickled
+    type: Literal["offer"] = "offer"
+
+
+class CameraTrack(MediaStreamTrack):
+    """One peer's video: access units from a camera's H264Hub, handed to aiortc as packets.
+
+    aiortc only packetizes packets into RTP, so the camera's H.264 reaches the browser
+    without being decoded or encoded. The track joins at the next live keyframe, and
+    like any hub viewer, skips ahead to the next one if the peer falls behind.
+    """
+
+    kind = "video"
+
+    def __init__(self, hub: StreamHub, client: str):
+        super().__init__()
+        self.hub = hub
+        self.client = client
+        self._subscription = AsyncExitStack()
+        self._subscriber: Optional[Subscriber] = None
+        self._start: Optional[float] = None
+        self._last_pts = -1
+        self._time_base = fractions.Fraction(1, VIDEO_CLOCK_RATE)
+
+    async def recv(self) -> "av.Packet":
+        if self.readyState != "live":
+            raise MediaStreamError
+        if self._subscriber is None:
+            self._subscriber = await self._subscription.enter_async_context(self.hub.subscribe(self.client, live=True))
+        data = await self._subscriber.read()
+        if data is None:
+            self.stop()
+            raise MediaStreamError
+        now = time.monotonic()
+        if self._start is None:
+            self._start = now
+        # Arrival time stands in for capture time; strictly increasing so no two frames share an RTP timestamp
+        pts = max(int((now - self._start) * VIDEO_CLOCK_RATE), self._last_pts + 1)
+        self._last_pts = pts
+        packet = av.Packet(data)
+        packet.pts = pts
+        packet.time_base = self._time_base
+        return packet
+
+    def stop(self) -> None:
+        super().stop()
+        asyncio.ensure_future(self._subscription.aclose())
+
+
+class WebRtcGateway:
+    """Answers browsers' WebRTC offers with a camera's H.264, forwarded without re-encoding.
+
+    Signaling is a single request: the browser POSTs an offer with its ICE candidates
+    already gathered, and gets back an answer with the proxy's. Each peer gets its own
+    track, while every peer of a camera shares its hub and upstream connection.
+    """
+
+    def __init__(self, ice_servers: List[str]):
+        if RTCPeerConnection is None:
+            raise RuntimeError("WebRTC requires aiortc (pip install aiortc)")
+        self.ice_servers = ice_servers
+        self._peers: Dict[RTCPeerConnection, str] = {}  # Camera each open peer connection watches
+
+    def peer_counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for camera_id in self._peers.values():
+            counts[camera_id] = counts.get(camera_id, 0) + 1
+        return counts
+
+    async def answer(self, hub: StreamHub, offer: str, client: str) -> str:
+        """Set up a peer connection sending the hub's stream and return the SDP answer"""
+        configuration = RTCConfiguration([RTCIceServer(url) for url in self.ice_servers])
+        pc = RTCPeerConnection(configuration)
+        camera_id = hub.config.id
+        self._peers[pc] = camera_id
+        track = CameraTrack(hub, f"webrtc {client}")
+
+        @pc.on("connectionstatechange")
+        async def on_state() -> None:
+            logger.info(f"WebRTC peer {client} of camera {camera_id} is {pc.connectionState}")
+            if pc.connectionState in ("failed", "closed"):
+                await self._close(pc)
+
+        try:
+            # Created before the offer is applied, so the offer's video is negotiated as H.264 only
+            transceiver = pc.addTransceiver(track, direction="sendonly")
+            transceiver.setCodecPreferences([
+                codec for codec in RTCRtpSender.getCapabilities("video").codecs if codec.mimeType == "video/H264"
+            ])
+            await pc.setRemoteDescription(RTCSessionDescription(sdp=offer, type="offer"))
+            await pc.setLocalDescription(await pc.createAnswer())
+        except Exception:
+            await self._close(pc)
+            raise
+        # A peer that never connects would otherwise hold its ICE agent forever
+        asyncio.get_running_loop().call_later(CONNECT_TIMEOUT, self._drop_unconnected, pc)
+        return pc.localDescription.sdp
+
+    def _drop_unconnected(self, pc: "RTCPeerConnection") -> None:
+        if pc in self._peers and pc.connectionState != "connected":
+            logger.warning(f"WebRTC peer of camera {self._peers[pc]} did not connect, dropping it")
+            asyncio.ensure_future(self._close(pc))
+
+    async def _close(self, pc: "RTCPeerConnection") -> None:
+        self._peers.pop(pc, None)
+        await pc.close()
+
+    async def close(self) -> None:
+        for pc in list(self._peers):
+            await self._close(pc)
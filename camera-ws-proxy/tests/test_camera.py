@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from src.camera import CallbackSink, CameraStream
+from src.config import CameraConfig
+
+from .test_h264 import IDR, P_SLICE, P_SLICE_CONTINUED, PPS, SPS
+
+
+class Received:
+    def __init__(self, name: str):
+        self.data = bytearray()
+        self.sink = CallbackSink(name, self.data.extend)
+
+    async def wait_for(self, size: int) -> None:
+        while len(self.data) < size:
+            await asyncio.sleep(0.01)
+
+
+@pytest_asyncio.fixture
+async def camera_server():
+    """A camera that sends its parameter sets and first picture on connect, then whatever the test puts in `send`"""
+    send: asyncio.Queue = asyncio.Queue()
+
+    async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        writer.write(SPS + PPS + IDR + P_SLICE)
+        while True:
+            writer.write(await send.get())
+            await writer.drain()
+
+    server = await asyncio.start_server(serve, "127.0.0.1", 0)
+    server.send = send
+    yield server
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_late_sinks_start_on_the_next_access_unit(camera_server):
+    port = camera_server.sockets[0].getsockname()[1]
+    camera = CameraStream(CameraConfig(id="cam", name="Cam", ip_address="127.0.0.1", port=port))
+    first, late = Received("first"), Received("late")
+    camera.attach(first.sink)
+    await asyncio.wait_for(first.wait_for(len(SPS + PPS + IDR + P_SLICE)), 5)
+    camera.attach(late.sink)
+    # The rest of the picture in progress, then the next one
+    camera_server.send.put_nowait(P_SLICE_CONTINUED)
+    await asyncio.wait_for(first.wait_for(len(SPS + PPS + IDR + P_SLICE + P_SLICE_CONTINUED)), 5)
+    camera_server.send.put_nowait(P_SLICE)
+    await asyncio.wait_for(late.wait_for(len(SPS + PPS + P_SLICE)), 5)
+    assert first.data == SPS + PPS + IDR + P_SLICE + P_SLICE_CONTINUED + P_SLICE
+    assert late.data == SPS + PPS + P_SLICE
+    await camera.detach(first.sink)
+    await camera.detach(late.sink)
+    assert not camera.is_connected
@@ -0,0 +1,36 @@
+import json
+
+from src.cluster import Cluster
+from src.metrics import Exposition
+
+
+def test_workers_take_the_lowest_free_number(tmp_path):
+    first, second = Cluster(tmp_path), Cluster(tmp_path)
+    assert (first.worker, second.worker) == (0, 1)
+    assert first.other_workers() == [(1, str(tmp_path / "worker-1.sock"))]
+    assert second.other_workers() == [(0, str(tmp_path / "worker-0.sock"))]
+    second.close()
+    assert first.other_workers() == []
+    # A replacement worker reuses the number, so its metrics keep their labels
+    third = Cluster(tmp_path)
+    assert third.worker == 1
+    third.close()
+    first.close()
+
+
+def test_metrics_of_several_workers_merge_into_one_family_each():
+    mine, theirs = Exposition(worker="0"), Exposition(worker="1")
+    for exposition, viewers in ((mine, 2), (theirs, 3)):
+        exposition.add("camera_viewers", "gauge", "WebSocket viewers connected", viewers, camera="cam")
+    theirs.add("camera_upstream_connected", "gauge", "Whether the TCP connection to the camera is open", 1, camera="cam")
+    # As it arrives from the other worker
+    mine.merge(json.loads(json.dumps(theirs.families)))
+    assert mine.render().splitlines() == [
+        "# HELP camera_viewers WebSocket viewers connected",
+        "# TYPE camera_viewers gauge",
+        'camera_viewers{camera="cam",worker="0"} 2',
+        'camera_viewers{camera="cam",worker="1"} 3',
+        "# HELP camera_upstream_connected Whether the TCP connection to the camera is open",
+        "# TYPE camera_upstream_connected gauge",
+        'camera_upstream_connected{camera="cam",worker="1"} 1',
+    ]
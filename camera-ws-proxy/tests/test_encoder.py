@@ -0,0 +1,157 @@
+from typing import Dict, List, Tuple
+
+import pytest
+
+from src import encoder as encoder_module
+from src.config import CameraConfig, Config
+from src.encoder import BALANCE_COOLDOWN, CpuScheduler, Encoding
+
+
+class FakeTranscoder:
+    """What the scheduler reads of a Transcoder; restart places it again, as the real one does on respawn"""
+
+    def __init__(self, scheduler: CpuScheduler, name: str, priority: str = "normal", profile: str = "hls"):
+        self.scheduler = scheduler
+        self.camera = type("Camera", (), {})()
+        self.camera.config = CameraConfig(id=name, name=name, ip_address="127.0.0.1", port=0, priority=priority)
+        self.camera_id = name
+        self.name = "hls"
+        self.profile = profile
+        self.process = None
+        self.encoding: Encoding = None
+        self.restarts = 0
+
+    def start(self) -> Encoding:
+        self.encoding = self.scheduler.place(self)
+        return self.encoding
+
+    async def restart(self) -> None:
+        self.restarts += 1
+        self.scheduler.release(self)
+        self.start()
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = CpuScheduler(Config(cameras={}).encoder_profiles, cpu_budget=4)
+    scheduler.cpus = [1, 2, 3, 4]
+    pinned: Dict[int, Tuple[int, ...]] = {}
+    monkeypatch.setattr(scheduler, "_set_affinity", lambda pid, cpus: pinned.__setitem__(pid, cpus))
+    monkeypatch.setattr(encoder_module.os, "setpriority", lambda *args: None)
+    scheduler.pinned = pinned
+    return scheduler
+
+
+def start(scheduler: CpuScheduler, count: int, **kwargs) -> List[FakeTranscoder]:
+    transcoders = [FakeTranscoder(scheduler, f"cam{number}", **kwargs) for number in range(count)]
+    for transcoder in transcoders:
+        transcoder.start()
+    return transcoders
+
+
+def test_threads_and_cores_are_shared_evenly(scheduler):
+    first, = start(scheduler, 1)
+    assert first.encoding.threads == 4
+    assert scheduler._placed[first] == (1, 2, 3, 4)
+    second = FakeTranscoder(scheduler, "second")
+    assert second.start().threads == 2
+    assert (scheduler._placed[first], scheduler._placed[second]) == ((1, 2), (3, 4))
+    third = FakeTranscoder(scheduler, "third")
+    assert third.start().threads == 1
+    # Consecutive slices that cover every core
+    assert [scheduler._placed[t] for t in (first, second, third)] == [(1,), (2,), (3, 4)]
+
+
+def test_more_encoders_than_cores_get_one_core_each(scheduler):
+    transcoders = start(scheduler, 6)
+    assert [scheduler._placed[t] for t in transcoders] == [(1,), (2,), (3,), (4,), (1,), (2,)]
+    assert transcoders[-1].encoding.threads == 1
+
+
+def test_running_encoders_move_when_one_exits(scheduler):
+    first, second = start(scheduler, 2)
+    scheduler.pin(first, 100)
+    scheduler.pin(second, 200)
+    assert scheduler.pinned == {100: (1, 2), 200: (3, 4)}
+    scheduler.release(second)
+    # The survivor spreads over every core without a restart
+    assert scheduler.pinned[100] == (1, 2, 3, 4)
+    assert second not in scheduler._placed
+
+
+def test_unknown_profile_is_refused(scheduler):
+    transcoder = FakeTranscoder(scheduler, "cam", profile="removed")
+    with pytest.raises(ValueError):
+        transcoder.start()
+    assert transcoder not in scheduler._placed
+
+
+def measured(scheduler: CpuScheduler, monkeypatch, load: float, usage: Dict[FakeTranscoder, float]) -> None:
+    monkeypatch.setattr(scheduler, "measure", lambda transcoders: load)
+    scheduler._usage.update(usage)
+    scheduler._last_change = -BALANCE_COOLDOWN  # As if the cooldown had passed
+
+
+@pytest.mark.asyncio
+async def test_over_budget_degrades_the_busiest_lowest_priority_encoder(scheduler, monkeypatch):
+    high, = start(scheduler, 1, priority="high")
+    normal = FakeTranscoder(scheduler, "normal")
+    quiet, busy = FakeTranscoder(scheduler, "quiet", "low"), FakeTranscoder(scheduler, "busy", "low")
+    for transcoder in (normal, quiet, busy):
+        transcoder.start()
+    measured(scheduler, monkeypatch, 5.0, {high: 3.0, normal: 1.0, quiet: 0.2, busy: 0.8})
+    await scheduler.balance([high, normal, quiet, busy])
+    assert [t.restarts for t in (high, normal, quiet, busy)] == [0, 0, 0, 1]
+    assert busy.encoding.degraded
+    assert busy.encoding.profile == scheduler.profiles["hls-low"]
+    # Nothing else changes until the cooldown is over
+    await scheduler.balance([high, normal, quiet, busy])
+    assert quiet.restarts == 0
+
+
+@pytest.mark.asyncio
+async def test_high_priority_is_never_degraded(scheduler, monkeypatch):
+    high, = start(scheduler, 1, priority="high")
+    measured(scheduler, monkeypatch, 8.0, {high: 8.0})
+    await scheduler.balance([high])
+    assert high.restarts == 0
+    assert not high.encoding.degraded
+
+
+@pytest.mark.asyncio
+async def test_restores_once_the_full_profile_fits(scheduler, monkeypatch):
+    transcoder, = start(scheduler, 1, priority="low")
+    scheduler.degraded.add((transcoder.camera_id, transcoder.name))
+    scheduler.release(transcoder)
+    transcoder.start()
+    assert transcoder.encoding.degraded
+    # hls-low encodes an eighth of the pixels per second of hls at 720p30
+    measured(scheduler, monkeypatch, 3.0, {transcoder: 0.3})
+    await scheduler.balance([transcoder])
+    assert transcoder.restarts == 0  # 3.0 - 0.3 + 2.4 is over 80% of the budget
+    measured(scheduler, monkeypatch, 0.5, {transcoder: 0.3})
+    await scheduler.balance([transcoder])
+    assert transcoder.restarts == 1
+    assert not transcoder.encoding.degraded
+
+
+@pytest.mark.asyncio
+async def test_encoders_whose_profile_a_reload_removed_are_left_alone(scheduler, monkeypatch):
+    transcoder, = start(scheduler, 1, priority="low")
+    scheduler.profiles = {name: p for name, p in scheduler.profiles.items() if name != "hls"}
+    measured(scheduler, monkeypatch, 8.0, {transcoder: 8.0})
+    await scheduler.balance([transcoder])
+    assert transcoder.restarts == 0
+
+
+@pytest.mark.parametrize("framerate, valid", [(30, True), (25, True), (15, False), (20, False)])
+def test_mpeg1_cameras_need_a_rate_mpeg1_can_encode(framerate, valid):
+    cameras = {"cam": {"name": "Cam", "ip_address": "127.0.0.1", "port": 0, "framerate": framerate}}
+    if valid:
+        Config.model_validate({"cameras": cameras})
+    else:
+        with pytest.raises(ValueError, match=f"cannot encode {framerate} fps"):
+            Config.model_validate({"cameras": cameras})
+    # A profile with its own rate decides for the camera
+    profiles = {"jsmpeg": {"framerate": 30}, "jsmpeg-low": {"framerate": 30}}
+    Config.model_validate({"cameras": cameras, "encoder_profiles": profiles})
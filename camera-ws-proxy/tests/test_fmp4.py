@@ -0,0 +1,71 @@
+import struct
+
+import pytest
+
+from src.fmp4 import SAMPLE_IS_NON_SYNC, FragmentParser
+
+TIMESCALE = 90000
+FRAME = 3000
+
+
+def box(box_type: bytes, *payload: bytes) -> bytes:
+    data = b"".join(payload)
+    return struct.pack(">I4s", 8 + len(data), box_type) + data
+
+
+def full_box(box_type: bytes, version: int, flags: int, *payload: bytes) -> bytes:
+    return box(box_type, struct.pack(">I", version << 24 | flags), *payload)
+
+
+FTYP = box(b"ftyp", b"iso5\x00\x00\x02\x00iso5iso6mp41")
+MOOV = box(
+    b"moov",
+    box(b"trak", box(b"mdia", full_box(b"mdhd", 0, 0, struct.pack(">IIIIHH", 0, 0, TIMESCALE, 0, 0x55C4, 0)))),
+    box(b"mvex", full_box(b"trex", 0, 0, struct.pack(">IIIII", 1, 1, 0, 0, SAMPLE_IS_NON_SYNC))),
+)
+
+
+def fragment(decode_time: int, keyframe: bool) -> bytes:
+    """A moof+mdat of three samples, with default durations and the first sample's flags in the trun"""
+    tfhd = full_box(b"tfhd", 0, 0x020008, struct.pack(">II", 1, FRAME))
+    tfdt = full_box(b"tfdt", 1, 0, struct.pack(">Q", decode_time))
+    first_flags = 0x02000000 if keyframe else SAMPLE_IS_NON_SYNC
+    trun = full_box(b"trun", 0, 0x000205, struct.pack(">IiIIII", 3, 0, first_flags, 10, 10, 10))
+    return box(b"moof", full_box(b"mfhd", 0, 0, struct.pack(">I", 1)), box(b"traf", tfhd, tfdt, trun)) + box(b"mdat", b"\x00" * 30)
+
+
+def test_splits_init_and_fragments():
+    parser = FragmentParser()
+    styp = box(b"styp", b"msdh\x00\x00\x00\x00msdhmsix")
+    first, second = fragment(0, True), fragment(3 * FRAME, False)
+    fragments = parser.feed(memoryview(FTYP + MOOV + styp + first + second))
+    assert parser.init == FTYP + MOOV
+    assert parser.timescale == TIMESCALE
+    assert [(f.data, f.keyframe, f.decode_time, f.duration) for f in fragments] == [
+        (styp + first, True, 0, 3 * FRAME),
+        (second, False, 3 * FRAME, 3 * FRAME),
+    ]
+
+
+@pytest.mark.parametrize("size", [1, 7, 64])
+def test_fragments_only_complete_with_their_mdat(size):
+    parser = FragmentParser()
+    stream = FTYP + MOOV + fragment(0, True) + fragment(3 * FRAME, True)
+    fragments = []
+    for offset in range(0, len(stream), size):
+        fragments += parser.feed(memoryview(stream[offset:offset + size]))
+    assert parser.init == FTYP + MOOV
+    assert [f.decode_time for f in fragments] == [0, 3 * FRAME]
+    assert all(f.keyframe for f in fragments)
+
+
+def test_per_sample_durations_and_flags():
+    parser = FragmentParser()
+    parser.feed(memoryview(FTYP + MOOV))
+    tfhd = full_box(b"tfhd", 0, 0x020000, struct.pack(">I", 1))
+    tfdt = full_box(b"tfdt", 0, 0, struct.pack(">I", 42))
+    # Durations and flags per sample, with no first_sample_flags
+    trun = full_box(b"trun", 0, 0x000500, struct.pack(">IIIII", 2, 1000, 0x02000000, 2000, SAMPLE_IS_NON_SYNC))
+    moof = box(b"moof", box(b"traf", tfhd, tfdt, trun))
+    [parsed] = parser.feed(memoryview(moof + box(b"mdat", b"\x00" * 4)))
+    assert (parsed.keyframe, parsed.decode_time, parsed.duration) == (True, 42, 3000)
@@ -0,0 +1,106 @@
+import pytest
+
+from src.h264 import AccessUnitParser, AccessUnitTracker
+
+SPS = b"\x00\x00\x00\x01\x67\x64\x00\x1f\xac"
+PPS = b"\x00\x00\x00\x01\x68\xee\x3c\xb0"
+IDR = b"\x00\x00\x01\x65\x88\x84\x21\xa0"  # first_mb_in_slice 0, so it starts a picture
+P_SLICE = b"\x00\x00\x01\x41\x9a\x24\x6c\x42"
+# A second slice of the same picture: first_mb_in_slice is not 0
+P_SLICE_CONTINUED = b"\x00\x00\x01\x41\x12\x34\x56\x78"
+
+STREAM = SPS + PPS + IDR + P_SLICE + P_SLICE_CONTINUED + P_SLICE + SPS + PPS + IDR + P_SLICE
+EXPECTED = [
+    (SPS + PPS + IDR, True),
+    (P_SLICE + P_SLICE_CONTINUED, False),
+    (P_SLICE, False),
+    (SPS + PPS + IDR, True),
+]
+
+
+def feed_in_chunks(parser: AccessUnitParser, data: bytes, size: int):
+    units = []
+    for offset in range(0, len(data), size):
+        units += parser.feed(memoryview(data[offset:offset + size]))
+    return units
+
+
+def test_splits_access_units():
+    parser = AccessUnitParser()
+    units = parser.feed(memoryview(STREAM))
+    assert [(unit.data, unit.keyframe) for unit in units] == EXPECTED
+    # The last picture stays buffered until the next one starts
+    assert parser.pending == P_SLICE
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 4, 5, 7, 13])
+def test_chunk_boundaries_do_not_change_the_split(size):
+    parser = AccessUnitParser()
+    units = feed_in_chunks(parser, STREAM, size)
+    assert [(unit.data, unit.keyframe) for unit in units] == EXPECTED
+    assert parser.pending == P_SLICE
+
+
+def test_captures_parameter_sets():
+    parser = AccessUnitParser()
+    assert parser.parameter_sets == b""
+    feed_in_chunks(parser, SPS + PPS + IDR + P_SLICE, 3)
+    assert parser.sps == SPS
+    assert parser.pps == PPS
+    assert parser.parameter_sets == SPS + PPS
+
+
+def test_keeps_the_latest_parameter_sets():
+    parser = AccessUnitParser()
+    new_sps = b"\x00\x00\x00\x01\x67\x4d\x00\x28\xab"
+    parser.feed(memoryview(SPS + PPS + IDR + P_SLICE + new_sps + PPS + IDR))
+    assert parser.sps == new_sps
+
+
+def test_no_access_unit_before_a_picture_completes():
+    parser = AccessUnitParser()
+    assert parser.feed(memoryview(SPS + PPS + IDR)) == []
+    assert parser.pending == SPS + PPS + IDR
+
+
+def track_in_chunks(tracker: AccessUnitTracker, data: bytes, size: int):
+    """Feed `data` in chunks, returning the stream offset of every access unit start the tracker reported"""
+    starts = []
+    for offset in range(0, len(data), size):
+        tracker.feed(memoryview(data[offset:offset + size]))
+        if tracker.access_unit_start is not None:
+            starts.append(offset + tracker.access_unit_start)
+    return starts
+
+
+def test_tracker_reports_where_each_chunk_first_starts_an_access_unit():
+    tracker = AccessUnitTracker()
+    tracker.feed(memoryview(STREAM))
+    assert tracker.access_unit_start == 0
+    tracker.feed(memoryview(P_SLICE_CONTINUED + P_SLICE))
+    assert tracker.access_unit_start == len(P_SLICE_CONTINUED)
+    tracker.feed(memoryview(P_SLICE_CONTINUED))
+    assert tracker.access_unit_start is None
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 4, 5, 7, 13])
+def test_tracker_finds_parameter_sets_across_chunk_boundaries(size):
+    tracker = AccessUnitTracker()
+    new_sps = b"\x00\x00\x00\x01\x67\x4d\x00\x28\xab"
+    stream = SPS + PPS + IDR + P_SLICE + new_sps + PPS + IDR + P_SLICE
+    starts = track_in_chunks(tracker, stream, size)
+    assert tracker.parameter_sets == new_sps + PPS
+    # Only access units whose start code begins within a chunk can be joined on
+    boundaries = [0, len(SPS + PPS + IDR), len(SPS + PPS + IDR + P_SLICE), len(stream) - len(P_SLICE)]
+    assert set(starts) <= set(boundaries)
+    if size >= len(P_SLICE):
+        assert starts
+
+
+def test_tracker_skips_the_picture_in_progress():
+    tracker = AccessUnitTracker()
+    # Joined mid-picture: the continued slice is not a place to start decoding
+    tracker.feed(memoryview(P_SLICE_CONTINUED[1:] + P_SLICE_CONTINUED))
+    assert tracker.access_unit_start is None
+    tracker.feed(memoryview(P_SLICE))
+    assert tracker.access_unit_start == 0
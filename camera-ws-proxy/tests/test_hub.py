@@ -0,0 +1,166 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from src.config import CameraConfig
+from src.hub import Chunk, StreamHub, Subscriber
+
+HEADER = b"header:"
+
+
+class FakeCamera:
+    def __init__(self):
+        self.config = CameraConfig(id="cam", name="Cam", ip_address="127.0.0.1", port=0)
+
+
+class FakeHub(StreamHub):
+    """A hub whose source is the test: chunks go in through `publish`"""
+
+    format = "fake"
+
+    def __init__(self, **kwargs):
+        super().__init__(FakeCamera(), **kwargs)
+
+    async def _start(self) -> None:
+        pass
+
+    async def _stop(self) -> None:
+        pass
+
+    def _header(self) -> bytes:
+        return HEADER
+
+    def publish(self, *names: str) -> None:
+        """Publish one chunk per name; names starting with K are keyframes"""
+        self._publish(Chunk(name.encode(), name.startswith("K")) for name in names)
+
+
+async def read(subscriber: Subscriber, count: int) -> List[bytes]:
+    return [await subscriber.read() for _ in range(count)]
+
+
+@pytest.mark.asyncio
+async def test_each_viewer_reads_the_ring_at_its_own_pace():
+    hub = FakeHub(ring_size=16, max_queue=8)
+    await hub.start()
+    hub.publish("K0")
+    async with hub.subscribe() as fast, hub.subscribe() as slow:
+        assert await fast.read() == HEADER + b"K0"
+        hub.publish("P1", "P2")
+        assert await read(fast, 2) == [b"P1", b"P2"]
+        assert fast.queue_depth == 0
+        assert slow.queue_depth == 2
+        assert await read(slow, 3) == [HEADER + b"K0", b"P1", b"P2"]
+        assert fast.dropped_chunks == slow.dropped_chunks == 0
+
+
+@pytest.mark.asyncio
+async def test_a_lagging_viewer_skips_to_the_newest_keyframe_within_its_queue():
+    hub = FakeHub(ring_size=8, max_queue=4)
+    await hub.start()
+    hub.publish("K0")
+    async with hub.subscribe() as fast, hub.subscribe() as slow:
+        await fast.read()
+        await slow.read()
+        for name in ("P1", "P2", "P3", "P4", "P5", "K6", "P7", "P8"):
+            hub.publish(name)
+            assert await fast.read() == name.encode()
+        # Five chunks behind the head, one more than the queue allows; the GOP at K6 is the newest in reach
+        assert await read(slow, 3) == [b"K6", b"P7", b"P8"]
+        assert slow.at_keyframe is False
+        assert (slow.dropped_chunks, slow.drop_events) == (5, 1)
+        assert fast.dropped_chunks == 0
+        assert hub.dropped_chunks == 5
+
+
+@pytest.mark.asyncio
+async def test_a_viewer_behind_every_keyframe_waits_for_the_next_one():
+    hub = FakeHub(ring_size=8, max_queue=4)
+    await hub.start()
+    hub.publish("K0")
+    async with hub.subscribe() as subscriber:
+        await subscriber.read()
+        hub.publish(*(f"P{number}" for number in range(1, 11)))
+        # The ring wrapped past the viewer's cursor, and nothing it could decode from is within its queue
+        reader = asyncio.create_task(read(subscriber, 2))
+        await asyncio.sleep(0)
+        hub.publish("P11", "K12", "P13")
+        assert await reader == [HEADER + b"K12", b"P13"]
+        assert subscriber.drop_events == 1
+        assert subscriber.dropped_chunks == 11
+        assert hub.dropped_chunks == 11
+
+
+@pytest.mark.asyncio
+async def test_reads_end_once_the_source_stops():
+    hub = FakeHub()
+    await hub.start()
+    hub.publish("K0")
+    async with hub.subscribe() as subscriber:
+        await subscriber.read()
+        await hub.stop()
+        assert await subscriber.read() is None
+
+
+@pytest.mark.asyncio
+async def test_new_viewers_start_with_the_cached_gop():
+    hub = FakeHub()
+    await hub.start()
+    hub.publish("P0", "K1", "P2", "K3", "P4")
+    async with hub.subscribe() as subscriber:
+        assert await subscriber.read() == HEADER + b"K3"
+        assert (subscriber.at_keyframe, subscriber.header_length) == (True, len(HEADER))
+        assert await subscriber.read() == b"P4"
+        assert not subscriber.at_keyframe
+        hub.publish("P5")
+        assert await subscriber.read() == b"P5"
+        assert subscriber.dropped_chunks == 0
+
+
+@pytest.mark.asyncio
+async def test_live_viewers_wait_for_the_next_keyframe():
+    hub = FakeHub()
+    await hub.start()
+    hub.publish("K0", "P1")
+    async with hub.subscribe(live=True) as subscriber:
+        hub.publish("K2")
+        assert await subscriber.read() == HEADER + b"K2"
+
+
+@pytest.mark.asyncio
+async def test_a_gop_too_large_to_cache_is_not_replayed():
+    hub = FakeHub(gop_cache_bytes=5)
+    await hub.start()
+    hub.publish("K0", "P1", "P2")
+    async with hub.subscribe() as subscriber:
+        assert not subscriber.backlog
+        hub.publish("K3")
+        assert await subscriber.read() == HEADER + b"K3"
+
+
+@pytest.mark.asyncio
+async def test_a_source_restart_drops_the_cache_and_resyncs_viewers():
+    hub = FakeHub()
+    await hub.start()
+    hub.publish("K0", "P1")
+    async with hub.subscribe() as subscriber:
+        hub._source_restarted()
+        assert not subscriber.backlog
+        hub.publish("P2", "K3")
+        assert await subscriber.read() == HEADER + b"K3"
+        assert subscriber.dropped_chunks == 0
+    async with hub.subscribe() as subscriber:
+        assert await subscriber.read() == HEADER + b"K3"
+
+
+@pytest.mark.asyncio
+async def test_waiting_for_the_first_keyframe_is_not_a_drop():
+    hub = FakeHub()
+    await hub.start()
+    hub.publish("P0")
+    async with hub.subscribe() as subscriber:
+        hub.publish("P1", "P2", "K3")
+        assert await subscriber.read() == HEADER + b"K3"
+        assert subscriber.dropped_chunks == 0
+        assert hub.dropped_chunks == 0
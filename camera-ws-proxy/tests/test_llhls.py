@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from src.llhls import SegmentStore
+
+PART = 0.25
+
+
+def fill(store: SegmentStore, segments: int) -> None:
+    """Add whole segments of four parts, each starting with a keyframe"""
+    for _ in range(segments):
+        for number in range(4):
+            store.add_part(b"part", PART, independent=number == 0)
+
+
+@pytest.mark.asyncio
+async def test_segments_start_at_a_keyframe_once_the_target_is_reached():
+    store = SegmentStore(target_duration=1.0, part_target=PART)
+    store.add_part(b"late", PART, independent=False)  # Nothing to attach it to yet
+    fill(store, 2)
+    store.add_part(b"next", PART, independent=True)
+    assert store.get_segment(0) == b"part" * 4
+    assert store.get_segment(1) == b"part" * 4
+    assert store.get_segment(2) is None  # Still being written
+    assert store.get_part(2, 0) == b"next"
+    assert store.get_part(2, 1) is None
+
+
+@pytest.mark.asyncio
+async def test_only_the_window_of_complete_segments_is_kept():
+    store = SegmentStore(target_duration=1.0, part_target=PART, window=2)
+    fill(store, 5)
+    store.add_part(b"next", PART, independent=True)
+    assert store.get_segment(2) is None
+    assert store.get_part(2, 0) is None
+    assert store.get_segment(3) is not None
+    assert store.get_segment(4) is not None
+    assert "#EXT-X-MEDIA-SEQUENCE:3\n" in store.playlist()
+
+
+@pytest.mark.asyncio
+async def test_wait_for_blocks_until_the_part_exists():
+    store = SegmentStore(target_duration=1.0, part_target=PART)
+    store.add_part(b"first", PART, independent=True)
+    waiter = asyncio.create_task(store.wait_for(0, 1, timeout=5))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    store.add_part(b"second", PART, independent=False)
+    assert await waiter
+
+
+@pytest.mark.asyncio
+async def test_wait_for_a_whole_segment_and_timeout():
+    store = SegmentStore(target_duration=1.0, part_target=PART)
+    fill(store, 1)
+    # Segment 0 has all its parts but is only complete once the next one starts
+    assert not await store.wait_for(0, timeout=0.05)
+    store.add_part(b"next", PART, independent=True)
+    assert await store.wait_for(0, timeout=0.05)
+    # A part past the end of a segment that closed is there in the sense that the playlist moved on
+    assert await store.wait_for(0, 7, timeout=0.05)
+
+
+@pytest.mark.asyncio
+async def test_blocking_requests_too_far_ahead_are_rejected():
+    store = SegmentStore(target_duration=1.0, part_target=PART)
+    fill(store, 1)
+    store.add_part(b"next", PART, independent=True)
+    # Segment 1 is the last one in the playlist, so _HLS_msn may block up to two past it
+    assert not store.is_too_far_ahead(3)
+    assert store.is_too_far_ahead(4)
+
+
+@pytest.mark.asyncio
+async def test_playlist_lists_recent_parts_and_hints_the_next():
+    store = SegmentStore(target_duration=1.0, part_target=PART)
+    fill(store, 4)
+    store.add_part(b"next", PART, independent=True)
+    playlist = store.playlist()
+    assert "CAN-BLOCK-RELOAD=YES" in playlist
+    # Parts are listed for the last three segments only
+    assert 'URI="part_1_0.m4s"' not in playlist
+    assert 'URI="part_2_0.m4s",INDEPENDENT=YES' in playlist
+    assert 'URI="part_4_0.m4s",INDEPENDENT=YES' in playlist
+    assert "segment_1.m4s" in playlist
+    assert "segment_4.m4s" not in playlist
+    assert playlist.endswith('#EXT-X-PRELOAD-HINT:TYPE=PART,URI="part_4_1.m4s"\n')
+
+
+@pytest.mark.asyncio
+async def test_reset_marks_a_discontinuity_and_keeps_counting():
+    store = SegmentStore(target_duration=1.0, part_target=PART)
+    fill(store, 2)
+    store.reset()
+    store.add_part(b"restarted", PART, independent=True)
+    playlist = store.playlist()
+    assert "#EXT-X-MEDIA-SEQUENCE:2\n" in playlist
+    assert "#EXT-X-DISCONTINUITY" in playlist
+    assert store.get_part(2, 0) == b"restarted"
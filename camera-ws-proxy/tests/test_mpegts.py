@@ -0,0 +1,70 @@
+from src.mpegts import TS_PACKET_SIZE, PacketBuffer, TSScanner
+
+PMT_PID = 0x1000
+VIDEO_PID = 0x0100
+
+
+def packet(pid: int, payload: bytes, unit_start: bool = False, adaptation: bytes = b"") -> bytes:
+    header = bytes([0x47, (0x40 if unit_start else 0) | pid >> 8, pid & 0xFF])
+    if adaptation:
+        header += bytes([0x30, len(adaptation)]) + adaptation
+    else:
+        header += b"\x10"
+    data = header + payload
+    return data + b"\xff" * (TS_PACKET_SIZE - len(data))
+
+
+def section(table_id: int, body: bytes) -> bytes:
+    length = len(body) + 4  # Followed by a CRC the scanner does not check
+    return bytes([table_id, 0xB0 | length >> 8, length & 0xFF]) + body + b"\x00" * 4
+
+
+PAT = packet(0, b"\x00" + section(0x00, b"\x00\x01\xc1\x00\x00" + bytes([0x00, 0x01, 0xE0 | PMT_PID >> 8, PMT_PID & 0xFF])),
+             unit_start=True)
+PMT = packet(PMT_PID, b"\x00" + section(0x02, b"\x00\x01\xc1\x00\x00" + bytes([0xE0 | VIDEO_PID >> 8, VIDEO_PID & 0xFF])
+                                        + b"\xf0\x00" + bytes([0x1B, 0xE0 | VIDEO_PID >> 8, VIDEO_PID & 0xFF, 0xF0, 0x00])),
+             unit_start=True)
+KEYFRAME = packet(VIDEO_PID, b"\x00\x00\x01\xe0", unit_start=True, adaptation=b"\x40")
+FRAME = packet(VIDEO_PID, b"\x00\x00\x01\xe0", unit_start=True, adaptation=b"\x00")
+CONTINUATION = packet(VIDEO_PID, b"\xab" * 10)
+
+
+def test_finds_video_pid_and_random_access_points():
+    scanner = TSScanner()
+    stream = PAT + PMT + KEYFRAME + CONTINUATION + FRAME + KEYFRAME
+    offsets = scanner.find_random_access(memoryview(stream))
+    assert scanner.pmt_pid == PMT_PID
+    assert scanner.video_pid == VIDEO_PID
+    assert offsets == [2 * TS_PACKET_SIZE, 5 * TS_PACKET_SIZE]
+    assert scanner.tables == [PAT, PMT]
+
+
+def test_no_tables_until_both_seen():
+    scanner = TSScanner()
+    scanner.find_random_access(memoryview(PAT))
+    assert scanner.tables == []
+    # The video PID is unknown before the PMT, so no packet counts as a random access point
+    assert scanner.find_random_access(memoryview(KEYFRAME)) == []
+
+
+def write(buffer: PacketBuffer, data: bytes) -> None:
+    buffer.free[:len(data)] = data
+    buffer.commit(len(data))
+
+
+def test_packet_buffer_keeps_partial_packet():
+    buffer = PacketBuffer(4 * TS_PACKET_SIZE)
+    write(buffer, PAT + PMT[:100])
+    assert bytes(buffer.packets()) == PAT
+    buffer.consume()
+    write(buffer, PMT[100:] + KEYFRAME)
+    assert bytes(buffer.packets()) == PMT + KEYFRAME
+    buffer.consume()
+    assert bytes(buffer.packets()) == b""
+
+
+def test_packet_buffer_resyncs_after_garbage():
+    buffer = PacketBuffer(4 * TS_PACKET_SIZE)
+    # A stray sync byte in the garbage is not followed by another one a packet later
+    write(buffer, b"\x01\x47\x02" + PAT + PMT)
+    assert bytes(buffer.packets()) == PAT + PMT
@@ -0,0 +1,153 @@
+from typing import List
+
+import pytest
+
+from src import recorder as recorder_module
+from src.camera import CallbackSink
+from src.config import CameraConfig, RecordingConfig
+from src.recorder import RECORD, Recorder, segment_name
+
+SPS = b"\x00\x00\x00\x01\x67\x64\x00\x1f\xac"
+PPS = b"\x00\x00\x00\x01\x68\xee\x3c\xb0"
+
+
+def idr(number: int) -> bytes:
+    return b"\x00\x00\x01\x65\x88" + bytes([number % 256 | 1]) * 90
+
+
+def p_slice(number: int) -> bytes:
+    return b"\x00\x00\x01\x41\x9a" + bytes([number % 256 | 1]) * 40
+
+
+class FakeCamera:
+    """Stands in for CameraStream: the test pushes bytes into whatever sinks are attached"""
+
+    def __init__(self, recording: RecordingConfig):
+        self.config = CameraConfig(id="cam", name="Cam", ip_address="127.0.0.1", port=0, recording=recording)
+        self.sinks: List[CallbackSink] = []
+
+    def attach(self, sink: CallbackSink) -> None:
+        self.sinks.append(sink)
+
+    async def detach(self, sink: CallbackSink) -> None:
+        self.sinks.remove(sink)
+
+    def send(self, data: bytes) -> None:
+        for sink in self.sinks:
+            sink.write(memoryview(data))
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(recorder_module.time, "time", clock.time)
+    return clock
+
+
+async def record(tmp_path, clock, gops: int, **recording) -> Recorder:
+    """Record one GOP per second, a keyframe and four P frames, with SPS/PPS only at the start"""
+    camera = FakeCamera(RecordingConfig(enabled=True, **recording))
+    recorder = Recorder(camera, tmp_path)
+    recorder.start()
+    camera.send(SPS + PPS)
+    for gop in range(gops):
+        for frame in range(5):
+            camera.send(idr(gop) if frame == 0 else p_slice(frame))
+            clock.now += 0.2
+    camera.send(idr(gops))  # Completes the last P frame
+    # Waits for the writer thread, so every file is on disk
+    await recorder.stop()
+    return recorder
+
+
+@pytest.mark.asyncio
+async def test_segments_start_with_parameter_sets(tmp_path, clock):
+    recorder = await record(tmp_path, clock, gops=6, segment_bytes=500, max_bytes=None)
+    assert len(recorder.segments) == 3
+    for segment in recorder.segments:
+        data = (tmp_path / segment_name(segment.seq)).read_bytes()
+        assert len(data) == segment.size
+        assert data.startswith(SPS + PPS + b"\x00\x00\x01\x65")
+    assert recorder.total_bytes == sum(segment.size for segment in recorder.segments)
+
+
+@pytest.mark.asyncio
+async def test_clip_starts_and_ends_at_keyframes(tmp_path, clock):
+    recorder = await record(tmp_path, clock, gops=6, segment_bytes=500, max_bytes=None)
+    # Keyframes are at 1000, 1001, ... ; the clip covers the GOPs at 1002 and 1003
+    ranges = recorder.clip_ranges(1002.5, 1003.5)
+    clip = b"".join(recorder.read_clip(ranges))
+    assert clip.startswith(SPS + PPS + idr(2))
+    assert idr(3) in clip
+    assert idr(4) not in clip
+    assert clip.endswith(p_slice(4))
+
+
+@pytest.mark.asyncio
+async def test_clip_outside_the_recording(tmp_path, clock):
+    recorder = await record(tmp_path, clock, gops=2, segment_bytes=500, max_bytes=None)
+    assert recorder.clip_ranges(900.0, 950.0) == []
+    assert recorder.clip_ranges(1001.5, 1001.0) == []
+
+
+@pytest.mark.asyncio
+async def test_index_is_reloaded_and_a_partial_record_dropped(tmp_path, clock):
+    recorder = await record(tmp_path, clock, gops=4, segment_bytes=500, max_bytes=None)
+    with open(recorder.index_path, "ab") as index:
+        index.write(b"\x01\x02\x03")  # A record cut short by a crash
+    reloaded = Recorder(recorder.camera, tmp_path)
+    reloaded._load_index()
+    assert recorder.index_path.stat().st_size % RECORD.size == 0
+    # Only keyframes are indexed, so the reloaded end of a segment is its last keyframe
+    assert [(s.seq, s.start, s.size) for s in reloaded.segments] == [(s.seq, s.start, s.size) for s in recorder.segments]
+    assert reloaded.clip_ranges(1001.5, 1002.5) == recorder.clip_ranges(1001.5, 1002.5)
+
+
+@pytest.mark.asyncio
+async def test_retention_deletes_the_oldest_segments(tmp_path, clock):
+    recorder = await record(tmp_path, clock, gops=10, segment_bytes=500, max_bytes=1500)
+    assert recorder.segments[0].seq > 0
+    assert recorder.total_bytes <= 1500 + recorder.segments[-1].size
+    kept = {segment_name(segment.seq) for segment in recorder.segments}
+    assert {path.name for path in tmp_path.glob("*.h264")} == kept
+    assert recorder.clip_ranges(1000.0, 1001.0) == recorder.clip_ranges(recorder.segments[0].start, 1001.0)
+
+
+@pytest.mark.asyncio
+async def test_clips_after_the_index_is_compacted(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(recorder_module, "COMPACT_MIN_RECORDS", 4)
+    recorder = await record(tmp_path, clock, gops=20, segment_bytes=500, max_bytes=1500)
+    first_live = recorder.segments[0].first_record
+    # Deleted segments' records were dropped from the file
+    assert recorder.index_path.stat().st_size < recorder._records * RECORD.size
+    assert recorder.index_path.stat().st_size >= (recorder._records - first_live) * RECORD.size
+    # Record numbers still map onto the compacted file, for the oldest kept segment and the newest
+    for segment in (recorder.segments[0], recorder.segments[-1]):
+        ranges = recorder.clip_ranges(segment.start, segment.start + 0.5)
+        assert ranges[0].seq == segment.seq
+        assert ranges[0].start == 0
+        clip = b"".join(recorder.read_clip(ranges))
+        assert clip.startswith(SPS + PPS + b"\x00\x00\x01\x65")
+
+
+@pytest.mark.asyncio
+async def test_a_segment_that_cannot_be_created_is_skipped(tmp_path, clock, caplog):
+    (tmp_path / segment_name(1)).mkdir()  # Opening it for writing fails
+    recorder = await record(tmp_path, clock, gops=6, segment_bytes=500, max_bytes=None)
+    assert [record.levelname for record in caplog.records].count("ERROR") == 1
+    # Nothing was indexed for the missing segment, and the next one records normally
+    seqs = {seq for _, seq, _ in RECORD.iter_unpack(recorder.index_path.read_bytes())}
+    assert seqs == {0, 2}
+    data = (tmp_path / segment_name(2)).read_bytes()
+    assert data.startswith(SPS + PPS + b"\x00\x00\x01\x65")
+    start = recorder.segments[2].start
+    clip = b"".join(recorder.read_clip(recorder.clip_ranges(start, start + 0.5)))
+    assert clip and data.startswith(clip)
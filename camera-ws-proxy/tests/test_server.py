@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from src.config import Config
+from src.server import CameraServer
+
+
+class FakeTranscoder:
+    def __init__(self):
+        self.is_running = True
+
+    async def stop(self) -> None:
+        self.is_running = False
+
+
+class FakeHub:
+    """A running WebSocket hub; stopping it ends its viewers, which then ask for the replacement"""
+
+    format = "h264"
+
+    def __init__(self, server: CameraServer, camera_id: str):
+        self.server = server
+        self.camera_id = camera_id
+        self.viewer = None
+
+    async def stop(self) -> None:
+        self.viewer = asyncio.create_task(self.server.replacement_hub(self.camera_id, self))
+
+
+def config(port: int, **camera) -> Config:
+    return Config.model_validate({"cameras": {"cam": {
+        "name": "Cam", "ip_address": "127.0.0.1", "port": port, "ws_format": "h264", **camera
+    }}})
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "static").mkdir()
+    server = CameraServer(config(8000))
+    started = []
+
+    async def start_hls_output(camera_id: str) -> bool:
+        # What the HLS would be built from at this point
+        started.append(server.config.cameras[camera_id])
+        return True
+
+    monkeypatch.setattr(server, "start_hls_output", start_hls_output)
+    server.started_hls = started
+    return server
+
+
+@pytest.mark.asyncio
+async def test_reconnecting_change_restarts_hls_and_moves_viewers(server):
+    server.transcoders["cam"] = FakeTranscoder()
+    hub = FakeHub(server, "cam")
+    server.hubs["cam"] = hub
+    await server.apply_config(config(9000))
+    assert [camera.port for camera in server.started_hls] == [9000]
+    replacement = await hub.viewer
+    assert replacement is not None and replacement is not hub
+    assert replacement.format == "h264"
+    assert replacement.config.port == 9000
+
+
+@pytest.mark.asyncio
+async def test_stopped_outputs_stay_stopped(server):
+    stopped = FakeTranscoder()
+    stopped.is_running = False
+    server.transcoders["cam"] = stopped
+    await server.apply_config(config(9000))
+    assert server.started_hls == []
+    assert "cam" not in server.hubs
+
+
+@pytest.mark.asyncio
+async def test_viewers_leave_when_the_format_changes(server):
+    hub = FakeHub(server, "cam")
+    server.hubs["cam"] = hub
+    await server.apply_config(config(9000, ws_format="fmp4"))
+    assert await hub.viewer is None
+
+
+@pytest.mark.asyncio
+async def test_viewers_leave_when_the_camera_is_removed(server):
+    hub = FakeHub(server, "cam")
+    server.hubs["cam"] = hub
+    await server.apply_config(Config(cameras={}))
+    assert await hub.viewer is None
@@ -0,0 +1,102 @@
+import asyncio
+from typing import List, Optional
+
+import pytest
+
+from src import transcoder as transcoder_module
+from src.config import CameraConfig
+from src.transcoder import STABLE_RUN_SECONDS, TranscoderLimitError, TranscoderSupervisor
+
+
+class FakeCamera:
+    def __init__(self, camera_id: str = "cam"):
+        self.config = CameraConfig(id=camera_id, name=camera_id, ip_address="127.0.0.1", port=0)
+
+
+class Runs:
+    """Stands in for FFmpeg and the clock: each run takes the next duration, then exits or raises"""
+
+    def __init__(self, monkeypatch, *outcomes, restarts: int = 5):
+        self.outcomes = list(outcomes)
+        self.now = 0.0
+        self.delays: List[float] = []
+        self.restarts = restarts
+        real_sleep = asyncio.sleep
+
+        async def sleep(delay: float) -> None:
+            self.delays.append(delay)
+            if len(self.delays) == self.restarts:
+                raise asyncio.CancelledError
+            await real_sleep(0)
+
+        monkeypatch.setattr(transcoder_module.asyncio, "sleep", sleep)
+        monkeypatch.setattr(transcoder_module.time, "monotonic", lambda: self.now)
+
+    async def run(self) -> int:
+        duration, outcome = self.outcomes.pop(0) if self.outcomes else (0.0, 1)
+        self.now += duration
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def supervised(monkeypatch, runs: Runs, supervisor: Optional[TranscoderSupervisor] = None, **kwargs):
+    supervisor = supervisor or TranscoderSupervisor()
+    transcoder = supervisor.create("test", FakeCamera(), lambda: ["ffmpeg"], **kwargs)
+    monkeypatch.setattr(transcoder, "_run_placed", runs.run)
+    return transcoder
+
+
+async def finish(transcoder) -> None:
+    """Wait until the fake sleep ends supervision after the last expected restart"""
+    with pytest.raises(asyncio.CancelledError):
+        await transcoder._task
+
+
+@pytest.mark.asyncio
+async def test_restart_delay_doubles_up_to_the_maximum(monkeypatch):
+    runs = Runs(monkeypatch)
+    transcoder = supervised(monkeypatch, runs, restart_min=1.0, restart_max=8.0)
+    transcoder.start()
+    await finish(transcoder)
+    assert runs.delays == [1.0, 2.0, 4.0, 8.0, 8.0]
+    assert transcoder.restarts == 5
+
+
+@pytest.mark.asyncio
+async def test_a_stable_run_resets_the_backoff(monkeypatch):
+    long_run = STABLE_RUN_SECONDS + 1
+    runs = Runs(monkeypatch, (0.0, 1), (0.0, 1), (0.0, 1), (long_run, 0), (0.0, 1))
+    transcoder = supervised(monkeypatch, runs, restart_min=1.0, restart_max=30.0)
+    transcoder.start()
+    await finish(transcoder)
+    assert runs.delays == [1.0, 2.0, 4.0, 1.0, 2.0]
+
+
+@pytest.mark.asyncio
+async def test_failures_to_start_are_retried_and_keep_the_slot(monkeypatch):
+    runs = Runs(monkeypatch, (0.0, OSError("no ffmpeg")), (0.0, ValueError("bad command")), restarts=3)
+    supervisor = TranscoderSupervisor(max_processes=1)
+    transcoder = supervised(monkeypatch, runs, supervisor, restart_min=1.0)
+    transcoder.start()
+    await finish(transcoder)
+    assert runs.delays == [1.0, 2.0, 4.0]
+    assert supervisor.transcoders == [transcoder]
+    await transcoder.stop()
+    assert supervisor.transcoders == []
+
+
+@pytest.mark.asyncio
+async def test_stop_ends_supervision_and_frees_the_slot(monkeypatch):
+    runs = Runs(monkeypatch, restarts=100)
+    supervisor = TranscoderSupervisor(max_processes=1)
+    first = supervised(monkeypatch, runs, supervisor)
+    first.start()
+    with pytest.raises(TranscoderLimitError):
+        supervised(monkeypatch, runs, supervisor).start()
+    await first.stop()
+    assert not first.is_running
+    second = supervised(monkeypatch, runs, supervisor)
+    second.start()
+    assert supervisor.transcoders == [second]
+    await second.stop()
@@ -0,0 +1,55 @@
+"use client";
+
+import { useEffect, useState } from "react";
+import { Camera, CameraService } from "../services/CameraService";
+
+interface CameraSnapshotProps {
+  camera: Camera;
+  refreshSeconds?: number;
+}
+
+export default function CameraSnapshot({
+  camera,
+  refreshSeconds = 5,
+}: CameraSnapshotProps) {
+  const [tick, setTick] = useState(Date.now());
+  const [failed, setFailed] = useState(false);
+
+  useEffect(() => {
+    if (!camera.enabled) {
+      return;
+    }
+    // The proxy answers from its cached keyframe, so polling a grid of these is cheap
+    const interval = setInterval(() => {
+      setTick(Date.now());
+      setFailed(false); // Try again; the camera may be back
+    }, refreshSeconds * 1000);
+    return () => clearInterval(interval);
+  }, [camera.enabled, refreshSeconds]);
+
+  return (
+    <div className="bg-white rounded-lg shadow overflow-hidden">
+      <div className="relative aspect-video bg-gray-900">
+        {camera.enabled && !failed ? (
+          // eslint-disable-next-line @next/next/no-img-element
+          <img
+            src={`${CameraService.getSnapshotUrl(camera.id)}?t=${tick}`}
+            alt={`${camera.name} preview`}
+            className="w-full h-full object-cover"
+            onError={() => setFailed(true)}
+          />
+        ) : (
+          <div className="absolute inset-0 flex items-center justify-center text-gray-400 text-sm">
+            {camera.enabled ? "No preview available" : "Camera is disabled"}
+          </div>
+        )}
+      </div>
+      <div className="px-4 py-3">
+        <h3 className="font-semibold">{camera.name}</h3>
+        {camera.location && (
+          <p className="text-sm text-gray-500">{camera.location}</p>
+        )}
+      </div>
+    </div>
+  );
+}
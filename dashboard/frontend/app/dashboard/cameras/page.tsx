@@ -3,6 +3,7 @@
 import { useEffect, useState } from "react";
 import { Camera, CameraService } from "@/app/services/CameraService";
 import CameraStream, { StreamStatus } from "@/app/components/CameraStream";
+import CameraSnapshot from "@/app/components/CameraSnapshot";
 
 export default function CamerasPage() {
   const [cameras, setCameras] = useState<Camera[]>([]);
@@ -112,6 +113,9 @@ export default function CamerasPage() {
       </div>
 
       <div className="grid grid-cols-1 md:grid-cols-2 gap-6">
+        {cameras.map(camera => (
+          <CameraSnapshot key={camera.id} camera={camera} />
+        ))}
         {/* {cameras.map(camera => (
           <CameraStream
             key={camera.id}
@@ -36,4 +36,8 @@ export const CameraService = {
   getStreamUrl(cameraId: string): string {
     return `wss://camerawsproxy.internal.com/stream/${cameraId}`;
   },
+
+  getSnapshotUrl(cameraId: string): string {
+    return `${API_BASE_URL}/cameras/${cameraId}/snapshot.jpg`;
+  },
 };